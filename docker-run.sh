@@ -1,6 +1,16 @@
 #!/bin/sh
 
-python manage.py makemigrations
-python manage.py migrate
+# Migrations are generated when the image is built; only apply them here, which
+# RUN_MIGRATIONS=0 skips for containers that start after the schema is in place.
+if [ "${RUN_MIGRATIONS:-1}" = "1" ]; then
+    python manage.py migrate --no-input
+fi
 
-exec gunicorn order_management.wsgi:application --bind 0.0.0.0:8000
+# SERVER_MODE=asgi serves the order, product and promotion listings with async views
+if [ "$SERVER_MODE" = "asgi" ]; then
+    exec gunicorn order_management.asgi:application --bind 0.0.0.0:8000 -k uvicorn.workers.UvicornWorker
+fi
+
+# sync workers, one request each at a time; PASSWORD_HASHING_CONCURRENCY plus
+# PASSWORD_HASHING_QUEUE_SIZE must stay below their number
+exec gunicorn order_management.wsgi:application --bind 0.0.0.0:8000 --workers "${WEB_CONCURRENCY:-4}"
@@ -0,0 +1,29 @@
+"""
+OpenAPI schema and Swagger UI, served when settings.API_DOCS is on.
+
+drf_yasg and the schema generator are only imported by the first request for
+the docs, so that workers boot without them.
+"""
+from functools import cache
+
+from rest_framework.permissions import AllowAny
+
+
+@cache
+def schema_view():
+    from drf_yasg import openapi
+    from drf_yasg.views import get_schema_view
+
+    return get_schema_view(
+        openapi.Info(title="Order management API", default_version="v1"),
+        public=True,
+        permission_classes=[AllowAny],
+    )
+
+
+def swagger_ui(request, *args, **kwargs):
+    return schema_view().with_ui('swagger', cache_timeout=0)(request, *args, **kwargs)
+
+
+def schema(request, *args, **kwargs):
+    return schema_view().without_ui(cache_timeout=0)(request, *args, **kwargs)
@@ -2,6 +2,8 @@
 ASGI config for order_management project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+It serves the order, product and promotion listings with async views, see
+order_management/asgi_urls.py.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -11,6 +13,6 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "order_management.settings")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "order_management.settings_asgi")
 
 application = get_asgi_application()
@@ -0,0 +1,17 @@
+"""
+URL configuration of the ASGI entry point: the same API as order_management.urls,
+with the order, product and promotion listings served by async views.
+"""
+
+from django.urls import path
+
+from orders import async_views
+
+from .urls import urlpatterns as wsgi_urlpatterns
+
+
+urlpatterns = [
+    path('products/', async_views.AsyncProductView.as_view(), name='product_list_create'),
+    path('promotions/', async_views.AsyncPromotionView.as_view(), name='promotion_list_create'),
+    path('orders/', async_views.AsyncOrderView.as_view(), name='order_list_create'),
+] + wsgi_urlpatterns
@@ -0,0 +1,142 @@
+"""
+Read replica routing.
+
+ReplicaRoutingMiddleware sends the reads of GET, HEAD and OPTIONS requests to
+one of settings.DATABASE_REPLICAS, picked per request; everything else, and
+any code running outside a request (management commands, the outbox worker),
+uses the primary. After a user's write request, their reads stay on the
+primary for settings.READ_YOUR_WRITES_SECONDS, so that they see their own
+changes even while the replicas lag behind. These pins are kept in
+settings.READ_YOUR_WRITES_FILE, shared by the workers of the host, rather than
+in the file-based cache, which would cull them at random once full.
+
+Data that is cached under a version stamp (listings, per-worker indexes) is
+read with `use_primary()`, as a lagging replica would otherwise get stale rows
+cached under the new version.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.state import token_backend
+
+from .shared_state import SharedState
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# {user id: time their reads may go back to the replicas}
+pins = SharedState('READ_YOUR_WRITES_FILE')
+
+_read_alias = ContextVar('read_alias', default=None)
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside the block, whatever the current request was routed to."""
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def token_user_id(request):
+    # The claims are not verified here: they only decide where the reads go, and
+    # the view still authenticates the request.
+    header = request.headers.get('Authorization', '').split()
+    if len(header) != 2 or header[0] not in api_settings.AUTH_HEADER_TYPES:
+        return None
+    try:
+        claims = token_backend.decode(header[1], verify=False)
+    except TokenBackendError:
+        return None
+    return claims.get(api_settings.USER_ID_CLAIM)
+
+
+def is_pinned(user_id):
+    return pins.read().get(str(user_id), 0) > time.time()
+
+
+def pin(user_id):
+    if settings.READ_YOUR_WRITES_SECONDS <= 0:
+        return
+    with pins.update() as state:
+        now = time.time()
+        # only the pins still in force are kept
+        for key, until in list(state.items()):
+            if until <= now:
+                del state[key]
+        state[str(user_id)] = now + settings.READ_YOUR_WRITES_SECONDS
+
+
+def read_alias(request):
+    """The replica to read from for `request`, or None for the primary."""
+    if not settings.DATABASE_REPLICAS or request.method not in SAFE_METHODS:
+        return None
+    user_id = token_user_id(request)
+    if user_id is not None and is_pinned(user_id):
+        return None
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        token = _read_alias.set(read_alias(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        self.pin_writer(request, response)
+        return response
+
+    async def __acall__(self, request):
+        token = _read_alias.set(await sync_to_async(read_alias)(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        await sync_to_async(self.pin_writer)(request, response)
+        return response
+
+    def pin_writer(self, request, response):
+        # Requests are matched to their user by the bearer token, like in read_alias()
+        if not settings.DATABASE_REPLICAS or request.method in SAFE_METHODS or response.status_code >= 400:
+            return
+        user_id = token_user_id(request)
+        if user_id is not None:
+            pin(user_id)
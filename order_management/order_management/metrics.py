@@ -0,0 +1,262 @@
+"""
+Per-request timing and SQL metrics.
+
+RequestMetricsMiddleware records, for every view, the request duration, query
+count and database time, plus the phases timed with `timer()` (authentication,
+validation, lock waits, pricing, serialization). They are returned to the client
+as a Server-Timing header and aggregated into per-worker histograms, which each
+worker periodically publishes to the shared cache so that /metrics can report
+all workers of the host at once.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+PREFIX = 'order_management'
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+WORKERS_KEY = 'metrics:workers'
+WORKER_KEY = 'metrics:worker:{pid}'
+WORKER_TTL = 600
+
+HISTOGRAMS = {
+    'request_duration_seconds': ('Time spent handling the request.', DURATION_BUCKETS),
+    'db_queries': ('Number of SQL queries per request.', QUERY_BUCKETS),
+    'db_duration_seconds': ('Time spent executing SQL per request.', DURATION_BUCKETS),
+    'phase_duration_seconds': ('Time spent per request in auth, validation, lock_wait, pricing and serialization.', DURATION_BUCKETS),
+    'password_hashing_queue_seconds': ('Time a password hash waited for the hashing pool.', DURATION_BUCKETS),
+}
+
+COUNTERS = {
+    'admission_rejections': 'Orders turned away by admission control, by the limit they were over.',
+    'password_hashing_rejections': 'Password hashes refused because the hashing pool and its queue were full.',
+}
+
+_measurement = ContextVar('request_measurement', default=None)
+
+
+@contextmanager
+def timer(phase):
+    """Add the time spent in the block to `phase` of the current request, if it is being measured."""
+    measurement = _measurement.get()
+    if measurement is None:
+        yield
+        return
+    timings = measurement.timings
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0) + time.perf_counter() - started
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (metric, labels) -> [bucket counts..., sum, count]
+        self._histograms = {}
+        # labels -> count
+        self._requests = {}
+        # (metric, labels) -> count
+        self._counters = {}
+        self.flushed_at = 0
+
+    def observe(self, metric, labels, value):
+        buckets = HISTOGRAMS[metric][1]
+        with self._lock:
+            histogram = self._histograms.get((metric, labels))
+            if histogram is None:
+                histogram = self._histograms[(metric, labels)] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def count_request(self, labels):
+        with self._lock:
+            self._requests[labels] = self._requests.get(labels, 0) + 1
+
+    def increment(self, metric, labels):
+        with self._lock:
+            self._counters[(metric, labels)] = self._counters.get((metric, labels), 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'histograms': {key: list(values) for key, values in self._histograms.items()},
+                'requests': dict(self._requests),
+                'counters': dict(self._counters),
+            }
+
+    def flush(self):
+        self.flushed_at = time.monotonic()
+        pid = os.getpid()
+        cache.set(WORKER_KEY.format(pid=pid), self.snapshot(), timeout=WORKER_TTL)
+        workers = cache.get(WORKERS_KEY) or set()
+        if pid not in workers:
+            cache.set(WORKERS_KEY, workers | {pid}, timeout=None)
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed_at >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+
+registry = Registry()
+
+
+def merged_snapshot():
+    registry.flush()
+    workers = cache.get(WORKERS_KEY) or set()
+    snapshots = cache.get_many([WORKER_KEY.format(pid=pid) for pid in workers]).values()
+
+    histograms, requests, counters = {}, {}, {}
+    for snapshot in snapshots:
+        for key, values in snapshot['histograms'].items():
+            merged = histograms.setdefault(key, [0] * len(values))
+            histograms[key] = [a + b for a, b in zip(merged, values)]
+        for labels, count in snapshot['requests'].items():
+            requests[labels] = requests.get(labels, 0) + count
+        for key, count in snapshot.get('counters', {}).items():
+            counters[key] = counters.get(key, 0) + count
+    return histograms, requests, counters
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+def render_prometheus(histograms, requests, counters):
+    lines = [
+        f'# HELP {PREFIX}_requests_total Requests handled, by view and status code.',
+        f'# TYPE {PREFIX}_requests_total counter',
+    ]
+    for labels, count in sorted(requests.items()):
+        lines.append(f'{PREFIX}_requests_total{format_labels(labels)} {count}')
+
+    for metric, help_text in COUNTERS.items():
+        name = f'{PREFIX}_{metric}_total'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for (key, labels), count in sorted(counters.items()):
+            if key == metric:
+                lines.append(f'{name}{format_labels(labels)} {count}')
+
+    for metric, (help_text, buckets) in HISTOGRAMS.items():
+        name = f'{PREFIX}_{metric}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for (key, labels), values in sorted(histograms.items()):
+            if key != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, values):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels, le="+Inf")} {values[-1]}')
+            lines.append(f'{name}_sum{format_labels(labels)} {values[-2]}')
+            lines.append(f'{name}_count{format_labels(labels)} {values[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+class Measurement:
+
+    def __init__(self):
+        self.timings = {}
+        self.queries = 0
+        self.db_duration = 0.0
+        self.duration = 0.0
+
+
+def measure_query(execute, sql, params, many, context):
+    # Counted for the request of the current context: the async ORM runs queries
+    # on another thread, with its own connections, but with the request's context.
+    measurement = _measurement.get()
+    if measurement is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        measurement.queries += 1
+        measurement.db_duration += time.perf_counter() - started
+
+
+def install_query_measurement(connection, **kwargs):
+    if measure_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(measure_query)
+
+
+# every connection, of any thread, once it connects
+connection_created.connect(install_query_measurement)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        with self.measure() as measurement:
+            response = self.get_response(request)
+        return self.record(request, response, measurement)
+
+    async def __acall__(self, request):
+        with self.measure() as measurement:
+            response = await self.get_response(request)
+        return self.record(request, response, measurement)
+
+    @contextmanager
+    def measure(self):
+        # connections of this thread that were opened before the signal was connected
+        for connection in connections.all(initialized_only=True):
+            install_query_measurement(connection)
+
+        measurement = Measurement()
+        token = _measurement.set(measurement)
+        started = time.perf_counter()
+        try:
+            yield measurement
+        finally:
+            _measurement.reset(token)
+            measurement.duration = time.perf_counter() - started
+
+    def record(self, request, response, measurement):
+        match = request.resolver_match
+        view = (('view', match.view_name if match else 'unmatched'),)
+        registry.count_request(view + (('status', response.status_code),))
+        registry.observe('request_duration_seconds', view, measurement.duration)
+        registry.observe('db_queries', view, measurement.queries)
+        registry.observe('db_duration_seconds', view, measurement.db_duration)
+        for phase, elapsed in measurement.timings.items():
+            registry.observe('phase_duration_seconds', view + (('phase', phase),), elapsed)
+        registry.maybe_flush()
+
+        server_timing = [f'db;dur={measurement.db_duration * 1000:.2f};desc="{measurement.queries} queries"']
+        server_timing += [f'{phase};dur={elapsed * 1000:.2f}' for phase, elapsed in measurement.timings.items()]
+        server_timing.append(f'total;dur={measurement.duration * 1000:.2f}')
+        response['Server-Timing'] = ', '.join(server_timing)
+        return response
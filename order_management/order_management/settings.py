@@ -46,10 +46,17 @@ INSTALLED_APPS = [
     "rest_framework_simplejwt", 
     "users", 
     "orders",
-    'drf_yasg',
 ]
 
+# API documentation with drf_yasg at /swagger/ (UI) and /swagger.json, off by default so
+# that workers boot without it; the schema generator is only loaded by the first request
+API_DOCS = os.getenv('API_DOCS', '0') == '1'
+if API_DOCS:
+    INSTALLED_APPS.append('drf_yasg')
+
 MIDDLEWARE = [
+    "order_management.metrics.RequestMetricsMiddleware",
+    "order_management.db_routing.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -94,12 +101,46 @@ DATABASES = {
     }
 }
 
+# Read replicas for GET requests, e.g. DB_REPLICA_HOSTS=replica1,replica2. Pointing one at
+# the primary's own host gives a second alias to try the routing locally.
+DATABASE_REPLICAS = []
+for i, host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica{i}'] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'USER': os.getenv('DB_REPLICA_USER', DATABASES['default']['USER']),
+        'PASSWORD': os.getenv('DB_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{i}')
+
+DATABASE_ROUTERS = ['order_management.db_routing.ReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they changed something
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
+# users pinned to the primary, shared by the host's workers and written under an flock
+READ_YOUR_WRITES_FILE = os.getenv('READ_YOUR_WRITES_FILE', '/tmp/order_management_pins.json')
+
+# Shared by all gunicorn workers on the host, e.g. for the promotion index version stamp
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', '/tmp/order_management_cache'),
+    }
+}
+
+# Listings built at once per worker by the async views of the ASGI entry point
+ASYNC_READ_CONCURRENCY = int(os.getenv('ASYNC_READ_CONCURRENCY', 32))
+
+# Seconds a cached product or promotion listing is kept; changes invalidate it right away
+RESPONSE_CACHE_TIMEOUT = 300
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.TimedJWTAuthentication',
     ),
 }
 
@@ -111,6 +152,57 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_LIFETIME_LATE_USER': timedelta(days=30),
 }
 
+# Authenticated users are cached per worker for up to USER_CACHE_TTL seconds (0 disables
+# the cache), which is also how long a deactivation can take to reach every worker
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 30))
+USER_CACHE_MAX_SIZE = 10000
+
+# How OrderView reserves stock: 'locking' takes row locks with select_for_update,
+# 'conditional' uses lock-free UPDATE ... WHERE stock >= quantity for hot products.
+ORDER_INVENTORY_MODE = os.getenv('ORDER_INVENTORY_MODE', 'locking')
+
+# Admission control of POST /orders/, shared by the workers of the host: token buckets (orders
+# per second and burst) for all users together and per user, and the orders in flight at once
+# per product. Orders over a limit get a 429 right away; 0 turns a limit off.
+ORDER_ADMISSION_RATE = float(os.getenv('ORDER_ADMISSION_RATE', 200))
+ORDER_ADMISSION_BURST = int(os.getenv('ORDER_ADMISSION_BURST', 400))
+ORDER_ADMISSION_USER_RATE = float(os.getenv('ORDER_ADMISSION_USER_RATE', 5))
+ORDER_ADMISSION_USER_BURST = int(os.getenv('ORDER_ADMISSION_USER_BURST', 20))
+ORDER_ADMISSION_MAX_IN_FLIGHT_PER_PRODUCT = int(os.getenv('ORDER_ADMISSION_MAX_IN_FLIGHT_PER_PRODUCT', 16))
+# shared admission state of the host's workers, written under an flock
+ADMISSION_STATE_FILE = os.getenv('ADMISSION_STATE_FILE', '/tmp/order_management_admission.json')
+
+# process_outbox: seconds a claimed event is reserved for its worker, attempts before an
+# event is marked failed, and the retry delay, doubling from the base up to the maximum
+OUTBOX_LEASE_SECONDS = 300
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_RETRY_BASE_DELAY = 5
+OUTBOX_RETRY_MAX_DELAY = 3600
+
+# archive_orders moves delivered and canceled orders older than this many days to the order archive
+ORDER_ARCHIVE_AFTER_DAYS = int(os.getenv('ORDER_ARCHIVE_AFTER_DAYS', 365))
+
+# How often (seconds) each worker publishes its request metrics for /metrics
+METRICS_FLUSH_INTERVAL = 5
+
+# Passwords are hashed by at most PASSWORD_HASHING_CONCURRENCY workers of the host at once, with
+# up to PASSWORD_HASHING_QUEUE_SIZE more waiting; further logins and registrations get a 503 right
+# away. Together they must stay below the number of gunicorn workers (WEB_CONCURRENCY, see
+# docker-run.sh), so that a login burst always leaves workers to place orders.
+PASSWORD_HASHING_CONCURRENCY = int(os.getenv('PASSWORD_HASHING_CONCURRENCY', 2))
+PASSWORD_HASHING_QUEUE_SIZE = int(os.getenv('PASSWORD_HASHING_QUEUE_SIZE', 1))
+PASSWORD_HASHING_LOCK_DIR = os.getenv('PASSWORD_HASHING_LOCK_DIR', '/tmp/order_management_password_hashing')
+# PBKDF2 iterations (Django 5.1's default, at least 600000); a login re-hashes passwords hashed differently
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', 870_000))
+
+PASSWORD_HASHERS = [
+    'users.hashing.BoundedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
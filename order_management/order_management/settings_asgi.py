@@ -0,0 +1,8 @@
+"""
+Settings for the ASGI entry point (order_management/asgi.py).
+"""
+
+from .settings import *  # noqa: F401,F403
+
+
+ROOT_URLCONF = "order_management.asgi_urls"
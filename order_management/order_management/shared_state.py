@@ -0,0 +1,71 @@
+"""
+State shared by the workers of the host in a JSON file.
+
+Unlike the file-based cache, which culls entries at random once it holds
+MAX_ENTRIES of them, a SharedState keeps everything written to it until its
+users drop it, so it suits small, hot state that must not vanish: admission
+buckets and read-your-writes pins. Updates are serialized across workers with
+an flock of the file.
+"""
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+class SharedState:
+
+    def __init__(self, setting):
+        # the name of the setting holding the file's path
+        self.setting = setting
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _open(self):
+        path = getattr(settings, self.setting)
+        # opened per process: a descriptor inherited over fork would share the lock with the parent
+        if self._file is None or self._file[:2] != (os.getpid(), path):
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._file = (os.getpid(), path, os.fdopen(fd, 'r+'))
+        return self._file[2]
+
+    def _read(self, file):
+        file.seek(0)
+        content = file.read()
+        return json.loads(content) if content else {}
+
+    def read(self):
+        """A snapshot of the state."""
+        with self._lock:
+            file = self._open()
+            fcntl.flock(file.fileno(), fcntl.LOCK_SH)
+            try:
+                return self._read(file)
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def update(self):
+        """
+        The state, locked for the block and written back when it completes; an
+        exception leaves it unchanged.
+        """
+        with self._lock:
+            file = self._open()
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                state = self._read(file)
+                yield state
+                file.seek(0)
+                file.truncate()
+                file.write(json.dumps(state, separators=(',', ':')))
+                file.flush()
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+    def clear(self):
+        with self.update() as state:
+            state.clear()
@@ -0,0 +1,114 @@
+"""
+Worker boot profiling.
+
+measure_startup() boots the project in a fresh interpreter, the way a new
+gunicorn worker does (settings, app registry, WSGI handler and URLconf), under
+`python -X importtime`, and reports how long each phase, each app's ready()
+and each imported module took. Run as `python -m order_management.startup`,
+this module is that child process and prints its timings as JSON.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+def boot():
+    """Boot the project like a worker and return its timings in seconds."""
+    started = time.perf_counter()
+
+    from django.apps import AppConfig
+    from django.conf import settings
+
+    settings.INSTALLED_APPS
+    settings_loaded = time.perf_counter()
+
+    # every app's models are imported before any ready() runs, so wrap ready() then
+    ready_seconds = {}
+    import_models = AppConfig.import_models
+
+    def timed_import_models(app_config):
+        import_models(app_config)
+        ready = app_config.ready
+
+        def timed_ready():
+            ready_started = time.perf_counter()
+            ready()
+            ready_seconds[app_config.label] = time.perf_counter() - ready_started
+
+        app_config.ready = timed_ready
+
+    AppConfig.import_models = timed_import_models
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+    AppConfig.import_models = import_models
+    apps_ready = time.perf_counter()
+
+    # the URLconf, and with it every view, is otherwise imported by the first request
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    urls_loaded = time.perf_counter()
+
+    assert application is not None
+    return {
+        'settings_seconds': settings_loaded - started,
+        'apps_seconds': apps_ready - settings_loaded,
+        'ready_seconds': ready_seconds,
+        'urls_seconds': urls_loaded - apps_ready,
+        'boot_seconds': urls_loaded - started,
+    }
+
+
+def parse_importtime(lines):
+    """{module: (self seconds, cumulative seconds)} and the top-level imports, from -X importtime output."""
+    modules, top_level = {}, []
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        module = name.strip()
+        modules[module] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+        if not name[1:].startswith(' '):
+            top_level.append(module)
+    return modules, top_level
+
+
+def measure_startup(settings_module=None):
+    """Boot the project in a child interpreter and return its timings and imports."""
+    env = dict(os.environ)
+    if settings_module:
+        env['DJANGO_SETTINGS_MODULE'] = settings_module
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'order_management.settings')
+
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'order_management.startup'],
+        cwd=PROJECT_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    process_seconds = time.perf_counter() - started
+
+    modules, top_level = parse_importtime(result.stderr.splitlines())
+    packages = {}
+    for module, (self_seconds, cumulative_seconds) in modules.items():
+        package = module.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_seconds
+
+    return {
+        **json.loads(result.stdout.splitlines()[-1]),
+        'process_seconds': process_seconds,
+        'import_seconds': sum(self_seconds for self_seconds, cumulative_seconds in modules.values()),
+        'modules': modules,
+        'top_level': top_level,
+        'packages': packages,
+    }
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, str(PROJECT_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'order_management.settings')
+    print(json.dumps(boot()))
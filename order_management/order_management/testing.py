@@ -0,0 +1,30 @@
+"""
+Query budgets, shared by the tests of the apps: an endpoint answers with at
+most its budget of queries, and with as many however much data there is.
+"""
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+
+def query_counts(sizes, prepare):
+    """
+    The queries of the request returned by `prepare(size)`, which adds `size`
+    more rows first, for each of `sizes`; streamed responses are read to the end.
+    """
+    counts = []
+    for size in sizes:
+        send = prepare(size)
+        with CaptureQueriesContext(connection) as queries:
+            response = send()
+            if response.streaming:
+                b''.join(response.streaming_content)
+        assert status.is_success(response.status_code), getattr(response, 'data', response.content)
+        counts.append(len(queries))
+    return counts
+
+
+def assert_query_budget(budget, sizes, prepare):
+    counts = query_counts(sizes, prepare)
+    assert max(counts) <= budget, counts
+    assert len(set(counts)) == 1, counts
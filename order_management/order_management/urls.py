@@ -15,12 +15,23 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
+
+from . import api_docs
+from .views import MetricsView
 
 
 urlpatterns = [
     path("admin/", admin.site.urls),  
+    path("metrics", MetricsView.as_view(), name="metrics"),
     path('', include('users.urls')),
     path('', include('orders.urls')),
 ]
+
+if settings.API_DOCS:
+    urlpatterns += [
+        path('swagger/', api_docs.swagger_ui, name='schema_swagger_ui'),
+        re_path(r'^swagger\.(?P<format>json|yaml)$', api_docs.schema, name='schema_json'),
+    ]
@@ -0,0 +1,12 @@
+from django.http import HttpResponse
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView
+
+from .metrics import merged_snapshot, render_prometheus
+
+
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render_prometheus(*merged_snapshot()), content_type='text/plain; version=0.0.4')
@@ -1,7 +1,17 @@
 from django.contrib import admin
-from .models import Product, Order, Promotion
+from .models import (
+    Product, Order, OrderItem, Promotion, OutboxEvent, DailySales, DailyProductSales, DailyPromotionSales,
+    OrderArchiveBatch, ArchivedOrder,
+)
 
 # Register your models here. 
 admin.site.register(Product) 
 admin.site.register(Promotion) 
 admin.site.register(Order) 
+admin.site.register(OrderItem) 
+admin.site.register(OutboxEvent)
+admin.site.register(DailySales)
+admin.site.register(DailyProductSales)
+admin.site.register(DailyPromotionSales)
+admin.site.register(OrderArchiveBatch)
+admin.site.register(ArchivedOrder)
\ No newline at end of file
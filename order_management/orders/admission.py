@@ -0,0 +1,139 @@
+"""
+Admission control for order placement.
+
+Before an order is validated, admit() checks three limits shared by all
+workers of the host: a global token bucket, a token bucket per user, and the
+number of orders in flight at once per product. An order over any of them is
+answered right away with 429 and Retry-After instead of queueing behind the
+row locks of the products, and counted in the admission_rejections metric.
+
+The state is one JSON document in settings.ADMISSION_STATE_FILE, read and
+written under an flock of the file, so that updates are serialized across
+workers and no entry is ever evicted. It only holds what still matters: user
+buckets are dropped once they have refilled, and the in-flight counts of
+products once they reach zero or expire.
+"""
+import math
+import time
+
+from django.conf import settings
+from rest_framework.exceptions import Throttled
+
+from order_management.metrics import registry
+from order_management.shared_state import SharedState
+
+
+# Counters of orders in flight expire, so that the slots of a worker that died
+# mid-request are given back eventually.
+IN_FLIGHT_TTL = 60
+
+GLOBAL = 'global'
+USER = 'user'
+PRODUCT = 'product'
+
+# the admission state of the host; an exception in an update, such as a
+# rejection, leaves it unchanged
+shared_state = SharedState('ADMISSION_STATE_FILE')
+
+
+def clear():
+    shared_state.clear()
+
+
+def take_token(state, rate, burst, now):
+    """Refill the bucket `state` (tokens, updated at) and take a token; returns (state, seconds to wait)."""
+    tokens, updated_at = state or (burst, now)
+    tokens = min(burst, tokens + (now - updated_at) * rate)
+    if tokens < 1:
+        return (tokens, now), (1 - tokens) / rate
+    return (tokens - 1, now), 0
+
+
+def cart_product_ids(data):
+    # Read leniently from the raw body, before validation; a malformed cart is
+    # admitted and then rejected by the serializer.
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return []
+    product_ids = set()
+    for item in items:
+        if isinstance(item, dict) and isinstance(item.get('product_id'), int):
+            product_ids.add(item['product_id'])
+    return sorted(product_ids)
+
+
+def reject(reason, wait):
+    registry.increment('admission_rejections', (('reason', reason),))
+    raise Throttled(wait=math.ceil(wait))
+
+
+def expire(state, now, user_rate, user_burst):
+    # a bucket that has refilled is the same as no bucket
+    state['users'] = {
+        user_id: (tokens, updated_at) for user_id, (tokens, updated_at) in state.get('users', {}).items()
+        if user_rate and tokens + (now - updated_at) * user_rate < user_burst
+    }
+    state['in_flight'] = {
+        product_id: (count, expires_at) for product_id, (count, expires_at) in state.get('in_flight', {}).items()
+        if count > 0 and expires_at > now
+    }
+
+
+class Ticket:
+
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+
+    def release(self):
+        if not self.product_ids:
+            return
+        with shared_state.update() as state:
+            in_flight = state.setdefault('in_flight', {})
+            now = time.time()
+            for product_id in self.product_ids:
+                count, expires_at = in_flight.pop(product_id, (0, 0))
+                if count > 1:
+                    in_flight[product_id] = (count - 1, now + IN_FLIGHT_TTL)
+
+
+def admit(user_id, product_ids):
+    """
+    Take the tokens and product slots of an order, or raise Throttled.
+    The returned Ticket must be released once the order is handled.
+    """
+    rate, burst = settings.ORDER_ADMISSION_RATE, settings.ORDER_ADMISSION_BURST
+    user_rate, user_burst = settings.ORDER_ADMISSION_USER_RATE, settings.ORDER_ADMISSION_USER_BURST
+    max_in_flight = settings.ORDER_ADMISSION_MAX_IN_FLIGHT_PER_PRODUCT
+    if not (rate or user_rate or max_in_flight):
+        return Ticket([])
+
+    # JSON object keys
+    user_key = str(user_id)
+    product_keys = [str(product_id) for product_id in product_ids] if max_in_flight else []
+
+    with shared_state.update() as state:
+        now = time.time()
+        expire(state, now, user_rate, user_burst)
+        users, in_flight = state['users'], state['in_flight']
+
+        global_bucket = user_bucket = None
+        if rate:
+            global_bucket, wait = take_token(state.get(GLOBAL), rate, burst, now)
+            if wait:
+                reject(GLOBAL, wait)
+        if user_rate:
+            user_bucket, wait = take_token(users.get(user_key), user_rate, user_burst, now)
+            if wait:
+                reject(USER, wait)
+        for key in product_keys:
+            if in_flight.get(key, (0, 0))[0] >= max_in_flight:
+                reject(PRODUCT, 1)
+
+        # tokens are only taken once the order is admitted
+        if global_bucket:
+            state[GLOBAL] = global_bucket
+        if user_bucket:
+            users[user_key] = user_bucket
+        for key in product_keys:
+            in_flight[key] = (in_flight.get(key, (0, 0))[0] + 1, now + IN_FLIGHT_TTL)
+    return Ticket(product_keys)
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class OrdersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "orders"
+
+    def ready(self):
+        from . import handlers, signals  # noqa: F401
+        from .search import create_trigram_index
+        post_migrate.connect(create_trigram_index, sender=self)
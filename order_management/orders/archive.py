@@ -0,0 +1,156 @@
+"""
+Archival of old orders.
+
+archive_batch() moves up to `batch_size` delivered or canceled orders created
+before a cutoff out of the Order and OrderItem tables: each becomes one
+ArchivedOrder row holding the order and its items as zlib-compressed JSON,
+and the batch is recorded in an OrderArchiveBatch manifest (order count, id
+and creation time range, total price and a checksum of the documents). The
+archive rows are written, the manifest recorded and the orders deleted in one
+transaction, so an order is never in both places or in neither. verify_batch()
+checks the archive against its manifest.
+
+Only orders already counted in the sales rollups are archived, and rollup days
+up to the last archived order are no longer recomputed by rollups.rebuild(),
+which only adds the orders of those days it finds uncounted.
+GET /orders/?archived=true pages through a user's archived orders with the same
+response as the live listing.
+"""
+import hashlib
+import json
+import zlib
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import rendering
+from .models import ArchivedOrder, Order, OrderArchiveBatch, OrderItem
+
+
+ARCHIVED_STATUSES = (Order.DELIVERED, Order.CANCELED)
+ARCHIVE_BATCH_SIZE = 1000
+
+# the columns kept in an archived order's document
+ORDER_FIELDS = ('id', 'user_id', 'status', 'total_price', 'created_at', 'items', 'rolled_up')
+ORDER_ITEM_FIELDS = ('order_id', 'product_id', 'quantity', 'unit_price', 'discount', 'promotion_id')
+
+
+def compress(data):
+    # str() keeps the microseconds of times, and decimals exact
+    return zlib.compress(json.dumps(data, default=str, separators=(',', ':')).encode())
+
+
+def decompress(document):
+    return json.loads(zlib.decompress(document))
+
+
+def checksum(documents):
+    digest = hashlib.sha256()
+    for document in documents:
+        digest.update(bytes(document))
+    return digest.hexdigest()
+
+
+def archivable(cutoff):
+    return Order.objects.filter(status__in=ARCHIVED_STATUSES, created_at__lt=cutoff, rolled_up=True)
+
+
+def order_items(order_ids):
+    """{order id: [the order's OrderItem values, in id order]}"""
+    lines = defaultdict(list)
+    for line in OrderItem.objects.filter(order_id__in=order_ids).order_by('id').values(*ORDER_ITEM_FIELDS):
+        lines[line.pop('order_id')].append(line)
+    return lines
+
+
+def archive_batch(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive the oldest `batch_size` archivable orders; returns their OrderArchiveBatch, or None once none are left."""
+    with transaction.atomic():
+        # orders locked by another archive run are left to it
+        order_ids = list(
+            archivable(cutoff).select_for_update(skip_locked=True).order_by('created_at', 'id').values_list('id', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return None
+
+        orders = list(Order.objects.filter(id__in=order_ids).order_by('id').values(*ORDER_FIELDS))
+        lines = order_items(order_ids)
+        documents = [compress({'order': order, 'order_items': lines.get(order['id'], [])}) for order in orders]
+
+        created = [order['created_at'] for order in orders]
+        batch = OrderArchiveBatch.objects.create(
+            cutoff=cutoff,
+            orders=len(orders),
+            first_order_id=orders[0]['id'],
+            last_order_id=orders[-1]['id'],
+            first_created_at=min(created),
+            last_created_at=max(created),
+            total_price=sum(order['total_price'] for order in orders),
+            checksum=checksum(documents),
+        )
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(
+                id=order['id'], user_id=order['user_id'], status=order['status'], created_at=order['created_at'],
+                batch=batch, document=document,
+            )
+            for order, document in zip(orders, documents)
+        ])
+        # the order items go with their orders
+        Order.objects.filter(id__in=order_ids).delete()
+    return batch
+
+
+def verify_batch(batch):
+    """The ways the archived orders of `batch` differ from its manifest; empty when they match."""
+    rows = list(ArchivedOrder.objects.filter(batch=batch).order_by('id').values_list('id', 'document'))
+    if checksum(document for order_id, document in rows) != batch.checksum:
+        return ["checksum mismatch"]
+
+    orders = [decompress(document)['order'] for order_id, document in rows]
+    problems = []
+    if len(orders) != batch.orders:
+        problems.append(f"{len(orders)} orders archived, {batch.orders} in the manifest")
+    elif orders and (orders[0]['id'], orders[-1]['id']) != (batch.first_order_id, batch.last_order_id):
+        problems.append(f"orders {orders[0]['id']} to {orders[-1]['id']} archived, "
+                        f"{batch.first_order_id} to {batch.last_order_id} in the manifest")
+    created = [parse_datetime(order['created_at']) for order in orders]
+    if created and (min(created) != batch.first_created_at or max(created) != batch.last_created_at):
+        problems.append("orders created outside the manifest's time range")
+    total_price = sum((Decimal(order['total_price']) for order in orders), Decimal(0))
+    if total_price != batch.total_price:
+        problems.append(f"total price {total_price}, {batch.total_price} in the manifest")
+    if Order.objects.filter(id__in=[order_id for order_id, document in rows]).exists():
+        problems.append("orders both archived and live")
+    return problems
+
+
+def archived_orders(user):
+    """values() rows of `user`'s archived orders, in the order of the live listing, for decode_orders()."""
+    return ArchivedOrder.objects.filter(user=user).order_by('id').values('id', 'created_at', 'document')
+
+
+def decode_orders(rows):
+    """The order listing's data for archived_orders() rows, as for the orders before they were archived."""
+    documents = [decompress(row['document']) for row in rows]
+    items = {
+        document['order']['id']: [{'product_id': line['product_id'], 'quantity': line['quantity']} for line in document['order_items']]
+        for document in documents
+    }
+    return rendering.encode_orders([document['order'] for document in documents], items)
+
+
+def archived_through():
+    """The last day, in the current time zone, with archived orders; None before any archive run."""
+    last = OrderArchiveBatch.objects.aggregate(last=Max('last_created_at'))['last']
+    return timezone.localdate(last) if last else None
+
+
+def cutoff_for(days):
+    """Start of the local day `days` days ago."""
+    day = timezone.localdate() - timedelta(days=days)
+    return timezone.make_aware(datetime.combine(day, time.min))
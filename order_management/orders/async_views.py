@@ -0,0 +1,198 @@
+"""
+Async variants of the order, product and promotion listings, served by the ASGI
+entry point (see order_management/asgi_urls.py).
+
+GET requests are answered with the async ORM, so a worker is not tied up while a
+client or the database is slow. Writes and cursor pages are handed to the
+regular DRF views.
+"""
+import asyncio
+import math
+import weakref
+from abc import ABC, abstractmethod
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound, PermissionDenied
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from order_management.metrics import timer
+from users.authentication import TimedJWTAuthentication
+
+from . import rendering
+from .models import Product, Promotion, Order
+from .response_cache import acached_listing
+from .serializers import PromotionSerializer
+from .versions import PRODUCT, PROMOTION
+from .views import (
+    ProductView, PromotionView, OrderView, ProductPagination, PromotionPagination, OrderPagination,
+)
+
+
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def concurrency_limit():
+    # At most settings.ASYNC_READ_CONCURRENCY listings are built at once per event
+    # loop; further requests wait for a slot instead of piling onto the database.
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(settings.ASYNC_READ_CONCURRENCY)
+    return semaphore
+
+
+async def paginate(request, queryset, pagination_class):
+    """Page-number pagination with the parameters and response shape of DRF's PageNumberPagination."""
+    paginator = pagination_class()
+
+    page_size = paginator.page_size
+    try:
+        requested = int(request.GET[paginator.page_size_query_param])
+        if requested > 0:
+            page_size = min(requested, paginator.max_page_size)
+    except (KeyError, ValueError):
+        pass
+
+    count = await queryset.acount()
+    num_pages = max(1, math.ceil(count / page_size))
+    page = request.GET.get(paginator.page_query_param, 1)
+    if page in paginator.last_page_strings:
+        page = num_pages
+    try:
+        page = int(page)
+    except ValueError:
+        raise NotFound("Invalid page.")
+    if not 1 <= page <= num_pages:
+        raise NotFound("Invalid page.")
+
+    results = [obj async for obj in queryset[(page - 1) * page_size:page * page_size]]
+
+    url = request.build_absolute_uri()
+    page_param = paginator.page_query_param
+    next_link = replace_query_param(url, page_param, page + 1) if page < num_pages else None
+    previous_link = None
+    if page > 1:
+        previous_link = remove_query_param(url, page_param) if page == 2 else replace_query_param(url, page_param, page - 1)
+
+    return {'count': count, 'next': next_link, 'previous': previous_link}, results
+
+
+def render(data, status_code=status.HTTP_200_OK, headers=None):
+    return HttpResponse(JSONRenderer().render(data), status=status_code,
+                        content_type='application/json', headers=headers)
+
+
+class AsyncListView(ABC, View):
+    # DRF view that serves writes and cursor pages
+    sync_view = None
+    staff_only = False
+    authentication = TimedJWTAuthentication()
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # authentication is by bearer token, like the DRF views, which are csrf exempt too
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def get(self, request, *args, **kwargs):
+        if request.GET.get('pagination') == 'cursor':
+            return await self.delegate(request, *args, **kwargs)
+
+        async with concurrency_limit():
+            try:
+                user = await self.authenticate(request)
+                return await self.list(request, user)
+            except APIException as exc:
+                headers = None
+                if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+                    headers = {'WWW-Authenticate': self.authentication.authenticate_header(request)}
+                data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                return render(data, exc.status_code, headers)
+
+    async def post(self, request, *args, **kwargs):
+        return await self.delegate(request, *args, **kwargs)
+
+    async def delegate(self, request, *args, **kwargs):
+        return await sync_to_async(self.sync_view)(request, *args, **kwargs)
+
+    async def authenticate(self, request):
+        result = await self.authentication.aauthenticate(request)
+        if result is None:
+            raise NotAuthenticated()
+
+        user = result[0]
+        if self.staff_only and not user.is_staff:
+            raise PermissionDenied()
+        return user
+
+    @abstractmethod
+    async def list(self, request, user):
+        """The response to an authenticated page-number GET."""
+
+
+class CachedAsyncListView(AsyncListView):
+    # name of the version stamp that invalidates the cached listing
+    version_name = None
+
+    async def list(self, request, user):
+        etag, data = await acached_listing(request, self.version_name, self.build)
+        if data is None:
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return render(data, headers={'ETag': etag})
+
+    @abstractmethod
+    async def build(self, request):
+        """The data of the listing, cached under the version stamp."""
+
+
+class AsyncProductView(CachedAsyncListView):
+    sync_view = staticmethod(ProductView.as_view())
+    staff_only = True
+    version_name = PRODUCT
+
+    async def get(self, request, *args, **kwargs):
+        if 'search' in request.GET:
+            return await self.delegate(request, *args, **kwargs)
+        return await super().get(request, *args, **kwargs)
+
+    async def build(self, request):
+        products = rendering.product_rows(Product.objects.with_stock().order_by('id'))
+        page, products = await paginate(request, products, ProductPagination)
+        with timer('serialization'):
+            return {**page, 'results': rendering.product_encoder.encode_all(products)}
+
+
+class AsyncPromotionView(CachedAsyncListView):
+    sync_view = staticmethod(PromotionView.as_view())
+    staff_only = True
+    version_name = PROMOTION
+
+    async def build(self, request):
+        now = timezone.now()
+        promotions = Promotion.objects.filter(start_date__lte=now, end_date__gte=now).order_by('id').prefetch_related('applicable_products')
+        page, promotions = await paginate(request, promotions, PromotionPagination)
+        with timer('serialization'):
+            return {**page, 'results': PromotionSerializer(promotions, many=True).data}
+
+
+class AsyncOrderView(AsyncListView):
+    sync_view = staticmethod(OrderView.as_view())
+
+    async def get(self, request, *args, **kwargs):
+        if request.GET.get('archived') == 'true':
+            return await self.delegate(request, *args, **kwargs)
+        return await super().get(request, *args, **kwargs)
+
+    async def list(self, request, user):
+        orders = rendering.order_rows(Order.objects.filter(user_id=user).order_by('id'))
+        page, orders = await paginate(request, orders, OrderPagination)
+        items = await rendering.aorder_items([order['id'] for order in orders])
+        with timer('serialization'):
+            return render({**page, 'results': rendering.encode_orders(orders, items)})
@@ -0,0 +1,487 @@
+import asyncio
+import multiprocessing
+import queue
+import random
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection, connections
+from django.db.models import Prefetch
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import rendering, search
+from .models import Order, OrderItem, Product, Promotion
+from .serializers import OrderListSerializer, ProductSerializer
+from .stock_stripes import split_stock
+
+
+def seed(products, promotions, users, stock, rng):
+    """Create a benchmark catalogue and return (product ids, user access tokens)."""
+    created = Product.objects.bulk_create([
+        Product(name=f"bench product {i}", price=rng.randint(100, 10000) / 100, stock=stock)
+        for i in range(products)
+    ])
+    product_ids = [product.id for product in created]
+
+    now = timezone.now()
+    for i in range(promotions):
+        promotion = Promotion.objects.create(
+            name=f"bench promotion {i}",
+            discount_type=rng.choice([Promotion.FIXED, Promotion.PERCENTAGE]),
+            value=rng.randint(1, 30),
+            start_date=now - timedelta(days=1),
+            end_date=now + timedelta(days=1),
+        )
+        promotion.applicable_products.set(rng.sample(product_ids, min(len(product_ids), 10)))
+
+    # staff, so that the read traffic can include the admin-only catalogue listings
+    created_users = User.objects.bulk_create([User(username=f"bench_user_{i}", is_staff=True) for i in range(users)])
+    tokens = [str(RefreshToken.for_user(user).access_token) for user in created_users]
+    return product_ids, tokens
+
+
+def plan_requests(product_ids, tokens, requests, hot_products, hot_ratio, read_ratio, items_per_order, rng):
+    # The first `hot_products` products receive `hot_ratio` of all order lines,
+    # which is what makes orders queue behind each other's row locks.
+    hot = product_ids[:hot_products]
+    cold = product_ids[hot_products:] or hot
+
+    plan = []
+    for _ in range(requests):
+        token = rng.choice(tokens)
+        if rng.random() < read_ratio:
+            plan.append(('get', rng.choice(['/orders/', '/products/', '/promotions/']), None, token))
+            continue
+
+        items = {}
+        for _ in range(items_per_order):
+            product_id = rng.choice(hot if rng.random() < hot_ratio else cold)
+            items[product_id] = items.get(product_id, 0) + 1
+        body = {'items': [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in items.items()]}
+        plan.append(('post', '/orders/', body, token))
+    return plan
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latency_summary(latencies):
+    return {
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def is_deadlock(error):
+    return 'deadlock' in str(error).lower()
+
+
+def run_benchmark(products=200, promotions=20, users=20, stock=1_000_000, requests=1000, concurrency=8,
+                  hot_products=1, hot_ratio=0.5, read_ratio=0.2, items_per_order=3, max_retries=3, seed_value=0,
+                  stripes=0):
+    """
+    Seed a catalogue and drive concurrent API traffic against it in-process.
+
+    Requests go through the full Django stack (middleware, JWT authentication,
+    views) with the test client, one thread and database connection per worker.
+    With `stripes`, the stock of the hot products is split over that many stripes.
+    """
+    rng = random.Random(seed_value)
+    product_ids, tokens = seed(products, promotions, users, stock, rng)
+    if stripes:
+        for product_id in product_ids[:hot_products]:
+            split_stock(product_id, stripes)
+    plan = plan_requests(product_ids, tokens, requests, hot_products, hot_ratio, read_ratio, items_per_order, rng)
+
+    pending = queue.Queue()
+    for request in plan:
+        pending.put(request)
+
+    samples = []
+    lock = threading.Lock()
+    counters = {'deadlocks': 0, 'errors': 0, 'retries': 0, 'failed': 0}
+
+    def worker():
+        client = Client(raise_request_exception=True)
+        try:
+            while True:
+                try:
+                    method, path, body, token = pending.get_nowait()
+                except queue.Empty:
+                    return
+
+                for attempt in range(max_retries + 1):
+                    started = time.perf_counter()
+                    try:
+                        with CaptureQueriesContext(connection) as queries:
+                            if method == 'post':
+                                response = client.post(path, body, content_type='application/json',
+                                                       HTTP_AUTHORIZATION=f'Bearer {token}')
+                            else:
+                                response = client.get(path, HTTP_AUTHORIZATION=f'Bearer {token}')
+                    except DatabaseError as error:
+                        with lock:
+                            counters['deadlocks' if is_deadlock(error) else 'errors'] += 1
+                            counters['retries' if attempt < max_retries else 'failed'] += 1
+                        continue
+
+                    with lock:
+                        samples.append((method, path, response.status_code, time.perf_counter() - started, len(queries)))
+                    break
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+
+    endpoints = {}
+    for method, path, status_code, latency, queries in samples:
+        endpoint = endpoints.setdefault(f"{method.upper()} {path}", {'latencies': [], 'queries': [], 'status_codes': {}})
+        endpoint['latencies'].append(latency)
+        endpoint['queries'].append(queries)
+        endpoint['status_codes'][str(status_code)] = endpoint['status_codes'].get(str(status_code), 0) + 1
+
+    return {
+        'config': {
+            'products': products, 'promotions': promotions, 'users': users, 'stock': stock,
+            'requests': requests, 'concurrency': concurrency, 'hot_products': hot_products,
+            'hot_ratio': hot_ratio, 'read_ratio': read_ratio, 'items_per_order': items_per_order,
+            'max_retries': max_retries, 'seed': seed_value, 'stripes': stripes, 'database': connection.vendor,
+        },
+        'duration_seconds': duration,
+        'throughput_rps': len(samples) / duration if duration else 0,
+        'completed': len(samples),
+        **counters,
+        'endpoints': {
+            name: {
+                'count': len(endpoint['latencies']),
+                **latency_summary(endpoint['latencies']),
+                'queries_per_request': sum(endpoint['queries']) / len(endpoint['queries']),
+                'status_codes': endpoint['status_codes'],
+            }
+            for name, endpoint in endpoints.items()
+        },
+    }
+
+
+READ_PATHS = ['/orders/', '/products/', '/promotions/']
+
+
+def capacity_summary(latencies, status_codes, duration, max_in_flight):
+    summary = {
+        'completed': len(latencies),
+        'duration_seconds': duration,
+        'throughput_rps': len(latencies) / duration if duration else 0,
+        'max_in_flight': max_in_flight,
+        'status_codes': status_codes,
+    }
+    if latencies:
+        summary.update(latency_summary(latencies))
+    return summary
+
+
+def measure_wsgi_reads(plan, threads):
+    pending = queue.Queue()
+    for request in plan:
+        pending.put(request)
+
+    latencies, status_codes = [], {}
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def worker():
+        client = Client()
+        try:
+            while True:
+                try:
+                    path, token = pending.get_nowait()
+                except queue.Empty:
+                    return
+                with lock:
+                    in_flight[0] += 1
+                    in_flight[1] = max(in_flight)
+                started = time.perf_counter()
+                response = client.get(path, HTTP_AUTHORIZATION=f'Bearer {token}')
+                with lock:
+                    in_flight[0] -= 1
+                    latencies.append(time.perf_counter() - started)
+                    status_codes[str(response.status_code)] = status_codes.get(str(response.status_code), 0) + 1
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return capacity_summary(latencies, status_codes, time.perf_counter() - started, in_flight[1])
+
+
+def measure_asgi_reads(plan, connections):
+    latencies, status_codes = [], {}
+    in_flight = [0, 0]
+
+    async def send(client, slots, path, token):
+        async with slots:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+            started = time.perf_counter()
+            response = await client.get(path, headers={'Authorization': f'Bearer {token}'})
+            in_flight[0] -= 1
+            latencies.append(time.perf_counter() - started)
+            status_codes[str(response.status_code)] = status_codes.get(str(response.status_code), 0) + 1
+
+    async def run():
+        client = AsyncClient()
+        slots = asyncio.Semaphore(connections)
+        await asyncio.gather(*(send(client, slots, path, token) for path, token in plan))
+
+    started = time.perf_counter()
+    with override_settings(ROOT_URLCONF='order_management.asgi_urls'):
+        async_to_sync(run)()
+    return capacity_summary(latencies, status_codes, time.perf_counter() - started, in_flight[1])
+
+
+def run_read_capacity_benchmark(products=200, promotions=20, users=20, orders=1000, requests=1000,
+                                connections=64, wsgi_threads=8, seed_value=0):
+    """
+    Compare the WSGI and ASGI serving paths of the read endpoints in one process.
+
+    The WSGI path gets `wsgi_threads` threads, like a threaded sync worker, and can
+    never have more requests in flight than that. The ASGI path runs on a single
+    event loop with up to `connections` concurrent requests. Differences show most
+    against a real database, where queries and clients wait on the network.
+    """
+    rng = random.Random(seed_value)
+    product_ids, tokens = seed(products, promotions, users, stock=orders, rng=rng)
+    write_plan = plan_requests(product_ids, tokens, orders, hot_products=0, hot_ratio=0, read_ratio=0,
+                               items_per_order=2, rng=rng)
+    client = Client()
+    for method, path, body, token in write_plan:
+        client.post(path, body, content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    plan = [(rng.choice(READ_PATHS), rng.choice(tokens)) for _ in range(requests)]
+    return {
+        'config': {
+            'products': products, 'promotions': promotions, 'users': users, 'orders': orders,
+            'requests': requests, 'connections': connections, 'wsgi_threads': wsgi_threads,
+            'seed': seed_value, 'database': connection.vendor,
+        },
+        'wsgi': measure_wsgi_reads(plan, wsgi_threads),
+        'asgi': measure_asgi_reads(plan, connections),
+    }
+
+
+def product_names(count, rng, vocabulary_size=5000):
+    # names of three words from a random vocabulary and a model number
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    vocabulary = [''.join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(vocabulary_size)]
+    for i in range(count):
+        yield f"{rng.choice(vocabulary)} {rng.choice(vocabulary)} {rng.choice(vocabulary)} {i}"
+
+
+def search_queries(names, match, count, rng):
+    queries = []
+    for _ in range(count):
+        words = rng.choice(names).split()
+        if match == search.PREFIX:
+            queries.append(words[0][:3])
+        elif match == search.SUBSTRING:
+            word = rng.choice(words[:3])
+            start = rng.randint(0, len(word) - 3)
+            queries.append(word[start:start + 4])
+        else:
+            queries.append(' '.join(word[:rng.randint(3, len(word))] for word in rng.sample(words[:3], 2)))
+    return queries
+
+
+def run_search_benchmark(products=500_000, requests=200, seed_value=0, batch_size=10_000):
+    """
+    Seed a catalogue of `products` generated names and time GET /products/?search=
+    for each match mode through the full request stack, with the response cache
+    off so that every request searches. On backends other than PostgreSQL the
+    first search builds the per-worker index, which is timed separately.
+    """
+    rng = random.Random(seed_value)
+    names = list(product_names(products, rng))
+    for start in range(0, products, batch_size):
+        Product.objects.bulk_create([
+            Product(name=name, price=1, stock=0) for name in names[start:start + batch_size]
+        ])
+    admin = User.objects.create(username='bench_search_admin', is_staff=True)
+    token = str(RefreshToken.for_user(admin).access_token)
+
+    index_build_seconds = None
+    if connection.vendor != 'postgresql':
+        started = time.perf_counter()
+        search.search_index.ensure_current()
+        index_build_seconds = time.perf_counter() - started
+
+    client = Client()
+    modes = {}
+    with override_settings(RESPONSE_CACHE_TIMEOUT=0):
+        for match in search.MATCH_CHOICES:
+            latencies, results, status_codes = [], [], {}
+            for query in search_queries(names, match, requests, rng):
+                started = time.perf_counter()
+                response = client.get('/products/', {'search': query, 'match': match},
+                                      HTTP_AUTHORIZATION=f'Bearer {token}')
+                latencies.append(time.perf_counter() - started)
+                status_codes[str(response.status_code)] = status_codes.get(str(response.status_code), 0) + 1
+                if response.status_code == 200:
+                    results.append(response.json()['count'])
+            modes[match] = {
+                'count': len(latencies),
+                **latency_summary(latencies),
+                'mean_results': sum(results) / len(results) if results else 0,
+                'status_codes': status_codes,
+            }
+
+    return {
+        'config': {'products': products, 'requests': requests, 'seed': seed_value, 'database': connection.vendor},
+        'index_build_seconds': index_build_seconds,
+        'modes': modes,
+    }
+
+
+def rows_per_second(render, rows, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        render()
+    return rows * repeat / (time.perf_counter() - started)
+
+
+def run_render_benchmark(rows=100, repeat=200, seed_value=0):
+    """
+    Compare the serializers of the product and order listings with the rendering
+    module on one page of `rows` rows, from the fetched rows to the JSON bytes.
+    Fetching is left out: both start from rows already loaded.
+    """
+    rng = random.Random(seed_value)
+    product_ids, tokens = seed(rows, 0, 1, 1000, rng)
+    user = User.objects.get(username='bench_user_0')
+    orders = Order.objects.bulk_create([
+        Order(user_id=user, items=[], total_price=1) for _ in range(rows)
+    ])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product_id=product_id, quantity=rng.randint(1, 5), unit_price=1)
+        for order in orders for product_id in rng.sample(product_ids, 3)
+    ])
+
+    products = Product.objects.with_stock().order_by('id')
+    product_instances = list(products)
+    product_rows = list(rendering.product_rows(products))
+
+    orders = Order.objects.filter(user_id=user).order_by('-created_at', '-id')
+    order_instances = list(orders.prefetch_related(Prefetch('order_items', queryset=OrderItem.objects.order_by('id'))))
+    order_rows = list(rendering.order_rows(orders))
+    items = rendering.order_items([row['id'] for row in order_rows])
+
+    renderer = JSONRenderer()
+    results = {}
+    for name, serialized, fast in (
+        ('products', lambda: ProductSerializer(product_instances, many=True).data,
+         lambda: rendering.product_encoder.encode_all(product_rows)),
+        ('orders', lambda: OrderListSerializer(order_instances, many=True).data,
+         lambda: rendering.encode_orders(order_rows, items)),
+    ):
+        serializer_rate = rows_per_second(lambda: renderer.render(serialized()), rows, repeat)
+        fast_rate = rows_per_second(lambda: renderer.render(fast()), rows, repeat)
+        results[name] = {
+            'serializer_rows_per_second': serializer_rate,
+            'fast_rows_per_second': fast_rate,
+            'speedup': fast_rate / serializer_rate,
+        }
+
+    return {
+        'config': {'rows': rows, 'repeat': repeat, 'seed': seed_value, 'database': connection.vendor},
+        'results': results,
+    }
+
+
+def log_in_until(stop, results):
+    """Body of a login worker process: log in until `stop` is set, then report the status codes."""
+    client = Client()
+    logins = {}
+    try:
+        while not stop.is_set():
+            response = client.post('/login/', {'username': 'bench_login', 'password': 'bench-login-password'},
+                                   content_type='application/json')
+            logins[str(response.status_code)] = logins.get(str(response.status_code), 0) + 1
+            # a turned away client tries again when told to
+            if response.has_header('Retry-After'):
+                stop.wait(int(response['Retry-After']))
+    finally:
+        connection.close()
+        results.put(logins)
+
+
+def run_login_flood_benchmark(products=50, orders=200, login_workers=16, seed_value=0):
+    """
+    Time POST /orders/, one at a time, first alone and then while `login_workers`
+    processes keep logging in. Each process stands for a gunicorn sync worker, so
+    this shows how a login burst slows order placement down when the password
+    hashing of all workers of the host competes for its cores.
+    """
+    rng = random.Random(seed_value)
+    product_ids, tokens = seed(products, 0, 1, 1_000_000, rng)
+    User.objects.create_user(username='bench_login', password='bench-login-password')
+    plan = plan_requests(product_ids, tokens, 2 * orders, hot_products=0, hot_ratio=0, read_ratio=0,
+                         items_per_order=3, rng=rng)
+
+    def place_orders(requests):
+        client = Client()
+        latencies, status_codes = [], {}
+        for method, path, body, token in requests:
+            started = time.perf_counter()
+            response = client.post(path, body, content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+            latencies.append(time.perf_counter() - started)
+            status_codes[str(response.status_code)] = status_codes.get(str(response.status_code), 0) + 1
+        return {**latency_summary(latencies), 'status_codes': status_codes}
+
+    baseline = place_orders(plan[:orders])
+
+    # the workers open connections of their own (an in-memory SQLite test database is kept)
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    stop, results = context.Event(), context.Queue()
+    workers = [context.Process(target=log_in_until, args=(stop, results)) for _ in range(login_workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        under_flood = place_orders(plan[orders:])
+    finally:
+        stop.set()
+        logins = {}
+        for _ in workers:
+            for code, count in results.get().items():
+                logins[code] = logins.get(code, 0) + count
+        for worker in workers:
+            worker.join()
+
+    return {
+        'config': {'products': products, 'orders': orders, 'login_workers': login_workers, 'seed': seed_value,
+                   'database': connection.vendor},
+        'orders_alone': baseline,
+        'orders_during_logins': under_flood,
+        'logins': logins,
+    }
+
@@ -0,0 +1,100 @@
+"""
+Streaming import and export of the product catalogue as CSV or NDJSON.
+
+Files are read and written row by row and products are upserted in chunks
+keyed by SKU, so memory use does not grow with the size of the file.
+"""
+import codecs
+import csv
+import json
+
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from . import stock_stripes
+from .models import Product, StockStripe
+from .serializers import ProductImportSerializer
+from .streaming import CSV, buffered, lines as export_lines
+from .versions import PRODUCT, PRODUCT_NAMES, data_changed
+
+
+EXPORT_FIELDS = ('id', 'sku', 'name', 'price', 'stock')
+# the summed stripes of striped products, see stock_stripes
+EXPORT_COLUMNS = ('id', 'sku', 'name', 'price', 'total_stock')
+UPDATE_FIELDS = ['name', 'price', 'stock']
+
+IMPORT_CHUNK_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+# rows with errors beyond this are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+def read_rows(lines, file_format):
+    """Yield (row number, row) from an iterable of byte lines; row is None where it cannot be parsed."""
+    if file_format == CSV:
+        yield from enumerate(csv.DictReader(codecs.iterdecode(lines, 'utf-8-sig')), 1)
+        return
+
+    number = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        number += 1
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+def upsert(products):
+    # the last row wins when a chunk repeats a SKU, as it would row by row
+    products = list({product.sku: product for product in products}.values())
+    with transaction.atomic():
+        Product.objects.bulk_create(products, update_conflicts=True, unique_fields=['sku'], update_fields=UPDATE_FIELDS)
+        # the imported stock of striped products goes to their stripes
+        striped = StockStripe.objects.filter(product__sku__in=[product.sku for product in products]).values_list(
+            'product_id', 'product__stock',
+        ).distinct()
+        stock_stripes.set_total(dict(striped))
+    return len(products)
+
+
+def import_products(rows, chunk_size=IMPORT_CHUNK_SIZE):
+    """Validate and upsert (row number, row) pairs by SKU; returns a report of what was imported."""
+    serializer = ProductImportSerializer()
+    imported = failed = 0
+    errors = []
+    chunk = []
+
+    for number, row in rows:
+        try:
+            if not isinstance(row, dict):
+                raise ValidationError({'non_field_errors': ['Expected an object with sku, name, price and stock.']})
+            chunk.append(Product(**serializer.run_validation(row)))
+        except ValidationError as e:
+            failed += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'row': number, 'errors': e.detail})
+            continue
+
+        if len(chunk) >= chunk_size:
+            imported += upsert(chunk)
+            chunk = []
+
+    if chunk:
+        imported += upsert(chunk)
+    if imported:
+        # bulk_create sends no post_save, so invalidate the cached product listings and search index here
+        data_changed(PRODUCT)
+        data_changed(PRODUCT_NAMES)
+
+    return {'imported': imported, 'failed': failed, 'errors': errors}
+
+
+def export_products(file_format, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the catalogue as text pieces of about WRITE_BUFFER_SIZE characters."""
+    # the database is picked now, like in order_export.export_orders()
+    products = Product.objects.with_stock().order_by('id')
+    rows = products.using(products.db).values_list(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size)
+    return buffered(export_lines(file_format, EXPORT_FIELDS, rows))
@@ -0,0 +1,15 @@
+import logging
+
+from .outbox import ORDER_CREATED, handler
+from .rollups import record_orders
+
+
+logger = logging.getLogger(__name__)
+
+
+# Notifications, analytics or ERP sync hook in here, or register their own handler per topic.
+@handler(ORDER_CREATED)
+def order_created(event):
+    logger.info("Order %s placed by user %s, total %s",
+                event.payload['order_id'], event.payload['user_id'], event.payload['total_price'])
+    record_orders([event.payload['order_id']])
@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from orders import archive
+from orders.models import OrderArchiveBatch
+
+
+class Command(BaseCommand):
+    help = (
+        "Move delivered and canceled orders older than a cutoff to the order archive, in batches "
+        "each recorded in a manifest. --verify checks the archived batches against their manifests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.ORDER_ARCHIVE_AFTER_DAYS,
+                            help="Archive orders created before the start of the day this many days ago.")
+        parser.add_argument('--batch-size', type=int, default=archive.ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, help="Stop after this many batches.")
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to wait between batches.")
+        parser.add_argument('--verify', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            return self.verify()
+
+        cutoff = archive.cutoff_for(options['older_than_days'])
+        batches = archived = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            batch = archive.archive_batch(cutoff, options['batch_size'])
+            if batch is None:
+                break
+            batches += 1
+            archived += batch.orders
+            self.stdout.write(f"Batch {batch.id}: {batch.orders} orders, {batch.first_created_at} to {batch.last_created_at}")
+            time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {archived} orders created before {cutoff} archived in {batches} batches."))
+
+    def verify(self):
+        failed = 0
+        batches = OrderArchiveBatch.objects.order_by('id')
+        for batch in batches.iterator():
+            problems = archive.verify_batch(batch)
+            if problems:
+                failed += 1
+                self.stderr.write(f"Batch {batch.id}: {'; '.join(problems)}")
+        if failed:
+            raise CommandError(f"{failed} archive batches do not match their manifests.")
+        self.stdout.write(self.style.SUCCESS(f"All {batches.count()} archive batches match their manifests."))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from orders.models import Order, OrderItem, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Create OrderItem rows for orders placed before the OrderItem table existed. "
+        "Prices charged back then were not recorded, so the current product price is "
+        "used as unit price with no discount."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        orders = Order.objects.filter(order_items__isnull=True).order_by('id').only('id', 'items')
+
+        last_id = 0
+        backfilled = 0
+        while True:
+            chunk = list(orders.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            lines = [
+                (order, item)
+                for order in chunk
+                for item in order.items
+                if isinstance(item, dict) and 'product_id' in item and 'quantity' in item
+            ]
+            prices = dict(
+                Product.objects.filter(id__in={item['product_id'] for _, item in lines}).values_list('id', 'price')
+            )
+
+            with transaction.atomic():
+                OrderItem.objects.bulk_create([
+                    OrderItem(
+                        order=order,
+                        product_id=item['product_id'] if item['product_id'] in prices else None,
+                        quantity=item['quantity'],
+                        unit_price=prices.get(item['product_id'], 0),
+                    )
+                    for order, item in lines
+                ])
+            backfilled += len(chunk)
+            self.stdout.write(f"Backfilled {backfilled} orders")
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {backfilled} orders backfilled."))
@@ -0,0 +1,188 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from orders.benchmark import (
+    run_benchmark, run_login_flood_benchmark, run_read_capacity_benchmark, run_render_benchmark, run_search_benchmark,
+)
+from orders.promotion_index import promotion_index
+from orders.search import search_index
+from orders.stock_stripes import stripe_index
+from users.user_cache import user_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the order API load benchmark against a throwaway test database and "
+        "write the results as JSON, so that runs can be compared."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--promotions', type=int, default=20)
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--stock', type=int, default=1_000_000)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--hot-products', type=int, default=1,
+                            help="Number of products that receive --hot-ratio of all order lines.")
+        parser.add_argument('--hot-ratio', type=float, default=0.5)
+        parser.add_argument('--read-ratio', type=float, default=0.2)
+        parser.add_argument('--items-per-order', type=int, default=3)
+        parser.add_argument('--max-retries', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--inventory-mode', choices=['locking', 'conditional'],
+                            help="Override settings.ORDER_INVENTORY_MODE for this run.")
+        parser.add_argument('--admission', action='store_true',
+                            help="Keep the configured order admission limits; by default they are off, "
+                                 "so that runs measure the database rather than the rate limits.")
+        parser.add_argument('--stripes', type=int, nargs='+', default=[0],
+                            help="Split the stock of the hot products over this many stripes; "
+                                 "several counts run the benchmark once per count, for comparison.")
+        parser.add_argument('--read-capacity', action='store_true',
+                            help="Compare the WSGI and ASGI paths of the read endpoints instead.")
+        parser.add_argument('--orders', type=int, default=1000,
+                            help="Orders placed before measuring --read-capacity.")
+        parser.add_argument('--connections', type=int, default=64,
+                            help="Concurrent connections on the ASGI path of --read-capacity.")
+        parser.add_argument('--wsgi-threads', type=int, default=8,
+                            help="Worker threads on the WSGI path of --read-capacity.")
+        parser.add_argument('--search', action='store_true',
+                            help="Time product searches against a catalogue of --catalogue-size products instead.")
+        parser.add_argument('--catalogue-size', type=int, default=500_000,
+                            help="Products seeded for --search.")
+        parser.add_argument('--render', action='store_true',
+                            help="Compare the listing serializers with the serializer-free rendering instead, "
+                                 "on pages of --page-rows rows.")
+        parser.add_argument('--page-rows', type=int, default=100)
+        parser.add_argument('--login-flood', action='store_true',
+                            help="Time --requests orders alone and then during a flood of logins from --login-workers processes.")
+        parser.add_argument('--login-workers', type=int, default=16)
+        parser.add_argument('--output', help="Result file, defaults to benchmark-<timestamp>.json")
+
+    def handle(self, *args, **options):
+        settings_overrides = {}
+        if options['inventory_mode']:
+            settings_overrides['ORDER_INVENTORY_MODE'] = options['inventory_mode']
+        if not options['admission']:
+            settings_overrides.update(ORDER_ADMISSION_RATE=0, ORDER_ADMISSION_USER_RATE=0,
+                                      ORDER_ADMISSION_MAX_IN_FLIGHT_PER_PRODUCT=0)
+
+        if options['login_flood']:
+            report = self.run(settings_overrides, lambda: run_login_flood_benchmark(
+                products=options['products'],
+                orders=options['requests'],
+                login_workers=options['login_workers'],
+                seed_value=options['seed'],
+            ))
+        elif options['render']:
+            report = self.run(settings_overrides, lambda: run_render_benchmark(
+                rows=options['page_rows'],
+                repeat=options['requests'],
+                seed_value=options['seed'],
+            ))
+        elif options['search']:
+            report = self.run(settings_overrides, lambda: run_search_benchmark(
+                products=options['catalogue_size'],
+                requests=options['requests'],
+                seed_value=options['seed'],
+            ))
+        elif options['read_capacity']:
+            report = self.run(settings_overrides, lambda: run_read_capacity_benchmark(
+                products=options['products'],
+                promotions=options['promotions'],
+                users=options['users'],
+                orders=options['orders'],
+                requests=options['requests'],
+                connections=options['connections'],
+                wsgi_threads=options['wsgi_threads'],
+                seed_value=options['seed'],
+            ))
+        else:
+            # every stripe count gets a fresh database, so that runs start from the same state
+            runs = [
+                self.run(settings_overrides, lambda: run_benchmark(
+                    products=options['products'],
+                    promotions=options['promotions'],
+                    users=options['users'],
+                    stock=options['stock'],
+                    requests=options['requests'],
+                    concurrency=options['concurrency'],
+                    hot_products=options['hot_products'],
+                    hot_ratio=options['hot_ratio'],
+                    read_ratio=options['read_ratio'],
+                    items_per_order=options['items_per_order'],
+                    max_retries=options['max_retries'],
+                    seed_value=options['seed'],
+                    stripes=stripes,
+                ))
+                for stripes in options['stripes']
+            ]
+            report = runs[0] if len(runs) == 1 else {'runs': runs}
+
+        output = options['output'] or f"benchmark-{timezone.now():%Y%m%d-%H%M%S}.json"
+        with open(output, 'w') as result_file:
+            json.dump(report, result_file, indent=2)
+
+        if options['login_flood']:
+            for phase in ('orders_alone', 'orders_during_logins'):
+                result = report[phase]
+                self.stdout.write(f"{phase}: p50 {result['p50_ms']:.1f}ms, p95 {result['p95_ms']:.1f}ms, "
+                                  f"p99 {result['p99_ms']:.1f}ms")
+            self.stdout.write(f"logins: {report['logins']}")
+            self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+            return
+
+        if options['render']:
+            for name, result in report['results'].items():
+                self.stdout.write(f"{name}: {result['serializer_rows_per_second']:.0f} rows/s with the serializer, "
+                                  f"{result['fast_rows_per_second']:.0f} rows/s without ({result['speedup']:.1f}x)")
+            self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+            return
+
+        if options['search']:
+            if report['index_build_seconds'] is not None:
+                self.stdout.write(f"search index built in {report['index_build_seconds']:.2f}s")
+            for match, result in report['modes'].items():
+                self.stdout.write(f"{match}: p50 {result['p50_ms']:.1f}ms, p95 {result['p95_ms']:.1f}ms, "
+                                  f"p99 {result['p99_ms']:.1f}ms, {result['mean_results']:.0f} results on average")
+            self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+            return
+
+        if options['read_capacity']:
+            for path in ('wsgi', 'asgi'):
+                result = report[path]
+                self.stdout.write(f"{path}: {result['completed']} requests in {result['duration_seconds']:.2f}s "
+                                  f"({result['throughput_rps']:.1f} req/s), p50 {result['p50_ms']:.1f}ms, "
+                                  f"p99 {result['p99_ms']:.1f}ms, {result['max_in_flight']} in flight at most")
+            self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+            return
+
+        for run in runs:
+            if len(runs) > 1:
+                self.stdout.write(f"{run['config']['stripes'] or 'no'} stripes:")
+            self.stdout.write(f"{run['completed']} requests in {run['duration_seconds']:.2f}s "
+                              f"({run['throughput_rps']:.1f} req/s), {run['deadlocks']} deadlocks, "
+                              f"{run['retries']} retries, {run['failed']} failed")
+            for name, endpoint in run['endpoints'].items():
+                self.stdout.write(f"  {name}: p50 {endpoint['p50_ms']:.1f}ms, p95 {endpoint['p95_ms']:.1f}ms, "
+                                  f"p99 {endpoint['p99_ms']:.1f}ms, {endpoint['queries_per_request']:.1f} queries")
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+    def run(self, settings_overrides, benchmark):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # ids start over in the new database, so nothing cached per worker may carry over
+        promotion_index.clear()
+        stripe_index.clear()
+        search_index.clear()
+        user_cache.clear()
+        try:
+            with override_settings(**settings_overrides):
+                return benchmark()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from orders import order_export, streaming
+from orders.serializers import OrderFilterSerializer
+
+
+class Command(BaseCommand):
+    help = "Write orders, optionally filtered by status, user and creation time, as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="File to write; defaults to standard output.")
+        parser.add_argument('--format', choices=[streaming.CSV, streaming.NDJSON],
+                            help="Defaults to the extension of --output, or ndjson.")
+        parser.add_argument('--status')
+        parser.add_argument('--user', help="User id.")
+        parser.add_argument('--created-after', help="ISO 8601 date or time, inclusive.")
+        parser.add_argument('--created-before', help="ISO 8601 date or time, exclusive.")
+        parser.add_argument('--chunk-size', type=int, default=order_export.EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file_format = options['format']
+        if file_format is None:
+            file_format = streaming.format_for_filename(output) if output else streaming.NDJSON
+            if file_format is None:
+                raise CommandError("Cannot tell the format from the file name, pass --format.")
+
+        filters = {
+            name: options[name]
+            for name in ('status', 'user', 'created_after', 'created_before')
+            if options[name] is not None
+        }
+        serializer = OrderFilterSerializer(data=filters)
+        if not serializer.is_valid():
+            raise CommandError(serializer.errors)
+
+        pieces = order_export.export_orders(file_format, serializer.validated_data, chunk_size=options['chunk_size'])
+        if output is None:
+            for piece in pieces:
+                self.stdout.write(piece, ending='')
+            return
+
+        with open(output, 'w', encoding='utf-8', newline='') as file:
+            for piece in pieces:
+                file.write(piece)
+        self.stderr.write(self.style.SUCCESS(f"Orders written to {output}."))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from orders import catalogue, streaming
+
+
+class Command(BaseCommand):
+    help = "Write the product catalogue as CSV or NDJSON, in the format import_products reads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="File to write; defaults to standard output.")
+        parser.add_argument('--format', choices=[streaming.CSV, streaming.NDJSON],
+                            help="Defaults to the extension of --output, or csv.")
+        parser.add_argument('--chunk-size', type=int, default=catalogue.EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file_format = options['format']
+        if file_format is None:
+            file_format = streaming.format_for_filename(output) if output else streaming.CSV
+            if file_format is None:
+                raise CommandError("Cannot tell the format from the file name, pass --format.")
+
+        pieces = catalogue.export_products(file_format, chunk_size=options['chunk_size'])
+        if output is None:
+            for piece in pieces:
+                self.stdout.write(piece, ending='')
+            return
+
+        with open(output, 'w', encoding='utf-8', newline='') as file:
+            for piece in pieces:
+                file.write(piece)
+        self.stderr.write(self.style.SUCCESS(f"Catalogue written to {output}."))
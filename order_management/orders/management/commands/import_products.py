@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from orders import catalogue, streaming
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update products from a CSV or NDJSON file with sku, name, price and stock, "
+        "matching existing products by SKU."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for standard input.")
+        parser.add_argument('--format', choices=[streaming.CSV, streaming.NDJSON],
+                            help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=catalogue.IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or streaming.format_for_filename(path)
+        if file_format is None:
+            raise CommandError("Cannot tell the format from the file name, pass --format.")
+
+        if path == '-':
+            report = self.import_file(sys.stdin.buffer, file_format, options['chunk_size'])
+        else:
+            with open(path, 'rb') as file:
+                report = self.import_file(file, file_format, options['chunk_size'])
+
+        for error in report['errors']:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(f"Done, {report['imported']} products imported, {report['failed']} rows failed."))
+
+    def import_file(self, file, file_format, chunk_size):
+        return catalogue.import_products(catalogue.read_rows(file, file_format), chunk_size=chunk_size)
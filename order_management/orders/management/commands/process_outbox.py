@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from orders.outbox import process_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Hand outbox events to their registered handlers, retrying failures with backoff. "
+        "Any number of workers can run side by side; each claims its own batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to wait when no event is due.")
+        parser.add_argument('--once', action='store_true',
+                            help="Process the events due now and exit.")
+
+    def handle(self, *args, **options):
+        total_processed = total_failed = 0
+        try:
+            while True:
+                processed, failed = process_batch(options['batch_size'])
+                total_processed += processed
+                total_failed += failed
+                if processed or failed:
+                    self.stdout.write(f"Processed {processed} events, {failed} failed")
+                elif options['once']:
+                    break
+                else:
+                    # like a request boundary: drop a connection the database closed or that reached CONN_MAX_AGE
+                    close_old_connections()
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {total_processed} events processed, {total_failed} failed."))
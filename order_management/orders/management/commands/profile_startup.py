@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from order_management.startup import measure_startup
+
+
+class Command(BaseCommand):
+    help = (
+        "Boot the project in a fresh interpreter, like a new worker, and report the time spent "
+        "in settings, app loading, each app's ready() and the URLconf, and the slowest imports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help="Number of modules and packages listed.")
+        parser.add_argument('--settings-module', help="Settings to boot with, defaults to DJANGO_SETTINGS_MODULE.")
+        parser.add_argument('--output', help="Also write the full report as JSON to this file.")
+
+    def handle(self, *args, **options):
+        report = measure_startup(options['settings_module'])
+
+        self.stdout.write(f"boot: {report['boot_seconds'] * 1000:.0f}ms "
+                          f"(process {report['process_seconds'] * 1000:.0f}ms, "
+                          f"imports {report['import_seconds'] * 1000:.0f}ms)")
+        self.stdout.write(f"  settings {report['settings_seconds'] * 1000:.1f}ms, "
+                          f"apps {report['apps_seconds'] * 1000:.1f}ms, urls {report['urls_seconds'] * 1000:.1f}ms")
+        for label, seconds in sorted(report['ready_seconds'].items(), key=lambda item: -item[1]):
+            self.stdout.write(f"  {label}.ready(): {seconds * 1000:.1f}ms")
+
+        self.stdout.write("slowest top-level imports (cumulative):")
+        top_level = sorted(report['top_level'], key=lambda module: -report['modules'][module][1])
+        for module in top_level[:options['top']]:
+            self.stdout.write(f"  {report['modules'][module][1] * 1000:8.1f}ms  {module}")
+
+        self.stdout.write("import time by package (self):")
+        packages = sorted(report['packages'].items(), key=lambda item: -item[1])
+        for package, seconds in packages[:options['top']]:
+            self.stdout.write(f"  {seconds * 1000:8.1f}ms  {package}")
+
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from orders.models import StockStripe
+from orders.stock_stripes import empty_columns, rebalance
+
+
+class Command(BaseCommand):
+    help = (
+        "Even out the stock stripes of striped products once a stripe runs low."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=0.5,
+                            help="Rebalance once a stripe holds less than this share of an even split.")
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help="Seconds between passes.")
+        parser.add_argument('--once', action='store_true', help="Make a single pass and exit.")
+
+    def handle(self, *args, **options):
+        emptied = empty_columns()
+        if emptied:
+            self.stdout.write(f"Emptied the stock column of {emptied} striped products")
+        try:
+            while True:
+                product_ids = list(StockStripe.objects.order_by('product_id').values_list('product_id', flat=True).distinct())
+                rebalanced = sum(
+                    1 for product_id in product_ids
+                    if rebalance(product_id, options['threshold']) is not None
+                )
+                if rebalanced:
+                    self.stdout.write(f"Rebalanced {rebalanced} products")
+                if options['once']:
+                    break
+                close_old_connections()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
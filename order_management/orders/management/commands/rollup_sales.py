@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from orders.models import Order
+from orders.rollups import rebuild, record_orders
+
+
+class Command(BaseCommand):
+    help = (
+        "Add orders that are not counted in the sales rollups yet, such as orders placed "
+        "before the rollups existed. --rebuild recomputes all rollups from scratch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            counts = rebuild()
+            summary = ', '.join(f"{count} {name} rows" for name, count in counts.items())
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {summary}."))
+            return
+
+        pending = Order.objects.filter(rolled_up=False).order_by('id').values_list('id', flat=True)
+        last_id = 0
+        counted = 0
+        while True:
+            chunk = list(pending.filter(id__gt=last_id)[:options['chunk_size']])
+            if not chunk:
+                break
+            last_id = chunk[-1]
+            counted += record_orders(chunk)
+            self.stdout.write(f"Counted {counted} orders")
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {counted} orders added to the sales rollups."))
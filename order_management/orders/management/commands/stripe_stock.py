@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.models import Product
+from orders.stock_stripes import split_stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Split the stock of high-contention products over several rows, so that "
+        "concurrent orders for them do not queue behind one row lock. "
+        "--stripes 0 moves the stock back to the product row."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='+', type=int)
+        parser.add_argument('--stripes', type=int, required=True)
+
+    def handle(self, *args, **options):
+        if not 0 <= options['stripes'] <= 1000:
+            raise CommandError("--stripes must be between 0 and 1000.")
+
+        for product_id in options['product_ids']:
+            try:
+                total = split_stock(product_id, options['stripes'])
+            except Product.DoesNotExist:
+                raise CommandError(f"Product with ID {product_id} does not exist.")
+            self.stdout.write(f"Product {product_id}: {total} in stock over {options['stripes'] or 'no'} stripes")
@@ -3,19 +3,58 @@ from django.core.validators import MinValueValidator
 from django.contrib.auth.models import User  
 from django.utils import timezone
 from django.core.exceptions import ValidationError
+from django.db.models.functions import Coalesce
 
 
 from enum import Enum 
 
 # Create your models here.
+class ProductQuerySet(models.QuerySet):
+
+    def with_stock(self):
+        """Annotate `total_stock`: the summed stripes of striped products, `stock` for the others."""
+        striped = StockStripe.objects.filter(product=models.OuterRef('pk')).order_by().values('product').annotate(
+            total=models.Sum('stock'),
+        ).values('total')
+        return self.annotate(total_stock=Coalesce(models.Subquery(striped), models.F('stock')))
+
+
 class Product(models.Model): 
+    # stable identifier used to match rows of catalogue imports
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=200, null=False, blank=False) 
     price = models.DecimalField(max_digits=20, decimal_places=2, validators=[MinValueValidator(0)], null=False, blank=False)
+    # 0 while the product is split into StockStripes, whose sum is its stock (see with_stock())
     stock = models.PositiveIntegerField(null=False, blank=False)  
 
+    objects = ProductQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the stored name, so that saving tells a rename from other changes
+        instance._loaded_name = instance.__dict__.get('name')
+        return instance
+
     def __str__(self): 
         return self.name 
 
+
+class StockStripe(models.Model):
+    # Stock of a high-contention product, split over several rows so that
+    # concurrent orders do not all wait on the same row lock.
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_stripes')
+    index = models.PositiveSmallIntegerField()
+    stock = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'index'], name='stockstripe_product_index_uniq'),
+        ]
+
+    def __str__(self):
+        return f"stripe {self.index} of product {self.product_id}"
+
 class Order(models.Model): 
     PENDING = 'pending'
     CONFIRMED = 'confirmed'
@@ -31,15 +70,54 @@ class Order(models.Model):
         (CANCELED, 'Canceled'),
     ]
 
+    # status -> statuses it may change to
+    TRANSITIONS = {
+        PENDING: {CONFIRMED, CANCELED},
+        CONFIRMED: {SHIPPED, CANCELED},
+        SHIPPED: {DELIVERED},
+        DELIVERED: set(),
+        CANCELED: set(),
+    }
+
     user_id = models.ForeignKey(User, on_delete=models.CASCADE, null=False, blank=False) 
     items = models.JSONField(null=False, blank=False)
     total_price = models.DecimalField(max_digits=20, decimal_places=2, validators=[MinValueValidator(0)], null=False, blank=False) 
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING, null=False, blank=False)
     created_at = models.DateTimeField(auto_now_add=True) 
+    # counted in the sales rollups, see orders/rollups.py
+    rolled_up = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # serves a user's order history, including keyset pages by (created_at, id)
+            models.Index(fields=['user_id', '-created_at', '-id'], name='order_user_created_idx'),
+            # date range exports across all users
+            models.Index(fields=['created_at', 'id'], name='order_created_idx'),
+            # orders still to be added to the sales rollups
+            models.Index(fields=['id'], condition=models.Q(rolled_up=False), name='order_not_rolled_up_idx'),
+        ]
 
     def __str__(self): 
         return f"Order by {self.user_id}"
 
+class OrderItem(models.Model): 
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='order_items') 
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, related_name='order_items', null=True) 
+    quantity = models.PositiveIntegerField(null=False, blank=False) 
+    # prices at the time the order was placed; discount is the deduction per unit
+    unit_price = models.DecimalField(max_digits=20, decimal_places=2, validators=[MinValueValidator(0)], null=False, blank=False)
+    discount = models.DecimalField(max_digits=20, decimal_places=2, validators=[MinValueValidator(0)], default=0, null=False, blank=False)
+    # the promotion that granted the discount, if any
+    promotion = models.ForeignKey('Promotion', on_delete=models.SET_NULL, related_name='order_items', null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'order'], name='orderitem_product_order_idx'),
+        ]
+
+    def __str__(self): 
+        return f"{self.quantity} x {self.product_id} in order {self.order_id}"
+
 class Promotion(models.Model): 
     PERCENTAGE = "percentage"
     FIXED = "fixed"
@@ -56,6 +134,11 @@ class Promotion(models.Model):
     end_date = models.DateTimeField(null=False, blank=False) 
     applicable_products = models.ManyToManyField(Product, related_name='promotions', blank=False)
 
+    class Meta:
+        indexes = [
+            # active promotions: start_date <= now <= end_date
+            models.Index(fields=['end_date', 'start_date'], name='promotion_active_idx'),
+        ]
 
     def __str__(self): 
         return self.name  
@@ -75,4 +158,121 @@ class Promotion(models.Model):
 
     def save(self, *args, **kwargs):
         self.clean()
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+class OutboxEvent(models.Model):
+    PENDING = 'pending'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSED, 'Processed'),
+        (FAILED, 'Failed'),
+    ]
+
+    topic = models.CharField(max_length=100, null=False, blank=False)
+    payload = models.JSONField(null=False, blank=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING, null=False, blank=False)
+    # not handed to a worker before this time: retry backoff, or the lease of the worker processing it
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # events due for a worker: status = pending AND available_at <= now
+            models.Index(fields=['status', 'available_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} event {self.id}"
+
+
+# Sales rollups, maintained per order by orders/rollups.py, so that reports read
+# one row per day (and product or promotion) instead of scanning orders.
+class DailySales(models.Model):
+    day = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"sales on {self.day}"
+
+
+class DailyProductSales(models.Model):
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='dailyproductsales_day_product_uniq'),
+        ]
+
+    def __str__(self):
+        return f"sales of product {self.product_id} on {self.day}"
+
+
+class DailyPromotionSales(models.Model):
+    day = models.DateField()
+    promotion = models.ForeignKey(Promotion, on_delete=models.CASCADE, related_name='daily_sales')
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveBigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'promotion'], name='dailypromotionsales_day_promotion_uniq'),
+        ]
+
+    def __str__(self):
+        return f"sales with promotion {self.promotion_id} on {self.day}"
+
+
+# Order archive, written by the archive_orders command (see orders/archive.py):
+# old delivered and canceled orders leave the Order and OrderItem tables for one
+# compressed row each, in batches recorded with what is needed to verify them.
+class OrderArchiveBatch(models.Model):
+    archived_at = models.DateTimeField(auto_now_add=True)
+    # orders created before the cutoff were eligible
+    cutoff = models.DateTimeField()
+    orders = models.PositiveIntegerField()
+    first_order_id = models.BigIntegerField()
+    last_order_id = models.BigIntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    total_price = models.DecimalField(max_digits=20, decimal_places=2)
+    # sha256 of the documents of the batch's orders, in id order
+    checksum = models.CharField(max_length=64)
+
+    def __str__(self):
+        return f"archive batch {self.id} of {self.orders} orders"
+
+
+class ArchivedOrder(models.Model):
+    # the id the order had
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    batch = models.ForeignKey(OrderArchiveBatch, on_delete=models.PROTECT, related_name='archived_orders')
+    # the order as the order listing renders it, as zlib-compressed JSON
+    document = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            # a user's archived history, including keyset pages by (created_at, id)
+            models.Index(fields=['user', '-created_at', '-id'], name='archivedorder_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived order {self.id} by {self.user_id}"
@@ -0,0 +1,78 @@
+"""Bulk order status changes, following Order.TRANSITIONS."""
+from django.db.models import Case, F, PositiveIntegerField, Sum, Value, When
+
+from . import rollups
+from .models import Order, OrderItem, Product, StockStripe
+from .stock_stripes import stripe_index
+from .versions import PRODUCT, data_changed
+
+
+def sources(target):
+    return [status for status, targets in Order.TRANSITIONS.items() if target in targets]
+
+
+def change_status(order_ids, target):
+    """
+    Move the orders in `order_ids` to `target` with one UPDATE, restocking their
+    products and taking them out of the sales rollups when canceling. Must run in a transaction; returns (updated ids, skipped),
+    with skipped a list of {'id', 'reason'}.
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    locked = Order.objects.select_for_update().filter(id__in=order_ids).order_by('id').values_list('id', 'status', 'rolled_up')
+    current, rolled_up = {}, set()
+    for order_id, status, counted in locked:
+        current[order_id] = status
+        if counted:
+            rolled_up.add(order_id)
+    allowed = sources(target)
+
+    updated, skipped = [], []
+    for order_id in order_ids:
+        status = current.get(order_id)
+        if status is None:
+            skipped.append({'id': order_id, 'reason': "Order not found."})
+        elif status == target:
+            skipped.append({'id': order_id, 'reason': f"Order is already {target}."})
+        elif status not in allowed:
+            skipped.append({'id': order_id, 'reason': f"Cannot change status from {status} to {target}."})
+        else:
+            updated.append(order_id)
+
+    if updated:
+        Order.objects.filter(id__in=updated).update(status=target)
+        if target == Order.CANCELED:
+            restock(updated)
+            # orders not counted yet are skipped when they are, now that they are canceled
+            rollups.remove_orders([order_id for order_id in updated if order_id in rolled_up])
+    return updated, skipped
+
+
+def added_stock(column, quantities, key):
+    return F(column) + Case(
+        *[When(**{key: product_id}, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=Value(0),
+        output_field=PositiveIntegerField(),
+    )
+
+
+def restock(order_ids):
+    """Put the items of `order_ids` back in stock, with one UPDATE for all products."""
+    quantities = dict(
+        OrderItem.objects.filter(order_id__in=order_ids, product__isnull=False)
+        .values('product_id').annotate(quantity=Sum('quantity')).values_list('product_id', 'quantity')
+    )
+    if not quantities:
+        return
+
+    # Rows are locked in id order first, like order placement does, so the UPDATE cannot deadlock with it.
+    striped = stripe_index.stripe_counts(quantities)
+    unstriped = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in striped}
+    if unstriped:
+        list(Product.objects.select_for_update().filter(id__in=unstriped).order_by('id').values_list('id'))
+        Product.objects.filter(id__in=unstriped).update(stock=added_stock('stock', unstriped, 'id'))
+    if striped:
+        # into the first stripe; rebalance_stock spreads it out
+        striped = {product_id: quantities[product_id] for product_id in striped}
+        list(StockStripe.objects.select_for_update().filter(product_id__in=striped, index=0).order_by('product_id').values_list('id'))
+        StockStripe.objects.filter(product_id__in=striped, index=0).update(stock=added_stock('stock', striped, 'product_id'))
+    data_changed(PRODUCT)
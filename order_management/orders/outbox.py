@@ -0,0 +1,114 @@
+"""
+Transactional outbox for work that follows an order, such as notifications,
+analytics or ERP sync.
+
+`publish()` writes an event row in the caller's transaction, so an event exists
+exactly when the order it describes was committed, and the request never waits
+for downstream systems. The process_outbox command hands due events to the
+handlers registered for their topic, outside of any order transaction.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+
+logger = logging.getLogger(__name__)
+
+ORDER_CREATED = 'order.created'
+
+# topic -> handler(event)
+handlers = {}
+
+
+def handler(topic):
+    """Register the decorated function to process events of `topic`; it must tolerate redelivery."""
+    def register(function):
+        handlers[topic] = function
+        return function
+    return register
+
+
+def publish(topic, payload):
+    return OutboxEvent.objects.create(topic=topic, payload=payload)
+
+
+def publish_many(topic, payloads):
+    return OutboxEvent.objects.bulk_create([OutboxEvent(topic=topic, payload=payload) for payload in payloads])
+
+
+def order_created_payload(order):
+    return {
+        'order_id': order.id,
+        'user_id': order.user_id_id,
+        'total_price': str(order.total_price),
+        'status': order.status,
+    }
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(
+        settings.OUTBOX_RETRY_BASE_DELAY * 2 ** (attempts - 1),
+        settings.OUTBOX_RETRY_MAX_DELAY,
+    ))
+
+
+def claim(batch_size):
+    """
+    Claim up to `batch_size` due events for this worker.
+
+    Rows locked by other workers are skipped rather than waited for, and the
+    claimed ones are leased by moving `available_at` forward, so the row locks
+    are released before any handler runs. Events of a worker that dies are
+    picked up again once their lease expires.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEvent.PENDING, available_at__lte=now, topic__in=list(handlers))
+            .order_by('available_at', 'id')[:batch_size]
+        )
+        if events:
+            OutboxEvent.objects.filter(id__in=[event.id for event in events]).update(
+                available_at=now + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS),
+                attempts=F('attempts') + 1,
+            )
+    for event in events:
+        event.attempts += 1
+    return events
+
+
+def dispatch(event):
+    try:
+        handlers[event.topic](event)
+    except Exception as error:
+        logger.exception("Outbox event %s (%s) failed on attempt %s", event.id, event.topic, event.attempts)
+        event.last_error = repr(error)
+        if event.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            event.status = OutboxEvent.FAILED
+        else:
+            event.available_at = timezone.now() + retry_delay(event.attempts)
+        event.save(update_fields=['status', 'available_at', 'last_error'])
+        return False
+
+    event.status = OutboxEvent.PROCESSED
+    event.processed_at = timezone.now()
+    event.save(update_fields=['status', 'processed_at'])
+    return True
+
+
+def process_batch(batch_size=100):
+    """Claim and dispatch one batch of events; returns (processed, failed) counts."""
+    processed = failed = 0
+    for event in claim(batch_size):
+        if dispatch(event):
+            processed += 1
+        else:
+            failed += 1
+    return processed, failed
@@ -0,0 +1,82 @@
+import threading
+from bisect import bisect_right
+
+from django.utils import timezone
+
+from order_management.db_routing import use_primary
+
+from .models import Promotion
+from .versions import PROMOTION, bump_version, current_version
+
+
+class PromotionIndex:
+    """
+    Per-worker index of current and upcoming promotions, keyed by product.
+
+    Every worker keeps its own copy and compares it against a version stamp in
+    the shared cache, so a promotion change made through any worker is picked up
+    by all of them on their next lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        # product_id -> (start dates, promotions), both sorted by start date
+        self._promotions = {}
+
+    def invalidate(self):
+        bump_version(PROMOTION)
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._promotions = {}
+
+    def refresh(self, version):
+        # Promotions that have not started yet are indexed too, so one that begins
+        # between two refreshes is applied as soon as its start date passes.
+        with use_primary():
+            rows = list(Promotion.applicable_products.through.objects.filter(
+                promotion__end_date__gte=timezone.now(),
+            ).values_list(
+                'product_id',
+                'promotion__start_date',
+                'promotion__end_date',
+                'promotion__discount_type',
+                'promotion__value',
+                'promotion_id',
+            ).order_by('promotion__start_date'))
+
+        promotions = {}
+        for product_id, start_date, end_date, discount_type, value, promotion_id in rows:
+            starts, entries = promotions.setdefault(product_id, ([], []))
+            starts.append(start_date)
+            entries.append((end_date, discount_type, value, promotion_id))
+
+        with self._lock:
+            self._version = version
+            self._promotions = promotions
+
+    def active_promotions(self, product_ids, at=None):
+        """Return {product_id: [(discount_type, value, promotion_id), ...]} for promotions active at `at`."""
+        version = current_version(PROMOTION)
+        if version != self._version:
+            self.refresh(version)
+
+        at = at or timezone.now()
+        index = self._promotions
+        active = {}
+        for product_id in product_ids:
+            if product_id not in index:
+                continue
+            starts, entries = index[product_id]
+            # Only promotions that started by `at` are candidates; expired ones are skipped.
+            active[product_id] = [
+                (discount_type, value, promotion_id)
+                for end_date, discount_type, value, promotion_id in entries[:bisect_right(starts, at)]
+                if end_date >= at
+            ]
+        return active
+
+
+promotion_index = PromotionIndex()
@@ -0,0 +1,101 @@
+import hashlib
+from bisect import bisect_right
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.cache import parse_etags
+from django.utils.http import urlencode
+from rest_framework import status
+from rest_framework.response import Response
+
+from order_management.db_routing import use_primary
+
+from .models import Promotion
+from .versions import PROMOTION, current_version
+
+
+RESPONSE_KEY = 'orders:response:{etag}'
+BOUNDARIES_KEY = 'orders:promotion_boundaries:{version}'
+
+
+def promotion_boundaries(version):
+    """Sorted start and end dates, still ahead, of the promotions at `version`."""
+    key = BOUNDARIES_KEY.format(version=version)
+    boundaries = cache.get(key)
+    if boundaries is None:
+        now = timezone.now()
+        with use_primary():
+            rows = list(Promotion.objects.filter(end_date__gte=now).values_list('start_date', 'end_date'))
+        boundaries = sorted({date for row in rows for date in row if date >= now})
+        cache.set(key, boundaries, timeout=settings.RESPONSE_CACHE_TIMEOUT)
+    return boundaries
+
+
+def next_promotion_boundary(version):
+    # Which promotions are active only changes when a start or end date passes,
+    # so the next boundary identifies the current active set for this version.
+    boundaries = promotion_boundaries(version)
+    index = bisect_right(boundaries, timezone.now())
+    return boundaries[index] if index < len(boundaries) else None
+
+
+def listing_etag(request, name):
+    """
+    Strong ETag of a listing, derived from the version of `name` and the request alone
+    so that a matching If-None-Match is answered before the listing is looked up or built.
+    """
+    version = current_version(name)
+    parts = [name, version, request.get_host(), urlencode(sorted(request.GET.items()))]
+
+    if name == PROMOTION:
+        boundary = next_promotion_boundary(version)
+        parts.append(boundary.isoformat() if boundary else '')
+
+    return '"%s"' % hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+def is_not_modified(request, etag):
+    return etag in parse_etags(request.headers.get('If-None-Match', ''))
+
+
+def response_key(etag):
+    return RESPONSE_KEY.format(etag=etag.strip('"'))
+
+
+def cached_listing(request, name, build_response):
+    """Serve a listing from the response cache, keyed by the version of `name`."""
+    etag = listing_etag(request, name)
+    if is_not_modified(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+    key = response_key(etag)
+    data = cache.get(key)
+    if data is None:
+        # built from the primary, as a lagging replica would cache stale rows under the new version
+        with use_primary():
+            response = build_response(request)
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        data = response.data
+        cache.set(key, data, timeout=settings.RESPONSE_CACHE_TIMEOUT)
+    return Response(data, headers={'ETag': etag})
+
+
+async def acached_listing(request, name, build_data):
+    """
+    cached_listing() for async views, where `build_data` is a coroutine function
+    returning the listing data. Returns (etag, data), with data None for a 304.
+    """
+    etag = await sync_to_async(listing_etag)(request, name)
+    if is_not_modified(request, etag):
+        return etag, None
+
+    key = response_key(etag)
+    data = await cache.aget(key)
+    if data is None:
+        with use_primary():
+            data = await build_data(request)
+        await cache.aset(key, data, timeout=settings.RESPONSE_CACHE_TIMEOUT)
+    return etag, data
@@ -0,0 +1,138 @@
+"""
+Sales rollups: orders, units, revenue and discounts per day, per day and
+product, and per day and promotion.
+
+Orders are added by the outbox handler of order.created (see handlers.py)
+once committed, so order placement never waits on the rollup rows, and by
+the rollup_sales command for any order still missing. Order.rolled_up is set
+in the same transaction as the increments, so an order is counted only once
+however often it is handed in. Canceled orders are not counted: they are
+taken back out by remove_orders() when canceled after they were added.
+"""
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+
+from .archive import archived_through
+from .models import DailyProductSales, DailyPromotionSales, DailySales, Order, OrderItem
+
+
+# rollup model -> the OrderItem field it is keyed by besides the day
+ROLLUPS = (
+    (DailySales, None),
+    (DailyProductSales, 'product_id'),
+    (DailyPromotionSales, 'promotion_id'),
+)
+FIGURES = ('orders', 'units', 'revenue', 'discount')
+
+REBUILD_BATCH_SIZE = 1000
+
+MONEY = DecimalField(max_digits=20, decimal_places=2)
+FIGURE_FIELDS = {'orders': IntegerField(), 'units': IntegerField(), 'revenue': MONEY, 'discount': MONEY}
+
+
+def aggregate(lines, key):
+    """Sum OrderItem `lines` by day, and by `key` unless it is None."""
+    keys = ['day'] if key is None else ['day', key]
+    if key is not None:
+        lines = lines.filter(**{f'{key}__isnull': False})
+    return lines.annotate(day=TruncDate('order__created_at')).values(*keys).annotate(
+        orders=Count('order_id', distinct=True),
+        units=Sum('quantity'),
+        revenue=Sum(ExpressionWrapper((F('unit_price') - F('discount')) * F('quantity'), output_field=MONEY)),
+        discount=Sum(ExpressionWrapper(F('discount') * F('quantity'), output_field=MONEY)),
+    ).order_by(*keys)
+
+
+def rollup_key(row, key):
+    lookup = {'day': row['day']}
+    if key is not None:
+        lookup[key] = row[key]
+    return lookup
+
+
+def record_orders(order_ids):
+    """Add the orders among `order_ids` that are not counted yet to the rollups; returns how many."""
+    with transaction.atomic():
+        # Waits for orders locked by a status change, an archive batch or another
+        # worker counting them, so that an outbox event is only done once its
+        # order is counted; those counted meanwhile no longer match.
+        pending = list(
+            Order.objects.select_for_update().filter(id__in=order_ids, rolled_up=False).order_by('id').values_list('id', flat=True)
+        )
+        if not pending:
+            return 0
+        Order.objects.filter(id__in=pending).update(rolled_up=True)
+
+        lines = OrderItem.objects.filter(order_id__in=pending).exclude(order__status=Order.CANCELED)
+        for model, key in ROLLUPS:
+            rows = list(aggregate(lines, key))
+            # rows are created empty first, so that concurrent workers only ever
+            # increment them; both go in (day, key) order, which avoids deadlocks
+            model.objects.bulk_create([model(**rollup_key(row, key)) for row in rows], ignore_conflicts=True)
+            for row in rows:
+                model.objects.filter(**rollup_key(row, key)).update(**{
+                    figure: F(figure) + row[figure] for figure in FIGURES
+                })
+    return len(pending)
+
+
+def remove_orders(order_ids):
+    """
+    Take the counted orders `order_ids` back out of the rollups, with one UPDATE
+    per rollup model. Must run in the transaction that locked the orders.
+    """
+    lines = OrderItem.objects.filter(order_id__in=order_ids)
+    for model, key in ROLLUPS:
+        rows = list(aggregate(lines, key))
+        if not rows:
+            continue
+        matches = [Q(**rollup_key(row, key)) for row in rows]
+        rollups = model.objects.filter(reduce(or_, matches))
+        # locked in (day, key) order first, like record_orders() increments them
+        list(rollups.select_for_update().order_by(*(['day'] if key is None else ['day', key])).values_list('id'))
+        rollups.update(**{
+            figure: F(figure) - Case(
+                *[When(match, then=Value(row[figure])) for match, row in zip(matches, rows)],
+                default=Value(0), output_field=FIGURE_FIELDS[figure],
+            )
+            for figure in FIGURES
+        })
+
+
+def rebuild():
+    """
+    Recompute all rollups from the order items and mark every order as counted.
+    Days up to the last archived order are kept as they are, as the items of
+    archived orders are no longer there to count; orders of those days that were
+    not counted yet are added to them instead.
+    """
+    archived = archived_through()
+    with transaction.atomic():
+        pending = Order.objects.filter(rolled_up=False)
+        if archived is not None:
+            # waits for the rows locked elsewhere, as those orders are only counted here
+            record_orders(pending.filter(created_at__date__lte=archived).values_list('id', flat=True))
+            pending = pending.filter(created_at__date__gt=archived)
+        pending.update(rolled_up=True)
+        lines = OrderItem.objects.filter(order__rolled_up=True).exclude(order__status=Order.CANCELED)
+        counts = {}
+        for model, key in ROLLUPS:
+            rows = aggregate(lines, key)
+            if archived is None:
+                model.objects.all().delete()
+            else:
+                model.objects.filter(day__gt=archived).delete()
+                rows = rows.filter(day__gt=archived)
+            batch = []
+            counts[model.__name__] = 0
+            for row in rows.iterator(chunk_size=REBUILD_BATCH_SIZE):
+                batch.append(model(**row))
+                if len(batch) >= REBUILD_BATCH_SIZE:
+                    counts[model.__name__] += len(model.objects.bulk_create(batch))
+                    batch = []
+            counts[model.__name__] += len(model.objects.bulk_create(batch))
+    return counts
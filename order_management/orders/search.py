@@ -0,0 +1,148 @@
+"""
+Product search by name.
+
+Three ways to match the query: PREFIX (the name starts with it), SUBSTRING
+(the name contains it) and WORDS (a word of the name starts with one of the
+words of the query; names matching more of them rank first). Matching ignores
+case.
+
+On PostgreSQL the matches are found by the database, with a trigram GIN index
+on Product.name that create_trigram_index() adds after migrating. Other
+backends use SearchIndex, a per-worker inverted index of the names, versioned
+like PromotionIndex and bumped by the product signals when a name changes.
+"""
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter
+
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from order_management.db_routing import use_primary
+
+from .models import Product
+from .versions import PRODUCT_NAMES, current_version
+
+
+PREFIX = 'prefix'
+SUBSTRING = 'substring'
+WORDS = 'words'
+MATCH_CHOICES = [PREFIX, SUBSTRING, WORDS]
+
+TRIGRAM_INDEX = 'product_name_trgm_idx'
+
+
+def words(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def create_trigram_index(using=DEFAULT_DB_ALIAS, **kwargs):
+    # post_migrate handler: migrations are generated on deploy, and a GIN index
+    # with an operator class from an extension cannot be declared portably.
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} ON {Product._meta.db_table} '
+            f'USING gin (name gin_trgm_ops)'
+        )
+
+
+class SearchIndex:
+    """
+    Per-worker inverted index of product names: each word maps to the ids of
+    the products whose name contains it.
+
+    Prefix lookups find the range of words starting with a query word in the
+    sorted vocabulary; substrings are looked for in the lowercased names.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        # (product id -> lowercased name, word -> product ids, all words sorted),
+        # replaced as a whole so that a search never mixes two refreshes
+        self._index = ({}, {}, [])
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._index = ({}, {}, [])
+
+    def refresh(self, version):
+        names, postings = {}, {}
+        with use_primary():
+            rows = Product.objects.order_by('id').values_list('id', 'name').iterator(chunk_size=10000)
+            for product_id, name in rows:
+                names[product_id] = name.lower()
+                for word in set(words(name)):
+                    postings.setdefault(word, []).append(product_id)
+
+        with self._lock:
+            self._version = version
+            self._index = (names, postings, sorted(postings))
+
+    def ensure_current(self):
+        version = current_version(PRODUCT_NAMES)
+        if version != self._version:
+            self.refresh(version)
+
+    def search(self, query, match):
+        """Ids of the products matching `query`, best first, then by id."""
+        self.ensure_current()
+        names, postings, vocabulary = self._index
+        query = query.lower()
+
+        def with_prefix(prefix):
+            # ids of the products with a word starting with `prefix`
+            ids = set()
+            for i in range(bisect_left(vocabulary, prefix), len(vocabulary)):
+                if not vocabulary[i].startswith(prefix):
+                    break
+                ids.update(postings[vocabulary[i]])
+            return ids
+
+        if match == WORDS:
+            ranks = Counter()
+            for word in set(words(query)):
+                ranks.update(with_prefix(word))
+            return sorted(ranks, key=lambda product_id: (-ranks[product_id], product_id))
+
+        if match == PREFIX:
+            query_words = words(query)
+            candidates = with_prefix(query_words[0]) if query_words else names
+            return sorted(product_id for product_id in candidates if names[product_id].startswith(query))
+
+        return sorted(product_id for product_id, name in names.items() if query in name)
+
+
+search_index = SearchIndex()
+
+
+def database_search(query, match):
+    # iregex rather than icontains/istartswith, whose UPPER() the trigram index does not cover
+    products = Product.objects.all()
+    if match == PREFIX:
+        return products.filter(name__iregex='^' + re.escape(query)).order_by('id')
+    if match == SUBSTRING:
+        return products.filter(name__iregex=re.escape(query)).order_by('id')
+
+    conditions = [Q(name__iregex=r'\m' + word) for word in dict.fromkeys(words(query))]
+    if not conditions:
+        return products.none()
+    rank = sum((Case(When(condition, then=Value(1)), default=Value(0), output_field=IntegerField())
+                for condition in conditions), Value(0))
+    matches = Q()
+    for condition in conditions:
+        matches |= condition
+    return products.filter(matches).alias(rank=rank).order_by('-rank', 'id')
+
+
+def search_product_ids(query, match):
+    """Ids of the products matching `query`, best first: a queryset on PostgreSQL, a list otherwise."""
+    if connections[router.db_for_read(Product)].vendor == 'postgresql':
+        return database_search(query, match).values_list('id', flat=True)
+    return search_index.search(query, match)
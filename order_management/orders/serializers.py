@@ -1,17 +1,85 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from django.db import transaction
+from . import stock_stripes
 from .models import Product, Promotion, Order 
+from .search import MATCH_CHOICES, WORDS
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ['id', 'name', 'price', 'stock']
+        fields = ['id', 'sku', 'name', 'price', 'stock']
         read_only_fields = ['id']
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # the summed stripes of a striped product, when annotated with Product.objects.with_stock()
+        total_stock = getattr(instance, 'total_stock', None)
+        if total_stock is not None:
+            data['stock'] = total_stock
+        return data
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        if 'stock' in validated_data and stock_stripes.stripe_index.stripe_counts([instance.id]):
+            stock_stripes.set_total({instance.id: instance.stock})
+            instance.total_stock, instance.stock = instance.stock, 0
+        return instance
+
+
+class ProductSearchSerializer(serializers.Serializer):
+    search = serializers.CharField(max_length=200)
+    match = serializers.ChoiceField(choices=MATCH_CHOICES, default=WORDS)
+
+
+class ProductImportSerializer(serializers.Serializer):
+    # A plain serializer, so validating a row runs no query; SKUs are matched by the upsert.
+    sku = serializers.CharField(max_length=64)
+    name = serializers.CharField(max_length=200)
+    price = serializers.DecimalField(max_digits=20, decimal_places=2, min_value=Decimal('0'))
+    stock = serializers.IntegerField(min_value=0, max_value=2147483647)
+
+
+class ProductIdsField(serializers.Field):
+    """Many-to-many product ids, looked up with one query instead of one per id."""
+
+    default_error_messages = {
+        'not_a_list': 'Expected a list of items but got type "{input_type}".',
+        'empty': 'This list may not be empty.',
+        'incorrect_type': 'Incorrect type. Expected pk value, received {data_type}.',
+        'does_not_exist': 'Invalid pk "{pk_value}" - object does not exist.',
+    }
+
+    def to_representation(self, value):
+        return [product.pk for product in value.all()]
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not data:
+            self.fail('empty')
+        pks = []
+        for pk in data:
+            if isinstance(pk, bool) or not isinstance(pk, (int, str)):
+                self.fail('incorrect_type', data_type=type(pk).__name__)
+            try:
+                pks.append(int(pk))
+            except ValueError:
+                self.fail('incorrect_type', data_type=type(pk).__name__)
+
+        products = Product.objects.in_bulk(pks)
+        for pk in pks:
+            if pk not in products:
+                self.fail('does_not_exist', pk_value=pk)
+        return list(products.values())
+
 
 class PromotionSerializer(serializers.ModelSerializer): 
+    applicable_products = ProductIdsField()
+
     class Meta:
         model = Promotion
         fields = '__all__'
@@ -41,14 +109,107 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ['items', 'status']
 
-    def validate(self, data):
-        items = data.get('items', [])
+    def validate_items(self, items):
+        # Existence and stock are checked by OrderView.create_order against the
+        # locked product rows, so only the shape of the cart is validated here.
+        if not isinstance(items, list) or not items:
+            raise serializers.ValidationError("Items must be a non-empty list.")
+
         for item in items:
-            try: 
-                product = Product.objects.get(id=item['product_id'])
-            except Product.DoesNotExist:
-                raise ValidationError(f"Product with ID {item['product_id']} does not exist.")
-
-            if product.stock < item['quantity']:
-                raise serializers.ValidationError(f"Not enough stock for product {product.name}")
-        return data
\ No newline at end of file
+            if not isinstance(item, dict) or 'product_id' not in item or 'quantity' not in item:
+                raise serializers.ValidationError("Each item must have a product_id and a quantity.")
+
+            product_id = item['product_id']
+            if not isinstance(product_id, int) or isinstance(product_id, bool):
+                raise serializers.ValidationError("Product ID must be an integer.")
+
+            quantity = item['quantity']
+            if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+                raise serializers.ValidationError("Quantity must be a positive integer.")
+        return items
+
+
+class OrderListSerializer(OrderSerializer):
+    items = serializers.SerializerMethodField()
+
+    def get_items(self, order):
+        # Rendered from the prefetched order_items; orders placed before OrderItem
+        # existed fall back to their JSON items until backfill_order_items has run.
+        order_items = order.order_items.all()
+        if not order_items:
+            return order.items
+        return [
+            {'product_id': order_item.product_id, 'quantity': order_item.quantity}
+            for order_item in order_items
+        ]
+
+
+class BatchOrderSerializer(serializers.Serializer):
+    MAX_ORDERS = 500
+
+    orders = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=MAX_ORDERS)
+
+
+class OrderFilterSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES, required=False)
+    user = serializers.IntegerField(min_value=1, required=False)
+    # created_after <= created_at < created_before
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        created_after = data.get('created_after')
+        created_before = data.get('created_before')
+        if created_after and created_before and created_before <= created_after:
+            raise serializers.ValidationError({'created_before': "Must be later than created_after."})
+        return data
+
+
+class ReportRangeSerializer(serializers.Serializer):
+    MAX_LIMIT = 1000
+
+    # both days included
+    start = serializers.DateField()
+    end = serializers.DateField()
+    limit = serializers.IntegerField(min_value=1, max_value=MAX_LIMIT, default=100)
+
+    def validate(self, data):
+        if data['end'] < data['start']:
+            raise serializers.ValidationError({'end': "End date cannot be before the start date."})
+        return data
+
+
+class SalesFiguresSerializer(serializers.Serializer):
+    orders = serializers.IntegerField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=20, decimal_places=2)
+    discount = serializers.DecimalField(max_digits=20, decimal_places=2)
+
+
+class DailySalesReportSerializer(SalesFiguresSerializer):
+    day = serializers.DateField()
+
+
+class ProductSalesReportSerializer(SalesFiguresSerializer):
+    product_id = serializers.IntegerField()
+    name = serializers.CharField(source='product__name')
+
+
+class PromotionSalesReportSerializer(SalesFiguresSerializer):
+    promotion_id = serializers.IntegerField()
+    name = serializers.CharField(source='promotion__name')
+
+
+class OrderStatusUpdateSerializer(serializers.Serializer):
+    MAX_ORDERS = 10000
+
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+    # either explicit ids or a filter selecting the orders
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                max_length=MAX_ORDERS, required=False)
+    filter = OrderFilterSerializer(required=False)
+
+    def validate(self, data):
+        if ('ids' in data) == ('filter' in data):
+            raise serializers.ValidationError("Give either ids or a filter.")
+        return data
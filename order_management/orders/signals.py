@@ -0,0 +1,40 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Product, Promotion
+from .versions import PRODUCT, PRODUCT_NAMES, PROMOTION, data_changed
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, **kwargs):
+    data_changed(PRODUCT)
+
+
+# Stock and price updates leave the search index of every worker as it is: only
+# a name other than the one the product was loaded with changes it.
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'name' not in update_fields:
+        return
+    if created or getattr(instance, '_loaded_name', None) != instance.name:
+        data_changed(PRODUCT_NAMES)
+    instance._loaded_name = instance.name
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, **kwargs):
+    data_changed(PRODUCT_NAMES)
+
+
+# The promotion version also invalidates the promotion index of every worker.
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+def promotion_changed(sender, **kwargs):
+    data_changed(PROMOTION)
+
+
+@receiver(m2m_changed, sender=Promotion.applicable_products.through)
+def applicable_products_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        data_changed(PROMOTION)
@@ -0,0 +1,152 @@
+"""
+Striped inventory for high-contention products.
+
+A product split with the stripe_stock command keeps its stock in N StockStripe
+rows instead of Product.stock, which stays 0 while it is striped: a worker
+whose stripe index has not caught up yet treats the product as unstriped, and
+then finds no stock to sell twice. The total is read with
+Product.objects.with_stock(). An order takes its quantity from one randomly
+chosen stripe with a conditional UPDATE, so concurrent orders for the product
+mostly lock different rows; only when no stripe it tries holds enough does it
+lock all stripes of the product and take from several. rebalance_stock evens
+the stripes out again in the background.
+"""
+import random
+import threading
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from order_management.db_routing import use_primary
+
+from .models import Product, StockStripe
+from .versions import STOCK_STRIPES, current_version, data_changed
+
+
+# stripes tried with a conditional UPDATE before falling back to locking them all
+MAX_PROBES = 2
+
+
+class StripeIndex:
+    """Per-worker map of striped product ids to their number of stripes, versioned like PromotionIndex."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._counts = {}
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._counts = {}
+
+    def refresh(self, version):
+        with use_primary():
+            counts = dict(StockStripe.objects.order_by().values('product_id').annotate(n=Count('id')).values_list('product_id', 'n'))
+        with self._lock:
+            self._version = version
+            self._counts = counts
+
+    def stripe_counts(self, product_ids):
+        """Return {product_id: number of stripes} for the striped ones among `product_ids`."""
+        version = current_version(STOCK_STRIPES)
+        if version != self._version:
+            self.refresh(version)
+        counts = self._counts
+        return {product_id: counts[product_id] for product_id in product_ids if product_id in counts}
+
+
+stripe_index = StripeIndex()
+
+
+def lock_stripes(product_ids):
+    """Lock the stripes of `product_ids`, in product and stripe order; returns {product_id: [stripes]}."""
+    stripes = {}
+    for stripe in StockStripe.objects.select_for_update().filter(product_id__in=product_ids).order_by('product_id', 'index'):
+        stripes.setdefault(stripe.product_id, []).append(stripe)
+    return stripes
+
+
+def deduct(stripes, quantity):
+    # fullest stripes first, leaving the small ones for orders that fit in them
+    for stripe in sorted(stripes, key=lambda stripe: -stripe.stock):
+        taken = min(stripe.stock, quantity)
+        stripe.stock -= taken
+        quantity -= taken
+        if not quantity:
+            break
+
+
+def spread(stripes, total):
+    share, remainder = divmod(total, len(stripes))
+    for stripe in stripes:
+        stripe.stock = share + (1 if stripe.index < remainder else 0)
+
+
+def take(product_id, quantity, count):
+    """Take `quantity` from the `count` stripes of a product; returns False when they hold less in total."""
+    start = random.randrange(count)
+    for offset in range(min(count, MAX_PROBES)):
+        index = (start + offset) % count
+        if StockStripe.objects.filter(product_id=product_id, index=index, stock__gte=quantity).update(stock=F('stock') - quantity):
+            return True
+
+    stripes = lock_stripes([product_id]).get(product_id, [])
+    if sum(stripe.stock for stripe in stripes) < quantity:
+        return False
+    deduct(stripes, quantity)
+    StockStripe.objects.bulk_update(stripes, ['stock'])
+    return True
+
+
+def set_total(product_ids_totals):
+    """Spread new totals, {product_id: stock}, over the stripes of striped products, emptying their column."""
+    with transaction.atomic():
+        stripes = lock_stripes(product_ids_totals.keys())
+        changed = []
+        for product_id, product_stripes in stripes.items():
+            spread(product_stripes, product_ids_totals[product_id])
+            changed.extend(product_stripes)
+        StockStripe.objects.bulk_update(changed, ['stock'])
+        if stripes:
+            Product.objects.filter(id__in=stripes.keys()).update(stock=0)
+
+
+def split_stock(product_id, count):
+    """Split the stock of a product over `count` stripes, or move it back to Product.stock when `count` is 0."""
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(id=product_id)
+        stripes = lock_stripes([product_id]).get(product_id)
+        total = sum(existing.stock for existing in stripes) if stripes else product.stock
+
+        StockStripe.objects.filter(product_id=product_id).delete()
+        if count:
+            new_stripes = [StockStripe(product_id=product_id, index=index) for index in range(count)]
+            spread(new_stripes, total)
+            StockStripe.objects.bulk_create(new_stripes)
+        product.stock = 0 if count else total
+        product.save(update_fields=['stock'])
+        data_changed(STOCK_STRIPES)
+    return total
+
+
+def empty_columns():
+    """Empty Product.stock of striped products that still hold stock there, from before it stayed 0; returns how many."""
+    return Product.objects.filter(id__in=StockStripe.objects.values('product_id')).exclude(stock=0).update(stock=0)
+
+
+def rebalance(product_id, threshold=0.5):
+    """
+    Even out the stripes of a product once one holds less than `threshold` of
+    its even share. Returns the total if it was rebalanced, else None.
+    """
+    with transaction.atomic():
+        stripes = lock_stripes([product_id]).get(product_id)
+        if not stripes:
+            return None
+        total = sum(stripe.stock for stripe in stripes)
+        if min(stripe.stock for stripe in stripes) >= threshold * total / len(stripes):
+            return None
+        spread(stripes, total)
+        StockStripe.objects.bulk_update(stripes, ['stock'])
+    return total
@@ -0,0 +1,79 @@
+"""Formats and helpers shared by the streaming catalogue and order exports."""
+import csv
+import json
+import os
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+
+CONTENT_TYPES = {
+    CSV: 'text/csv',
+    NDJSON: 'application/x-ndjson',
+}
+EXTENSIONS = {
+    '.csv': CSV,
+    '.ndjson': NDJSON,
+    '.jsonl': NDJSON,
+}
+
+# bytes of output gathered before a piece is handed to the response or file
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+def format_for_content_type(content_type):
+    content_type = content_type.split(';')[0].strip().lower()
+    for file_format, known in CONTENT_TYPES.items():
+        if content_type == known:
+            return file_format
+    if content_type in ('application/ndjson', 'application/jsonl', 'application/json-lines'):
+        return NDJSON
+    return None
+
+
+def format_for_filename(filename):
+    return EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+class Echo:
+    """File-like object whose write() returns what was written, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def csv_value(value, encoder=DjangoJSONEncoder()):
+    # dates, times and decimals as in the NDJSON output; nested data as JSON
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return encoder.default(value)
+
+
+def lines(file_format, fields, rows):
+    """Yield one line of text per row, tuples of `fields` values, plus a CSV header."""
+    if file_format == CSV:
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow([csv_value(value) for value in row])
+        return
+
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def buffered(pieces, size=WRITE_BUFFER_SIZE):
+    """Join small text pieces into ones of about `size` characters."""
+    buffer, length = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
@@ -1,16 +1,48 @@
-from django.test import TestCase
-from django.db import connection
+from asgiref.sync import async_to_sync
+from django.test import TestCase, TransactionTestCase, AsyncClient, RequestFactory
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.core.cache import cache
+from django.db import connection, connections, router, transaction
+from django.http import HttpResponse
+from django.db.models import Prefetch, Sum
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
-from django.utils.timezone import now
+from django.utils.timezone import localdate, now
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
 from rest_framework import status 
+from rest_framework.exceptions import Throttled
+from rest_framework.renderers import JSONRenderer
 from rest_framework_simplejwt.tokens import RefreshToken
 from datetime import datetime, timedelta
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import StringIO
+import json
+import threading
+import time
 
 import pytest 
 
-from .models import Product, Promotion, Order 
+from .models import (
+    Product, Promotion, Order, OrderItem, OutboxEvent, StockStripe, DailySales, DailyProductSales, ArchivedOrder,
+    OrderArchiveBatch,
+)
+from .promotion_index import promotion_index
+from .stock_stripes import stripe_index, split_stock
+from .search import search_index
+from .serializers import OrderListSerializer, ProductSerializer
+from .versions import PRODUCT_NAMES, STOCK_STRIPES, bump_version, current_version
+from . import admission, archive, outbox, rendering, rollups
+from .benchmark import (
+    run_benchmark, run_login_flood_benchmark, run_read_capacity_benchmark, run_render_benchmark, run_search_benchmark,
+)
+from order_management.metrics import registry
+from order_management.startup import measure_startup
+from order_management.testing import assert_query_budget
+from order_management.db_routing import ReplicaRoutingMiddleware, is_pinned, pin, pins, use_primary
 
 
 def authenticate(user):
@@ -22,6 +54,20 @@ def authenticate(user):
 
     return client 
 
+@pytest.fixture(autouse=True) 
+def fresh_promotion_index(): 
+    # rolled back test data does not send signals, so start every test from an empty index
+    promotion_index.clear()
+    promotion_index.invalidate()
+    stripe_index.clear()
+    bump_version(STOCK_STRIPES)
+    search_index.clear()
+    # admission buckets and in-flight counts are kept by user and product id
+    admission.clear()
+    # so are the users pinned to the primary
+    pins.clear()
+    cache.clear()
+
 @pytest.fixture 
 def authenticated_admin_user(): 
     user = User.objects.create_user(username="user", password="user123", is_staff=True)  
@@ -148,3 +194,1278 @@ def test_invalid_promotion_creation_as_admin(authenticated_admin_user):
 
     assert response.status_code == status.HTTP_400_BAD_REQUEST
     assert response.data == {'end_date': ["End date cannot be before the start date.(API)"]}
+
+
+@pytest.mark.django_db 
+def test_order_creation_applies_best_promotion(authenticated_user): 
+    user, client = authenticated_user 
+
+    product = Product.objects.create(name="product_1", price=200, stock=5)
+    fixed = Promotion.objects.create(name="fixed", discount_type="fixed", value=30, 
+                                     start_date=now() - timedelta(days=1), end_date=now() + timedelta(days=1))
+    percentage = Promotion.objects.create(name="percentage", discount_type="percentage", value=25, 
+                                          start_date=now() - timedelta(days=1), end_date=now() + timedelta(days=1))
+    fixed.applicable_products.add(product) 
+    percentage.applicable_products.add(product) 
+
+    response = client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 2}]}, format="json") 
+
+    assert response.status_code == status.HTTP_201_CREATED
+    product.refresh_from_db()
+    assert product.stock == 3
+    assert Order.objects.get().total_price == 300
+
+@pytest.mark.django_db 
+def test_order_creation_with_insufficient_stock(authenticated_user): 
+    user, client = authenticated_user 
+
+    product = Product.objects.create(name="product_1", price=200, stock=1)
+
+    response = client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 2}]}, format="json") 
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data == {'non_field_errors': ["Not enough stock for product product_1"]}
+    product.refresh_from_db()
+    assert product.stock == 1
+    assert Order.objects.count() == 0
+
+@pytest.mark.django_db 
+def test_order_creation_query_count_is_constant(authenticated_user): 
+    user, client = authenticated_user 
+
+    products = [Product.objects.create(name=f"product_{i}", price=100, stock=10) for i in range(40)]
+    promotion = Promotion.objects.create(name="sale", discount_type="percentage", value=10, 
+                                         start_date=now() - timedelta(days=1), end_date=now() + timedelta(days=1))
+    promotion.applicable_products.set(products)
+
+    def count_queries(cart):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post("/orders/", {"items": cart}, format="json") 
+        assert response.status_code == status.HTTP_201_CREATED
+        return len(queries)
+
+    count_queries([{"product_id": products[0].id, "quantity": 1}])  # warm up the promotion index
+    single = count_queries([{"product_id": products[0].id, "quantity": 1}])
+    full = count_queries([{"product_id": product.id, "quantity": 1} for product in products])
+
+    assert single == full
+
+@pytest.mark.django_db 
+def test_conditional_order_creation_with_insufficient_stock(authenticated_user, settings): 
+    settings.ORDER_INVENTORY_MODE = "conditional"
+    user, client = authenticated_user 
+
+    in_stock = Product.objects.create(name="product_1", price=200, stock=5)
+    out_of_stock = Product.objects.create(name="product_2", price=200, stock=1)
+
+    response = client.post("/orders/", {"items": [
+        {"product_id": in_stock.id, "quantity": 2}, 
+        {"product_id": out_of_stock.id, "quantity": 2}, 
+    ]}, format="json") 
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data == {'non_field_errors': ["Not enough stock for product product_2"]}
+    in_stock.refresh_from_db()
+    assert in_stock.stock == 5
+    assert Order.objects.count() == 0
+
+@pytest.mark.django_db(transaction=True) 
+@pytest.mark.parametrize("stripes", [0, 3]) 
+def test_conditional_order_creation_never_oversells(stripes, settings): 
+    settings.ORDER_INVENTORY_MODE = "conditional"
+    product = Product.objects.create(name="product_1", price=200, stock=5)
+    if stripes:
+        split_stock(product.id, stripes)
+    clients = [authenticate(User.objects.create_user(username=f"user_{i}", password="user123")) for i in range(12)]
+
+    def place_order(client):
+        try:
+            return client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 1}]}, format="json").status_code
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        codes = list(executor.map(place_order, clients))
+
+    assert codes.count(status.HTTP_201_CREATED) == 5
+    assert codes.count(status.HTTP_400_BAD_REQUEST) == 7
+    assert Product.objects.with_stock().get(id=product.id).total_stock == 0
+    assert Order.objects.count() == 5
+
+@pytest.mark.django_db 
+def test_promotion_index_follows_promotion_changes(): 
+    product = Product.objects.create(name="product_1", price=200, stock=5)
+    promotion = Promotion.objects.create(name="later", discount_type="fixed", value=30, 
+                                         start_date=now() + timedelta(days=1), end_date=now() + timedelta(days=2))
+    promotion.applicable_products.add(product)
+
+    assert promotion_index.active_promotions([product.id]) == {product.id: []}
+    with CaptureQueriesContext(connection) as queries:
+        assert promotion_index.active_promotions([product.id], at=now() + timedelta(hours=36)) == {product.id: [("fixed", 30, promotion.id)]}
+        assert promotion_index.active_promotions([product.id], at=now() + timedelta(days=3)) == {product.id: []}
+    assert len(queries) == 0
+
+    promotion.start_date = now() - timedelta(days=1)
+    promotion.save()
+    assert promotion_index.active_promotions([product.id]) == {product.id: [("fixed", 30, promotion.id)]}
+
+    promotion.applicable_products.remove(product)
+    assert promotion_index.active_promotions([product.id]) == {}
+
+@pytest.mark.django_db 
+def test_batch_order_creation_reports_each_order(authenticated_user): 
+    user, client = authenticated_user 
+
+    product = Product.objects.create(name="product_1", price=100, stock=3)
+    other = Product.objects.create(name="product_2", price=50, stock=10)
+
+    response = client.post("/orders/batch/", {"orders": [
+        {"items": [{"product_id": product.id, "quantity": 2}, {"product_id": other.id, "quantity": 1}]}, 
+        {"items": [{"product_id": product.id, "quantity": 2}]}, 
+        {"items": [{"product_id": other.id, "quantity": 0}]}, 
+        {"items": [{"product_id": product.id, "quantity": 1}]}, 
+    ]}, format="json") 
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["created"] == 2
+    assert [result["status"] for result in response.data["results"]] == ["created", "failed", "failed", "created"]
+    assert response.data["results"][1]["errors"] == {'non_field_errors': ["Not enough stock for product product_1"]}
+    assert "items" in response.data["results"][2]["errors"]
+
+    product.refresh_from_db()
+    other.refresh_from_db()
+    assert (product.stock, other.stock) == (0, 9)
+    assert sorted(Order.objects.values_list("total_price", flat=True)) == [100, 250]
+
+@pytest.mark.django_db 
+def test_batch_order_creation_query_count_is_constant(authenticated_user): 
+    user, client = authenticated_user 
+
+    products = [Product.objects.create(name=f"product_{i}", price=100, stock=100) for i in range(20)]
+
+    def count_queries(orders):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post("/orders/batch/", {"orders": orders}, format="json") 
+        assert response.data["created"] == len(orders)
+        return len(queries)
+
+    count_queries([{"items": [{"product_id": products[0].id, "quantity": 1}]}])  # warm up the promotion index
+    single = count_queries([{"items": [{"product_id": products[0].id, "quantity": 1}]}])
+    many = count_queries([{"items": [{"product_id": product.id, "quantity": 1}]} for product in products * 5])
+
+    assert single == many
+
+@pytest.mark.django_db 
+def test_order_cursor_pagination(authenticated_user): 
+    user, client = authenticated_user 
+
+    other = User.objects.create_user(username="other", password="other123")
+    orders = [Order.objects.create(user_id=user, items=[{"product_id": i, "quantity": 1}], total_price=0) for i in range(12)]
+    Order.objects.create(user_id=other, items=[], total_price=0)
+
+    seen = []
+    url = "/orders/?pagination=cursor"
+    while url:
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url) 
+        assert response.status_code == status.HTTP_200_OK
+        assert "count" not in response.data
+        assert not any("COUNT(" in query["sql"] for query in queries)
+        seen += [order["items"] for order in response.data["results"]]
+        url = response.data["next"]
+
+    assert seen == [order.items for order in reversed(orders)]
+
+    # page numbers keep the order of placement
+    response = client.get("/orders/?page=2&page_size=5")
+    assert [order["items"] for order in response.data["results"]] == [order.items for order in orders[5:10]]
+
+@pytest.mark.django_db 
+def test_product_listing_keeps_page_number_pagination(authenticated_admin_user): 
+    admin, client = authenticated_admin_user 
+
+    for i in range(7):
+        Product.objects.create(name=f"product_{i}", price=100, stock=1)
+
+    response = client.get("/products/?page=2") 
+    assert response.data["count"] == 7
+    assert len(response.data["results"]) == 2
+
+    response = client.get("/products/?pagination=cursor&page_size=4") 
+    assert [product["name"] for product in response.data["results"]] == [f"product_{i}" for i in range(4)]
+    response = client.get(response.data["next"]) 
+    assert [product["name"] for product in response.data["results"]] == [f"product_{i}" for i in range(4, 7)]
+    assert response.data["next"] is None
+
+@pytest.mark.django_db 
+def test_order_creation_records_order_items(authenticated_user): 
+    user, client = authenticated_user 
+
+    product = Product.objects.create(name="product_1", price=200, stock=5)
+    promotion = Promotion.objects.create(name="fixed", discount_type="fixed", value=30, 
+                                         start_date=now() - timedelta(days=1), end_date=now() + timedelta(days=1))
+    promotion.applicable_products.add(product) 
+
+    response = client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 2}]}, format="json") 
+
+    assert response.status_code == status.HTTP_201_CREATED
+    order_item = OrderItem.objects.get()
+    assert (order_item.product, order_item.quantity, order_item.unit_price, order_item.discount) == (product, 2, 200, 30)
+    assert order_item.order.total_price == 340
+
+@pytest.mark.django_db 
+def test_order_listing_prefetches_order_items(authenticated_user): 
+    user, client = authenticated_user 
+
+    product = Product.objects.create(name="product_1", price=200, stock=100)
+    client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 1}]}, format="json") 
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get("/orders/") 
+    single = len(queries)
+
+    for _ in range(4):
+        client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 1}, {"product_id": product.id, "quantity": 2}]}, format="json") 
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get("/orders/") 
+
+    assert len(queries) == single
+    assert response.data["results"][-1]["items"] == [{"product_id": product.id, "quantity": 1}, {"product_id": product.id, "quantity": 2}]
+
+@pytest.mark.django_db 
+def test_backfill_order_items(authenticated_user): 
+    user, client = authenticated_user 
+
+    product = Product.objects.create(name="product_1", price=200, stock=5)
+    for _ in range(3):
+        Order.objects.create(user_id=user, items=[{"product_id": product.id, "quantity": 2}, {"product_id": 999, "quantity": 1}], total_price=400)
+
+    call_command("backfill_order_items", chunk_size=2, stdout=StringIO())
+
+    assert OrderItem.objects.filter(product=product, quantity=2, unit_price=200).count() == 3
+    assert OrderItem.objects.filter(product=None, quantity=1).count() == 3
+
+    call_command("backfill_order_items", stdout=StringIO())
+    assert OrderItem.objects.count() == 6
+
+
+def seed_catalogue(user, size): 
+    products = [Product.objects.create(name=f"product_{i}", price=100, stock=1000) for i in range(size)]
+    promotions = []
+    for i in range(size):
+        promotion = Promotion.objects.create(name=f"promotion_{i}", discount_type="fixed", value=1, 
+                                             start_date=now() - timedelta(days=1), end_date=now() + timedelta(days=1))
+        promotion.applicable_products.set(products)
+        promotions.append(promotion)
+        order = Order.objects.create(user_id=user, items=[{"product_id": products[i].id, "quantity": 1}], total_price=100)
+        OrderItem.objects.create(order=order, product=products[i], quantity=1, unit_price=100, discount=1, promotion=promotion)
+    rollups.rebuild()
+    return products, promotions
+
+def endpoint_request(endpoint, client, products, promotions): 
+    product_ids = [product.id for product in products]
+    report_range = f"start={localdate() - timedelta(days=30)}&end={localdate()}"
+    catalogue = "sku,name,price,stock\n" + "".join(f"SKU-{i},product_{i},100,1000\n" for i in range(len(products)))
+    return {
+        "product_list": lambda: client.get("/products/?page_size=100"),
+        "product_search": lambda: client.get("/products/?search=product&page_size=100"),
+        "product_create": lambda: client.post("/products/", {"name": "water", "price": 120, "stock": 10}, format="json"),
+        "product_update": lambda: client.patch(f"/products/{product_ids[0]}/", {"stock": 500}, format="json"),
+        "product_import": lambda: client.generic("POST", "/products/import/", catalogue, content_type="text/csv"),
+        "product_export": lambda: client.get("/products/export.csv"),
+        "promotion_list": lambda: client.get("/promotions/?page_size=100"),
+        "promotion_create": lambda: client.post("/promotions/", {
+            "name": "sale", "discount_type": "fixed", "value": 5, "start_date": now().isoformat(),
+            "end_date": (now() + timedelta(days=1)).isoformat(), "applicable_products": product_ids,
+        }, format="json"),
+        "promotion_update": lambda: client.patch(f"/promotions/{promotions[0].id}/", {"applicable_products": product_ids}, format="json"),
+        "order_list": lambda: client.get("/orders/?page_size=100"),
+        "order_create": lambda: client.post("/orders/", {"items": [{"product_id": product_id, "quantity": 1} for product_id in product_ids]}, format="json"),
+        "order_batch_create": lambda: client.post("/orders/batch/", {"orders": [{"items": [{"product_id": product_id, "quantity": 1}]} for product_id in product_ids]}, format="json"),
+        "order_status_update": lambda: client.post("/orders/status/", {"status": "canceled", "filter": {"status": "pending"}}, format="json"),
+        "order_export": lambda: client.get("/orders/export.ndjson"),
+        "report_sales": lambda: client.get(f"/reports/sales/?{report_range}"),
+        "report_products": lambda: client.get(f"/reports/products/?{report_range}"),
+        "report_promotions": lambda: client.get(f"/reports/promotions/?{report_range}"),
+        "metrics": lambda: client.get("/metrics"),
+    }[endpoint]
+
+# Budgets for a caller already in the user cache, which is how most requests find it.
+QUERY_BUDGETS = {
+    "product_list": 2,
+    # includes rebuilding the search index of the worker after products were added
+    "product_search": 2,
+    "product_create": 1,
+    "product_update": 2,
+    "product_import": 6,
+    "product_export": 1,
+    # includes looking up the next promotion start/end date after promotions changed
+    "promotion_list": 4,
+    "promotion_create": 6,
+    "promotion_update": 5,
+    "order_list": 3,
+    # includes the promotion index rebuild after the catalogue changed, and the outbox event
+    "order_create": 8,
+    "order_batch_create": 8,
+    # includes locking and restocking the products of the canceled orders, the savepoint, and
+    # summing, locking and decrementing the three sales rollups they were counted in
+    "order_status_update": 17,
+    "order_export": 1,
+    "report_sales": 2,
+    "report_products": 1,
+    "report_promotions": 1,
+    "metrics": 0,
+}
+
+@pytest.mark.django_db 
+@pytest.mark.parametrize("endpoint", sorted(QUERY_BUDGETS)) 
+def test_endpoint_query_budget(endpoint, authenticated_admin_user): 
+    admin, client = authenticated_admin_user 
+    client.get("/orders/")
+    stripe_index.stripe_counts([])
+
+    assert_query_budget(
+        QUERY_BUDGETS[endpoint], (1, 10, 25), lambda size: endpoint_request(endpoint, client, *seed_catalogue(admin, size)),
+    )
+
+
+def query_plan(queryset): 
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            # tiny test tables are always cheaper to scan, so only ask whether the index is usable
+            cursor.execute("SET LOCAL enable_seqscan = off")
+    return queryset.explain()
+
+@pytest.mark.django_db 
+def test_hot_queries_use_indexes(authenticated_user): 
+    user, client = authenticated_user 
+
+    assert "order_user_created_idx" in query_plan(Order.objects.filter(user_id=user).order_by("-created_at", "-id")[:5])
+    assert "promotion_active_idx" in query_plan(Promotion.objects.filter(end_date__gte=now()).values("id"))
+    assert "order_created_idx" in query_plan(Order.objects.filter(created_at__gte=now()).order_by("created_at", "id").values("id"))
+    assert "orderitem_product_order_idx" in query_plan(OrderItem.objects.filter(product_id=1).values("order_id"))
+
+@pytest.mark.django_db(transaction=True) 
+@pytest.mark.parametrize("inventory_mode", ["locking", "conditional"]) 
+def test_benchmark_hot_product_contention(inventory_mode, settings): 
+    settings.ORDER_INVENTORY_MODE = inventory_mode
+
+    report = run_benchmark(products=20, promotions=5, users=5, stock=1000, requests=60, concurrency=4, 
+                           hot_products=1, hot_ratio=0.8)
+
+    assert report["completed"] + report["failed"] == 60
+    orders = report["endpoints"]["POST /orders/"]
+    assert orders["status_codes"] == {"201": orders["count"]}
+    assert orders["p50_ms"] <= orders["p95_ms"] <= orders["p99_ms"]
+    assert Product.objects.aggregate(sold=Sum("order_items__quantity"))["sold"] == 20 * 1000 - Product.objects.aggregate(stock=Sum("stock"))["stock"]
+
+@pytest.mark.django_db 
+def test_order_creation_reports_server_timing(authenticated_user): 
+    user, client = authenticated_user 
+
+    product = Product.objects.create(name="product_1", price=200, stock=5)
+    response = client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 1}]}, format="json") 
+
+    phases = {entry.split(";")[0] for entry in response["Server-Timing"].split(", ")}
+    assert {"db", "auth", "validation", "lock_wait", "pricing", "serialization", "total"} <= phases
+
+@pytest.mark.django_db 
+def test_metrics_endpoint(authenticated_admin_user): 
+    admin, admin_client = authenticated_admin_user 
+    client = authenticate(User.objects.create_user(username="customer", password="customer123"))
+
+    client.get("/orders/") 
+
+    assert client.get("/metrics").status_code == status.HTTP_403_FORBIDDEN
+    response = admin_client.get("/metrics") 
+    assert response.status_code == status.HTTP_200_OK
+    assert response["Content-Type"].startswith("text/plain")
+    body = response.content.decode()
+    assert 'order_management_requests_total{view="order_list_create",status="200"}' in body
+    assert 'order_management_db_queries_bucket{view="order_list_create",le="+Inf"}' in body
+    assert 'order_management_phase_duration_seconds_count{view="order_list_create",phase="serialization"}' in body
+
+@pytest.mark.django_db 
+def test_product_listing_etag(authenticated_admin_user): 
+    admin, client = authenticated_admin_user 
+
+    product = Product.objects.create(name="product_1", price=200, stock=5)
+    response = client.get("/products/") 
+    etag = response["ETag"]
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get("/products/", HTTP_IF_NONE_MATCH=etag) 
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert not any("orders_product" in query["sql"] for query in queries)
+
+    # stock changes from order placement invalidate the listing
+    client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 2}]}, format="json") 
+    response = client.get("/products/", HTTP_IF_NONE_MATCH=etag) 
+    assert response.status_code == status.HTTP_200_OK
+    assert response["ETag"] != etag
+    assert response.data["results"][0]["stock"] == 3
+
+    product.name = "renamed"
+    product.save()
+    assert client.get("/products/").data["results"][0]["name"] == "renamed"
+
+@pytest.mark.django_db 
+def test_promotion_listing_expires_at_promotion_boundaries(authenticated_admin_user): 
+    admin, client = authenticated_admin_user 
+
+    product = Product.objects.create(name="product_1", price=200, stock=5)
+    promotion = Promotion.objects.create(name="later", discount_type="fixed", value=30, 
+                                         start_date=now() + timedelta(minutes=10), end_date=now() + timedelta(minutes=20))
+    promotion.applicable_products.add(product)
+
+    response = client.get("/promotions/") 
+    assert response.data["results"] == []
+    etag = response["ETag"]
+
+    with mock.patch("django.utils.timezone.now", return_value=now() + timedelta(minutes=15)):
+        response = client.get("/promotions/", HTTP_IF_NONE_MATCH=etag) 
+    assert response.status_code == status.HTTP_200_OK
+    assert [promotion["name"] for promotion in response.data["results"]] == ["later"]
+
+    with mock.patch("django.utils.timezone.now", return_value=now() + timedelta(minutes=25)):
+        response = client.get("/promotions/") 
+    assert response.data["results"] == []
+
+def async_request(method, path, token=None, headers=None, **kwargs): 
+    headers = dict(headers or {})
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    return async_to_sync(getattr(AsyncClient(), method))(path, headers=headers, **kwargs)
+
+@pytest.mark.django_db 
+def test_async_listings_match_sync_listings(authenticated_admin_user, settings): 
+    admin, client = authenticated_admin_user 
+    token = str(RefreshToken.for_user(admin).access_token)
+
+    products = [Product.objects.create(name=f"product_{i}", price=100, stock=100) for i in range(7)]
+    promotion = Promotion.objects.create(name="sale", discount_type="fixed", value=5, 
+                                         start_date=now() - timedelta(days=1), end_date=now() + timedelta(days=1))
+    promotion.applicable_products.set(products)
+    for product in products:
+        client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 2}]}, format="json") 
+
+    paths = ["/orders/", "/orders/?page=2", "/orders/?page=last", "/products/?page_size=3&page=3",
+             "/products/?page_size=3&page=last", "/promotions/"]
+    expected = [client.get(path).json() for path in paths]
+
+    settings.ROOT_URLCONF = "order_management.asgi_urls"
+    assert [async_request("get", path, token).json() for path in paths] == expected
+
+@pytest.mark.django_db 
+@pytest.mark.parametrize("path", ["/orders/", "/products/", "/promotions/"])
+def test_async_listings_report_their_queries(path, authenticated_admin_user, settings): 
+    admin, client = authenticated_admin_user 
+    settings.ROOT_URLCONF = "order_management.asgi_urls"
+    token = str(RefreshToken.for_user(admin).access_token)
+
+    # the async ORM queries on another thread, with connections of its own
+    response = async_request("get", path, token)
+    assert response.status_code == status.HTTP_200_OK
+    db_timing = response["Server-Timing"].split(", ")[0]
+    queries = int(db_timing.split('desc="')[1].split(" ")[0])
+    assert queries > 0
+
+@pytest.mark.django_db 
+def test_async_listing_authentication_and_etag(authenticated_admin_user, settings): 
+    admin, client = authenticated_admin_user 
+    settings.ROOT_URLCONF = "order_management.asgi_urls"
+    customer = User.objects.create_user(username="customer", password="customer123")
+    token = str(RefreshToken.for_user(admin).access_token)
+
+    assert async_request("get", "/products/").status_code == status.HTTP_401_UNAUTHORIZED
+    assert async_request("get", "/products/", "not-a-token").status_code == status.HTTP_401_UNAUTHORIZED
+    assert async_request("get", "/products/", str(RefreshToken.for_user(customer).access_token)).status_code == status.HTTP_403_FORBIDDEN
+    assert async_request("get", "/products/?page=9", token).status_code == status.HTTP_404_NOT_FOUND
+
+    response = async_request("get", "/products/", token)
+    assert response.status_code == status.HTTP_200_OK
+    response = async_request("get", "/products/", token, headers={"If-None-Match": response["ETag"]})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+@pytest.mark.django_db 
+def test_async_entry_point_delegates_writes(authenticated_user, settings): 
+    user, client = authenticated_user 
+    settings.ROOT_URLCONF = "order_management.asgi_urls"
+    token = str(RefreshToken.for_user(user).access_token)
+
+    product = Product.objects.create(name="product_1", price=200, stock=5)
+    response = async_request("post", "/orders/", token, data={"items": [{"product_id": product.id, "quantity": 2}]}, 
+                             content_type="application/json")
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert async_request("get", "/orders/", token).json()["count"] == 1
+
+@pytest.mark.django_db(transaction=True) 
+def test_benchmark_read_capacity(): 
+    report = run_read_capacity_benchmark(products=10, promotions=2, users=3, orders=10, requests=30, 
+                                         connections=10, wsgi_threads=2)
+
+    assert report["wsgi"]["status_codes"] == {"200": 30}
+    assert report["asgi"]["status_codes"] == {"200": 30}
+    assert report["wsgi"]["max_in_flight"] <= 2
+
+
+@pytest.mark.django_db 
+def test_order_creation_publishes_outbox_event(authenticated_user): 
+    user, client = authenticated_user 
+
+    product = Product.objects.create(name="product_1", price=200, stock=5)
+    response = client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 2}]}, format="json") 
+    assert response.status_code == status.HTTP_201_CREATED
+
+    response = client.post("/orders/batch/", {"orders": [{"items": [{"product_id": product.id, "quantity": 1}]}, 
+                                                         {"items": [{"product_id": product.id, "quantity": 10}]}]}, format="json") 
+    assert response.data["created"] == 1
+
+    events = OutboxEvent.objects.order_by("id")
+    assert [event.topic for event in events] == [outbox.ORDER_CREATED] * 2
+    assert [event.payload["order_id"] for event in events] == list(Order.objects.order_by("id").values_list("id", flat=True))
+    assert events[0].payload == {"order_id": events[0].payload["order_id"], "user_id": user.id, "total_price": "400.00", "status": "pending"}
+
+@pytest.mark.django_db 
+def test_rejected_order_publishes_no_event(authenticated_user): 
+    user, client = authenticated_user 
+
+    product = Product.objects.create(name="product_1", price=200, stock=1)
+    response = client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 2}]}, format="json") 
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert not OutboxEvent.objects.exists()
+
+@pytest.mark.django_db 
+def test_process_outbox_dispatches_and_retries(settings): 
+    settings.OUTBOX_MAX_ATTEMPTS = 2
+    delivered = []
+
+    def flaky(event): 
+        if event.payload["fail"]: 
+            raise RuntimeError("downstream unavailable")
+        delivered.append(event.payload["n"])
+
+    ok, failing = outbox.publish_many("test.event", [{"n": 1, "fail": False}, {"n": 2, "fail": True}])
+    outbox.publish("unhandled.event", {})
+
+    with mock.patch.dict(outbox.handlers, {"test.event": flaky}): 
+        call_command("process_outbox", once=True, stdout=StringIO())
+        assert delivered == [1]
+
+        ok.refresh_from_db()
+        failing.refresh_from_db()
+        assert (ok.status, ok.attempts) == (OutboxEvent.PROCESSED, 1)
+        assert (failing.status, failing.attempts) == (OutboxEvent.PENDING, 1)
+        assert failing.available_at > now() and "downstream unavailable" in failing.last_error
+
+        # due again after the backoff, and failed for good once out of attempts
+        OutboxEvent.objects.filter(id=failing.id).update(available_at=now())
+        assert outbox.process_batch() == (0, 1)
+        failing.refresh_from_db()
+        assert (failing.status, failing.attempts) == (OutboxEvent.FAILED, 2)
+        assert outbox.process_batch() == (0, 0)
+
+    # events without a handler wait until one is registered
+    assert OutboxEvent.objects.get(topic="unhandled.event").status == OutboxEvent.PENDING
+
+@pytest.mark.django_db 
+def test_catalogue_import_upserts_by_sku(authenticated_admin_user): 
+    admin, client = authenticated_admin_user 
+
+    Product.objects.create(sku="SKU-1", name="old name", price=1, stock=1)
+    body = "sku,name,price,stock\nSKU-1,water,1.20,10\nSKU-2,juice,2.50,5\nSKU-3,bread,-1,5\nSKU-2,juice,2.75,6\n"
+    response = client.generic("POST", "/products/import/", body, content_type="text/csv") 
+
+    assert response.status_code == status.HTTP_200_OK
+    assert (response.data["imported"], response.data["failed"]) == (2, 1)
+    assert response.data["errors"][0]["row"] == 3 and "price" in response.data["errors"][0]["errors"]
+    assert list(Product.objects.order_by("sku").values_list("sku", "name", "stock")) == [("SKU-1", "water", 10), ("SKU-2", "juice", 6)]
+
+    ndjson = b'{"sku": "SKU-3", "name": "bread", "price": "3.10", "stock": 7}\nnot json\n'
+    upload = SimpleUploadedFile("catalogue.ndjson", ndjson, content_type="application/octet-stream")
+    response = client.post("/products/import/", {"file": upload}, format="multipart") 
+    assert (response.data["imported"], response.data["failed"]) == (1, 1)
+    assert Product.objects.get(sku="SKU-3").stock == 7
+
+    response = client.generic("POST", "/products/import/", "<xml/>", content_type="application/xml") 
+    assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+@pytest.mark.django_db 
+def test_catalogue_import_requires_admin(authenticated_user): 
+    user, client = authenticated_user 
+
+    response = client.generic("POST", "/products/import/", "sku,name,price,stock\nSKU-1,water,1,1\n", content_type="text/csv") 
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+    assert not Product.objects.exists()
+
+@pytest.mark.django_db 
+def test_catalogue_export_streams_csv_and_ndjson(authenticated_admin_user): 
+    admin, client = authenticated_admin_user 
+
+    water = Product.objects.create(sku="SKU-1", name="water, sparkling", price="1.20", stock=10)
+    Product.objects.create(name="no sku", price=2, stock=0)
+
+    response = client.get("/products/export.csv") 
+    assert response.streaming and response["Content-Type"] == "text/csv"
+    lines = b"".join(response.streaming_content).decode().splitlines()
+    assert lines[:2] == ["id,sku,name,price,stock", f'{water.id},SKU-1,"water, sparkling",1.20,10']
+    assert len(lines) == 3
+
+    response = client.get("/products/export.ndjson") 
+    rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+    assert rows[0] == {"id": water.id, "sku": "SKU-1", "name": "water, sparkling", "price": "1.20", "stock": 10}
+
+    assert client.get("/products/export.xml").status_code == status.HTTP_404_NOT_FOUND
+
+@pytest.mark.django_db 
+def test_catalogue_commands_round_trip(tmp_path): 
+    for i in range(5):
+        Product.objects.create(sku=f"SKU-{i}", name=f"product_{i}", price=i, stock=i)
+
+    path = tmp_path / "catalogue.ndjson"
+    call_command("export_products", output=str(path), stderr=StringIO())
+    Product.objects.all().update(stock=0)
+
+    call_command("import_products", str(path), chunk_size=2, stdout=StringIO())
+    assert list(Product.objects.order_by("sku").values_list("stock", flat=True)) == [0, 1, 2, 3, 4]
+    assert Product.objects.count() == 5
+
+@pytest.mark.django_db 
+def test_order_export_filters_and_streams(authenticated_admin_user): 
+    admin, client = authenticated_admin_user 
+
+    customer = User.objects.create_user(username="customer", password="customer123")
+    first = Order.objects.create(user_id=customer, items=[{"product_id": 1, "quantity": 2}], total_price="10.50")
+    second = Order.objects.create(user_id=customer, items=[], total_price=5, status=Order.SHIPPED)
+    Order.objects.create(user_id=admin, items=[], total_price=7)
+    Order.objects.filter(id=first.id).update(created_at=now() - timedelta(days=10))
+
+    response = client.get(f"/orders/export.ndjson?user={customer.id}") 
+    assert response.streaming
+    rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+    assert [row["id"] for row in rows] == [first.id, second.id]
+    assert rows[0]["items"] == [{"product_id": 1, "quantity": 2}] and rows[0]["total_price"] == "10.50"
+
+    response = client.get(f"/orders/export.csv?status=shipped&created_after={(now() - timedelta(days=1)).date()}") 
+    lines = b"".join(response.streaming_content).decode().splitlines()
+    assert lines[0] == "id,user_id,status,total_price,created_at,items"
+    assert [line.split(",")[0] for line in lines[1:]] == [str(second.id)]
+
+    response = client.get("/orders/export.csv?status=lost") 
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.django_db 
+def test_export_orders_command(authenticated_user, tmp_path): 
+    user, client = authenticated_user 
+
+    for i in range(5):
+        Order.objects.create(user_id=user, items=[], total_price=i)
+
+    path = tmp_path / "orders.csv"
+    call_command("export_orders", output=str(path), user=str(user.id), chunk_size=2, stderr=StringIO())
+    assert len(path.read_text().splitlines()) == 6
+
+    with pytest.raises(CommandError): 
+        call_command("export_orders", created_after="yesterday")
+
+
+def stripe_stocks(product): 
+    return list(StockStripe.objects.filter(product=product).order_by("index").values_list("stock", flat=True))
+
+@pytest.mark.django_db 
+@pytest.mark.parametrize("inventory_mode", ["locking", "conditional"]) 
+def test_striped_product_orders_take_from_stripes(inventory_mode, authenticated_user, settings): 
+    settings.ORDER_INVENTORY_MODE = inventory_mode
+    user, client = authenticated_user 
+
+    hot = Product.objects.create(name="hot", price=100, stock=10)
+    cold = Product.objects.create(name="cold", price=50, stock=10)
+    split_stock(hot.id, 3)
+    assert stripe_stocks(hot) == [4, 3, 3]
+
+    response = client.post("/orders/", {"items": [{"product_id": hot.id, "quantity": 3}, {"product_id": cold.id, "quantity": 1}]}, format="json") 
+    assert response.status_code == status.HTTP_201_CREATED
+    assert sum(stripe_stocks(hot)) == 7
+    cold.refresh_from_db()
+    assert cold.stock == 9
+
+    # more than any one stripe holds is taken from several
+    response = client.post("/orders/", {"items": [{"product_id": hot.id, "quantity": 6}]}, format="json") 
+    assert response.status_code == status.HTTP_201_CREATED
+    assert sum(stripe_stocks(hot)) == 1
+
+    response = client.post("/orders/", {"items": [{"product_id": hot.id, "quantity": 2}, {"product_id": cold.id, "quantity": 1}]}, format="json") 
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert sum(stripe_stocks(hot)) == 1
+    cold.refresh_from_db()
+    assert cold.stock == 9
+
+@pytest.mark.django_db 
+@pytest.mark.parametrize("inventory_mode", ["locking", "conditional"]) 
+def test_stale_stripe_index_cannot_sell_the_column(inventory_mode, authenticated_user, settings): 
+    settings.ORDER_INVENTORY_MODE = inventory_mode
+    user, client = authenticated_user 
+
+    hot = Product.objects.create(name="hot", price=100, stock=10)
+    stripe_index.stripe_counts([hot.id])
+    split_stock(hot.id, 2)
+
+    # a worker that has not seen the split yet takes the product for unstriped
+    with mock.patch.object(stripe_index, "stripe_counts", return_value={}):
+        response = client.post("/orders/", {"items": [{"product_id": hot.id, "quantity": 1}]}, format="json") 
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert sum(stripe_stocks(hot)) == 10
+    assert Product.objects.with_stock().get(id=hot.id).total_stock == 10
+
+@pytest.mark.django_db 
+def test_striped_product_batch_orders(authenticated_user): 
+    user, client = authenticated_user 
+
+    hot = Product.objects.create(name="hot", price=100, stock=9)
+    split_stock(hot.id, 3)
+
+    response = client.post("/orders/batch/", {"orders": [{"items": [{"product_id": hot.id, "quantity": 5}]}, 
+                                                         {"items": [{"product_id": hot.id, "quantity": 5}]}, 
+                                                         {"items": [{"product_id": hot.id, "quantity": 4}]}]}, format="json") 
+    assert [result["status"] for result in response.data["results"]] == ["created", "failed", "created"]
+    assert stripe_stocks(hot) == [0, 0, 0]
+
+@pytest.mark.django_db 
+def test_striped_stock_is_reported_and_maintained(authenticated_admin_user): 
+    admin, client = authenticated_admin_user 
+
+    product = Product.objects.create(name="hot", price=100, stock=12)
+    split_stock(product.id, 4)
+    StockStripe.objects.filter(product=product, index=0).update(stock=0)
+    # a column filled before striped products kept it empty
+    Product.objects.filter(id=product.id).update(stock=12)
+
+    response = client.get("/products/") 
+    assert response.data["results"][0]["stock"] == 9
+    assert b",9\r\n" in b"".join(client.get("/products/export.csv").streaming_content)
+
+    call_command("rebalance_stock", once=True, stdout=StringIO())
+    assert stripe_stocks(product) == [3, 2, 2, 2]
+    # the column holds nothing to sell while the product is striped
+    product.refresh_from_db()
+    assert product.stock == 0
+    assert Product.objects.with_stock().get(id=product.id).total_stock == 9
+
+    response = client.patch(f"/products/{product.id}/", {"stock": 20}, format="json") 
+    assert response.data["data"]["stock"] == 20
+    assert stripe_stocks(product) == [5, 5, 5, 5]
+    product.refresh_from_db()
+    assert product.stock == 0
+
+    call_command("stripe_stock", str(product.id), stripes=0, stdout=StringIO())
+    assert stripe_stocks(product) == []
+    product.refresh_from_db()
+    assert product.stock == 20
+
+
+@pytest.mark.django_db 
+def test_sales_rollups_follow_placed_orders(authenticated_admin_user): 
+    admin, client = authenticated_admin_user 
+
+    water = Product.objects.create(name="water", price=100, stock=100)
+    juice = Product.objects.create(name="juice", price=50, stock=100)
+    promotion = Promotion.objects.create(name="sale", discount_type="percentage", value=10, 
+                                         start_date=now() - timedelta(days=1), end_date=now() + timedelta(days=1))
+    promotion.applicable_products.add(water)
+
+    client.post("/orders/", {"items": [{"product_id": water.id, "quantity": 2}, {"product_id": juice.id, "quantity": 1}]}, format="json") 
+    client.post("/orders/batch/", {"orders": [{"items": [{"product_id": juice.id, "quantity": 3}]}]}, format="json") 
+    assert OrderItem.objects.get(product=water).promotion == promotion
+
+    call_command("process_outbox", once=True, stdout=StringIO())
+    # handing the same orders in again does not count them twice
+    assert rollups.record_orders(Order.objects.values_list("id", flat=True)) == 0
+
+    # rollup days are in the local time zone
+    today, week_ago = localdate(), localdate() - timedelta(days=7)
+    response = client.get(f"/reports/sales/?start={week_ago}&end={today}") 
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["totals"] == {"orders": 2, "units": 6, "revenue": "380.00", "discount": "20.00"}
+    assert [row["day"] for row in response.data["results"]] == [str(today)]
+
+    response = client.get(f"/reports/products/?start={week_ago}&end={today}") 
+    assert [(row["name"], row["units"], row["revenue"]) for row in response.data["results"]] == [("juice", 4, "200.00"), ("water", 2, "180.00")]
+
+    response = client.get(f"/reports/promotions/?start={week_ago}&end={today}") 
+    assert [(row["name"], row["orders"], row["discount"]) for row in response.data["results"]] == [("sale", 1, "20.00")]
+
+    response = client.get(f"/reports/sales/?start={today}&end={week_ago}") 
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.django_db 
+def test_rollup_sales_catches_up_and_rebuilds(authenticated_user): 
+    user, client = authenticated_user 
+
+    product = Product.objects.create(name="water", price=100, stock=100)
+    for _ in range(3):
+        client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 1}]}, format="json") 
+
+    # no outbox worker ran: the command adds what is missing
+    call_command("rollup_sales", chunk_size=2, stdout=StringIO())
+    figures = list(DailyProductSales.objects.values_list("orders", "units", "revenue"))
+    assert figures == [(3, 3, 300)]
+
+    DailyProductSales.objects.update(units=0)
+    call_command("rollup_sales", rebuild=True, stdout=StringIO())
+    assert list(DailyProductSales.objects.values_list("orders", "units", "revenue")) == figures
+    assert DailySales.objects.get().orders == 3
+
+
+@contextmanager
+def order_locked(order, seconds=0.5):
+    """Hold the row lock of `order` in another thread for `seconds` from the start of the block."""
+    locked = threading.Event()
+
+    def hold_lock():
+        try:
+            with transaction.atomic():
+                Order.objects.select_for_update().get(id=order.id)
+                locked.set()
+                time.sleep(seconds)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        holder = pool.submit(hold_lock)
+        assert locked.wait(5)
+        yield
+        holder.result()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_order_created_event_waits_for_a_locked_order(authenticated_user):
+    user, client = authenticated_user
+
+    product = Product.objects.create(name="water", price=100, stock=100)
+    client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 2}]}, format="json")
+    order = Order.objects.get()
+
+    # like a status change of the order while the outbox worker runs
+    with order_locked(order):
+        assert outbox.process_batch() == (1, 0)
+
+    order.refresh_from_db()
+    assert order.rolled_up
+    assert DailySales.objects.get().orders == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rebuild_counts_locked_orders_of_archived_days(authenticated_user):
+    user, client = authenticated_user
+
+    product = Product.objects.create(name="water", price=100, stock=100)
+    client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 2}]}, format="json")
+    order = Order.objects.get()
+    created_at = now() - timedelta(days=400)
+    Order.objects.filter(id=order.id).update(created_at=created_at)
+    OrderArchiveBatch.objects.create(
+        cutoff=created_at, orders=0, first_order_id=0, last_order_id=0, first_created_at=created_at,
+        last_created_at=created_at, total_price=0, checksum="",
+    )
+
+    with order_locked(order):
+        rollups.rebuild()
+
+    order.refresh_from_db()
+    assert order.rolled_up
+    assert DailySales.objects.values_list("orders", "units").get(day=localdate(created_at)) == (1, 2)
+
+
+@pytest.mark.django_db 
+def test_bulk_status_change_follows_transitions(authenticated_admin_user): 
+    admin, client = authenticated_admin_user 
+
+    orders = {status: Order.objects.create(user_id=admin, items=[], total_price=0, status=status) 
+              for status in ["pending", "confirmed", "shipped", "delivered"]}
+    ids = [order.id for order in orders.values()] + [999999]
+
+    with CaptureQueriesContext(connection) as queries: 
+        response = client.post("/orders/status/", {"status": "shipped", "ids": ids}, format="json") 
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["updated"] == 1
+    assert response.data["skipped"] == [
+        {"id": orders["pending"].id, "reason": "Cannot change status from pending to shipped."},
+        {"id": orders["shipped"].id, "reason": "Order is already shipped."},
+        {"id": orders["delivered"].id, "reason": "Cannot change status from delivered to shipped."},
+        {"id": 999999, "reason": "Order not found."},
+    ]
+    assert Order.objects.get(id=orders["confirmed"].id).status == "shipped"
+    assert len([query for query in queries.captured_queries if query["sql"].startswith("UPDATE")]) == 1
+
+    response = client.post("/orders/status/", {"status": "shipped"}, format="json") 
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.django_db 
+def test_canceling_orders_restocks_products(authenticated_admin_user): 
+    admin, client = authenticated_admin_user 
+
+    water = Product.objects.create(name="water", price=100, stock=10)
+    juice = Product.objects.create(name="juice", price=50, stock=10)
+    split_stock(juice.id, 2)
+    for quantity in (1, 2, 3):
+        client.post("/orders/", {"items": [{"product_id": water.id, "quantity": quantity}, {"product_id": juice.id, "quantity": 1}]}, format="json") 
+    Order.objects.filter(total_price__gt=300).update(status="shipped")
+    # the first order is counted in the sales rollups, the second not yet
+    rollups.record_orders(Order.objects.order_by("id").values_list("id", flat=True)[:1])
+
+    response = client.post("/orders/status/", {"status": "canceled", "filter": {"user": admin.id}}, format="json") 
+    assert response.data["updated"] == 2
+    assert [entry["reason"] for entry in response.data["skipped"]] == ["Cannot change status from shipped to canceled."]
+
+    water.refresh_from_db()
+    assert water.stock == 10 - 3
+    assert Product.objects.with_stock().get(id=juice.id).total_stock == 10 - 1
+
+    # only the shipped order is left in the sales reports, however its rollup was reached
+    rollups.record_orders(Order.objects.values_list("id", flat=True))
+    today = localdate()
+    report = client.get(f"/reports/sales/?start={today}&end={today}").data
+    assert [(day["orders"], day["units"]) for day in report["results"]] == [(1, 4)]
+    assert report["totals"]["revenue"] == "350.00"
+    assert sorted(DailyProductSales.objects.values_list("product_id", "orders", "units")) == [
+        (water.id, 1, 3), (juice.id, 1, 1),
+    ]
+
+
+@pytest.mark.django_db
+def test_reads_go_to_replicas_until_own_writes(authenticated_user, settings):
+    settings.DATABASE_REPLICAS = ["replica1"]
+    user, client = authenticated_user
+    other = User.objects.create_user(username="other", password="other123")
+
+    routed = []
+    def view(request):
+        routed.append(router.db_for_read(Product))
+        with use_primary():
+            routed.append(router.db_for_read(Product))
+        return HttpResponse(status=201 if request.method == "POST" else 200)
+
+    middleware = ReplicaRoutingMiddleware(view)
+    factory = RequestFactory()
+    token = f"Bearer {RefreshToken.for_user(user).access_token}"
+    other_token = f"Bearer {RefreshToken.for_user(other).access_token}"
+
+    middleware(factory.get("/orders/", HTTP_AUTHORIZATION=token))
+    assert routed == ["replica1", "default"]
+
+    routed.clear()
+    middleware(factory.post("/orders/", {}, HTTP_AUTHORIZATION=token))
+    middleware(factory.get("/orders/", HTTP_AUTHORIZATION=token))
+    middleware(factory.get("/orders/", HTTP_AUTHORIZATION=other_token))
+    middleware(factory.get("/products/"))
+    assert routed[::2] == ["default", "default", "replica1", "replica1"]
+
+    # outside of requests, e.g. in commands and the outbox worker
+    assert router.db_for_read(Product) == "default"
+
+
+def test_pins_survive_many_users(settings):
+    settings.READ_YOUR_WRITES_SECONDS = 5
+    # more users than the file-based cache holds before it culls
+    for user_id in range(400):
+        pin(user_id)
+    assert all(is_pinned(user_id) for user_id in range(400))
+    assert not is_pinned(400)
+
+    # expired pins are dropped by the next pin
+    with mock.patch("order_management.db_routing.time.time", return_value=now().timestamp() + 10):
+        assert not is_pinned(0)
+        pin(1)
+    assert pins.read().keys() == {"1"}
+
+
+@override_settings(DATABASE_REPLICAS=["replica_mirror"])
+class ReplicaAliasTests(TransactionTestCase):
+    # A second alias of the test database, like DB_REPLICA_HOSTS=localhost: it only sees
+    # committed rows, through a connection of its own. It is added before the test case
+    # checks its databases.
+    alias = "replica_mirror"
+    databases = {"default", alias}
+
+    @classmethod
+    def setUpClass(cls):
+        default = connections["default"].settings_dict
+        connections.settings[cls.alias] = {**default, "TEST": {**default["TEST"], "MIRROR": "default"}}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.alias].close()
+        del connections[cls.alias]
+        del connections.settings[cls.alias]
+
+    def test_replica_alias_serves_reads_until_own_writes(self):
+        user = User.objects.create_user(username="user", password="user123")
+        other = User.objects.create_user(username="other", password="other123")
+        product = Product.objects.create(name="Water", price=10, stock=5)
+        client, other_client = authenticate(user), authenticate(other)
+
+        def list_orders(client):
+            with CaptureQueriesContext(connections[self.alias]) as replica_queries:
+                response = client.get("/orders/")
+            assert response.status_code == status.HTTP_200_OK
+            return len(response.data["results"]), len(replica_queries)
+
+        orders, replica_queries = list_orders(client)
+        assert orders == 0 and replica_queries > 0
+
+        response = client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 1}]}, format="json")
+        assert response.status_code == status.HTTP_201_CREATED
+        # the user's own reads stay on the primary, other users still read from the replica
+        assert list_orders(client) == (1, 0)
+        orders, replica_queries = list_orders(other_client)
+        assert orders == 0 and replica_queries > 0
+
+
+@pytest.mark.django_db
+def test_product_search_modes(authenticated_admin_user):
+    admin, client = authenticated_admin_user
+    red_widget = Product.objects.create(name="Red Widget", price=1, stock=1)
+    blue_widget = Product.objects.create(name="Blue widget deluxe", price=1, stock=1)
+    red_gadget = Product.objects.create(name="red gadget", price=1, stock=1)
+
+    def search(query, match=None):
+        params = {"search": query} if match is None else {"search": query, "match": match}
+        response = client.get("/products/", params)
+        assert response.status_code == status.HTTP_200_OK, response.data
+        return [product["id"] for product in response.data["results"]]
+
+    assert search("red", "prefix") == [red_widget.id, red_gadget.id]
+    assert search("dget", "substring") == [red_widget.id, blue_widget.id, red_gadget.id]
+    assert search("get d", "substring") == [blue_widget.id]
+    # ranked by the number of query words matched, then by id
+    assert search("wid re") == [red_widget.id, blue_widget.id, red_gadget.id]
+    assert search("nothing") == []
+
+    response = client.get("/products/", {"search": "red", "match": "fuzzy"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_product_search_follows_renames(authenticated_admin_user):
+    admin, client = authenticated_admin_user
+    product = Product.objects.create(name="Garden hose", price=1, stock=1)
+    assert client.get("/products/", {"search": "hose"}).data["count"] == 1
+
+    response = client.patch(f"/products/{product.id}/", {"name": "Garden rake"}, format="json")
+    assert response.status_code == status.HTTP_200_OK
+    assert client.get("/products/", {"search": "hose"}).data["count"] == 0
+    assert client.get("/products/", {"search": "rake"}).data["count"] == 1
+
+    # stock changes leave the index alone
+    client.patch(f"/products/{product.id}/", {"stock": 5}, format="json")
+    version = search_index._version
+    assert client.get("/products/", {"search": "rake"}).data["count"] == 1
+    assert search_index._version == version
+
+    product.delete()
+    assert client.get("/products/", {"search": "rake"}).data["count"] == 0
+
+
+@pytest.mark.django_db
+def test_price_change_keeps_product_names_version_without_an_index():
+    product = Product.objects.create(name="Garden hose", price=1, stock=1)
+    # a worker that never built its search index
+    search_index.clear()
+    version = current_version(PRODUCT_NAMES)
+
+    product = Product.objects.get(id=product.id)
+    product.price = 2
+    product.save()
+    serializer = ProductSerializer(Product.objects.with_stock().get(id=product.id), data={"stock": 3}, partial=True)
+    assert serializer.is_valid(), serializer.errors
+    serializer.save()
+    assert current_version(PRODUCT_NAMES) == version
+
+    product.name = "Garden rake"
+    product.save()
+    assert current_version(PRODUCT_NAMES) != version
+
+
+@pytest.mark.django_db
+def test_benchmark_search():
+    report = run_search_benchmark(products=50, requests=5)
+    assert set(report["modes"]) == {"prefix", "substring", "words"}
+    for result in report["modes"].values():
+        assert result["status_codes"] == {"200": 5}
+
+
+@pytest.mark.django_db
+def test_admission_rejects_over_user_rate_before_any_query(authenticated_user, settings):
+    settings.ORDER_ADMISSION_USER_RATE = 0.01
+    settings.ORDER_ADMISSION_USER_BURST = 2
+    user, client = authenticated_user
+    product = Product.objects.create(name="Widget", price=1, stock=10)
+    order = {"items": [{"product_id": product.id, "quantity": 1}]}
+
+    for _ in range(2):
+        assert client.post("/orders/", order, format="json").status_code == status.HTTP_201_CREATED
+
+    rejected_before = registry.snapshot()["counters"].get(("admission_rejections", (("reason", "user"),)), 0)
+    with CaptureQueriesContext(connection) as queries:
+        response = client.post("/orders/", order, format="json")
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(response["Retry-After"]) > 0
+    assert len(queries) == 0
+    assert registry.snapshot()["counters"][("admission_rejections", (("reason", "user"),))] == rejected_before + 1
+    assert Order.objects.count() == 2
+
+    # other users have their own bucket
+    other = User.objects.create_user(username="other", password="other123")
+    assert authenticate(other).post("/orders/", order, format="json").status_code == status.HTTP_201_CREATED
+
+
+def test_admission_caps_orders_in_flight_per_product(settings):
+    settings.ORDER_ADMISSION_MAX_IN_FLIGHT_PER_PRODUCT = 2
+    first = admission.admit(1, [7, 8])
+    second = admission.admit(2, [7])
+    with pytest.raises(Throttled):
+        admission.admit(3, [8, 7])
+    # products with free slots are unaffected
+    admission.admit(3, [8]).release()
+
+    second.release()
+    admission.admit(3, [8, 7]).release()
+    first.release()
+
+
+def test_admission_state_survives_many_users(settings):
+    settings.ORDER_ADMISSION_RATE = 0
+    settings.ORDER_ADMISSION_USER_RATE = 0.001
+    settings.ORDER_ADMISSION_USER_BURST = 1
+    settings.ORDER_ADMISSION_MAX_IN_FLIGHT_PER_PRODUCT = 1
+    held = admission.admit(1, [7])
+
+    # far more users than the file cache keeps entries before it culls
+    for user_id in range(2, 402):
+        admission.admit(user_id, [8]).release()
+
+    with pytest.raises(Throttled):
+        admission.admit(1000, [7])
+    with pytest.raises(Throttled):
+        admission.admit(1, [9])
+    held.release()
+
+    # idle buckets are dropped once they have refilled
+    with mock.patch.object(admission.time, "time", return_value=admission.time.time() + 2000):
+        admission.admit(1, [7]).release()
+    with open(settings.ADMISSION_STATE_FILE) as state_file:
+        assert json.load(state_file)["users"].keys() == {"1"}
+
+
+@pytest.mark.django_db
+def test_fast_rendering_matches_serializers():
+    user = User.objects.create_user(username="user", password="user123")
+    plain = Product.objects.create(name="Plain", price="12.5", stock=3)
+    Product.objects.create(sku="SKU-1", name="Ünïcode \"quoted\"", price="0", stock=0)
+    Product.objects.create(sku="SKU-2", name="Big", price="123456789012345678.99", stock=2147483647)
+    striped = Product.objects.create(name="Striped", price="1.10", stock=10)
+    split_stock(striped.id, 4)
+
+    with_items = Order.objects.create(user_id=user, items=[{"product_id": plain.id, "quantity": 2}], total_price=25)
+    OrderItem.objects.create(order=with_items, product=plain, quantity=2, unit_price="12.50")
+    OrderItem.objects.create(order=with_items, product=None, quantity=1, unit_price="1.00")
+    # placed before OrderItem existed: rendered from the JSON items
+    Order.objects.create(user_id=user, items=[{"product_id": 99, "quantity": 1}], total_price=1, status=Order.SHIPPED)
+
+    renderer = JSONRenderer()
+    products = Product.objects.with_stock().order_by("id")
+    assert renderer.render(rendering.product_encoder.encode_all(rendering.product_rows(products))) == \
+        renderer.render(ProductSerializer(products, many=True).data)
+
+    orders = Order.objects.filter(user_id=user).order_by("-created_at", "-id")
+    rows = list(rendering.order_rows(orders))
+    fast = rendering.encode_orders(rows, rendering.order_items([row["id"] for row in rows]))
+    prefetched = orders.prefetch_related(Prefetch("order_items", queryset=OrderItem.objects.order_by("id")))
+    assert renderer.render(fast) == renderer.render(OrderListSerializer(prefetched, many=True).data)
+
+
+@pytest.mark.django_db
+def test_benchmark_render():
+    report = run_render_benchmark(rows=5, repeat=3)
+    assert set(report["results"]) == {"products", "orders"}
+    assert all(result["fast_rows_per_second"] > 0 for result in report["results"].values())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_benchmark_login_flood():
+    report = run_login_flood_benchmark(products=5, orders=3, login_workers=2)
+    assert report["orders_alone"]["status_codes"] == {"201": 3}
+    assert report["orders_during_logins"]["status_codes"] == {"201": 3}
+    assert sum(report["logins"].values()) > 0
+
+
+# seconds from a fresh interpreter to a worker ready to serve: settings, apps and URLconf
+BOOT_BUDGET_SECONDS = 1.5
+
+def test_worker_boot_within_budget():
+    report = measure_startup()
+    phases = {key: value for key, value in report.items() if key.endswith("_seconds")}
+    assert report["boot_seconds"] <= BOOT_BUDGET_SECONDS, phases
+    # optional apps such as the API docs are not loaded by workers
+    assert "drf_yasg" not in report["modules"]
+
+
+@pytest.mark.django_db 
+def test_archive_orders_moves_old_orders_in_batches(authenticated_user): 
+    user, client = authenticated_user 
+
+    product = Product.objects.create(name="water", price=100, stock=100)
+    for quantity in range(1, 6):
+        client.post("/orders/", {"items": [{"product_id": product.id, "quantity": quantity}]}, format="json") 
+    orders = list(Order.objects.order_by("id"))
+    # three delivered and a pending order from a year ago, and a recent delivered order
+    for index, order in enumerate(orders):
+        order.status = "pending" if index == 3 else "delivered"
+        if index < 4:
+            order.created_at = now() - timedelta(days=400, minutes=10 - index)
+        order.save()
+    call_command("rollup_sales", stdout=StringIO())
+    figures = list(DailySales.objects.order_by("day").values_list("day", "orders", "units", "revenue"))
+    listing = client.get("/orders/?page_size=100").data["results"]
+
+    out = StringIO()
+    call_command("archive_orders", batch_size=2, stdout=out)
+    assert "3 orders" in out.getvalue()
+
+    assert set(Order.objects.values_list("id", flat=True)) == {orders[3].id, orders[4].id}
+    assert not OrderItem.objects.filter(order_id__in=[order.id for order in orders[:3]]).exists()
+    assert ArchivedOrder.objects.count() == 3
+    assert list(OrderArchiveBatch.objects.order_by("id").values_list("orders", flat=True)) == [2, 1]
+
+    # the archive renders as the listing did, with either pagination
+    assert client.get("/orders/?page_size=100").data["results"] == listing[3:]
+    response = client.get("/orders/?archived=true&page_size=100")
+    assert response.data["count"] == 3
+    assert response.data["results"] == listing[:3]
+    # newest first
+    response = client.get("/orders/?archived=true&pagination=cursor&page_size=2")
+    assert response.data["results"] == [listing[2], listing[1]]
+    assert client.get(response.data["next"]).data["results"] == [listing[0]]
+
+    # the sales of archived days are kept by a rebuild
+    rollups.rebuild()
+    assert list(DailySales.objects.order_by("day").values_list("day", "orders", "units", "revenue")) == figures
+
+    # and an order of an archived day that was not counted yet is added to them
+    client.post("/orders/", {"items": [{"product_id": product.id, "quantity": 6}]}, format="json")
+    late = Order.objects.latest("id")
+    Order.objects.filter(id=late.id).update(created_at=orders[0].created_at, rolled_up=False)
+    rollups.rebuild()
+    day, day_orders, units, revenue = figures[0]
+    assert DailySales.objects.values_list("orders", "units", "revenue").get(day=day) == (day_orders + 1, units + 6, revenue + 600)
+    assert Order.objects.get(id=late.id).rolled_up
+
+    call_command("archive_orders", verify=True, stdout=StringIO())
+    ArchivedOrder.objects.filter(id=orders[0].id).update(document=archive.compress({"order": {}, "order_items": []}))
+    with pytest.raises(CommandError):
+        call_command("archive_orders", verify=True, stdout=StringIO(), stderr=StringIO())
+
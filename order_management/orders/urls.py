@@ -5,10 +5,20 @@ urlpatterns = [
     # Product endpoints
     path('products/', views.ProductView.as_view(), name='product_list_create'),
     path('products/<int:id>/', views.UpdateProduct.as_view(), name='update_product'),
+    path('products/import/', views.ProductImportView.as_view(), name='product_import'),
+    path('products/export.<str:file_format>', views.ProductExportView.as_view(), name='product_export'),
 
     # Promotion endpoints
     path('promotions/', views.PromotionView.as_view(), name='promotion_list_create'),
     path('promotions/<int:id>/', views.UpdatePromotion.as_view(), name='update_promotion'),
 
     path('orders/', views.OrderView.as_view(), name='order_list_create'),
+    path('orders/batch/', views.BatchOrderView.as_view(), name='order_batch_create'),
+    path('orders/status/', views.OrderStatusView.as_view(), name='order_status_update'),
+    path('orders/export.<str:file_format>', views.OrderExportView.as_view(), name='order_export'),
+
+    # Sales reports
+    path('reports/sales/', views.DailySalesReportView.as_view(), name='report_daily_sales'),
+    path('reports/products/', views.ProductSalesReportView.as_view(), name='report_product_sales'),
+    path('reports/promotions/', views.PromotionSalesReportView.as_view(), name='report_promotion_sales'),
 ]
@@ -0,0 +1,34 @@
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+PRODUCT = 'product'
+PROMOTION = 'promotion'
+STOCK_STRIPES = 'stock_stripes'
+PRODUCT_NAMES = 'product_names'
+
+VERSION_KEY = 'orders:version:{name}'
+
+
+def current_version(name):
+    """Return the version stamp shared by all workers for `name` (e.g. PRODUCT)."""
+    key = VERSION_KEY.format(name=name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    cache.set(VERSION_KEY.format(name=name), uuid.uuid4().hex, timeout=None)
+
+
+def data_changed(name):
+    # Bump right away for the current worker, and again once the change is
+    # committed, so that a worker which rebuilt its copy in between from the
+    # not yet committed state does not keep serving it.
+    bump_version(name)
+    transaction.on_commit(lambda: bump_version(name))
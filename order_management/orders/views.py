@@ -1,16 +1,40 @@
+from abc import ABC, abstractmethod
+
 from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.pagination import PageNumberPagination
-from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+from rest_framework.exceptions import ValidationError, UnsupportedMediaType
+from rest_framework.settings import api_settings
 
 
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.utils import timezone 
 from django.db import transaction
-
-from .models import Product, Promotion, Order
-from .serializers import ProductSerializer, PromotionSerializer, OrderSerializer
+from django.db.models import F, Sum
+
+from . import admission, archive, catalogue, order_export, order_status, outbox, rendering, search, stock_stripes, streaming
+from .models import Product, Promotion, Order, OrderItem, StockStripe, DailySales, DailyProductSales, DailyPromotionSales
+from .serializers import (
+    ProductSerializer, PromotionSerializer, OrderSerializer, BatchOrderSerializer, OrderFilterSerializer,
+    ReportRangeSerializer, SalesFiguresSerializer, DailySalesReportSerializer, ProductSalesReportSerializer,
+    PromotionSalesReportSerializer, OrderStatusUpdateSerializer, ProductSearchSerializer,
+)
+from .promotion_index import promotion_index
+from .stock_stripes import stripe_index
+from .response_cache import cached_listing
+from .versions import PRODUCT, PROMOTION, data_changed
+from order_management.metrics import timer
+
+
+def get_paginator(request, pagination_class, cursor_pagination_class):
+    # ?pagination=cursor switches a listing to keyset pages: no COUNT(*) and no
+    # OFFSET scan, with opaque next/previous cursors instead of page numbers.
+    if request.query_params.get('pagination') == 'cursor':
+        return cursor_pagination_class()
+    return pagination_class()
 
 
 class ProductPagination(PageNumberPagination):
@@ -19,15 +43,46 @@ class ProductPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class ProductCursorPagination(CursorPagination):
+    page_size = 5 
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = 'id'
+
+
 class ProductView(APIView):
     permission_classes = [IsAdminUser]
 
     def get(self, request, *args, **kwargs):
-            products = Product.objects.all()
-            paginator = ProductPagination()
+        return cached_listing(request, PRODUCT, self.list_products)
+
+    def list_products(self, request):
+            if 'search' in request.query_params:
+                return self.search_products(request)
+
+            products = rendering.product_rows(Product.objects.with_stock().order_by('id'))
+            paginator = get_paginator(request, ProductPagination, ProductCursorPagination)
             result_page = paginator.paginate_queryset(products, request)
-            serializer = ProductSerializer(result_page, many=True)
-            return paginator.get_paginated_response(serializer.data)
+            with timer('serialization'):
+                data = rendering.product_encoder.encode_all(result_page)
+            return paginator.get_paginated_response(data)
+
+    def search_products(self, request):
+        # ?search=...&match=prefix|substring|words, best matches first; pages are numbered
+        serializer = ProductSearchSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        params = serializer.validated_data
+        product_ids = search.search_product_ids(params['search'], params['match'])
+        paginator = ProductPagination()
+        page_ids = list(paginator.paginate_queryset(product_ids, request))
+        rows = rendering.product_rows(Product.objects.with_stock().filter(id__in=page_ids))
+        products = {row['id']: row for row in rows}
+        # a product deleted since its id was found is left out
+        with timer('serialization'):
+            data = rendering.product_encoder.encode_all(products[product_id] for product_id in page_ids if product_id in products)
+        return paginator.get_paginated_response(data)
 
     def post(self, request, *args, **kwargs):
         serializer = ProductSerializer(data=request.data)
@@ -42,12 +97,49 @@ class ProductView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST) 
 
 
+class ProductImportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        # The body is read line by line instead of going through DRF's parsers, which
+        # would load all of it: either a raw text/csv or application/x-ndjson body, or
+        # a multipart upload in `file`, which Django spools to disk when it is large.
+        if request.content_type.startswith('multipart/form-data'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+            file_format = streaming.format_for_filename(upload.name)
+            lines = upload
+        else:
+            file_format = streaming.format_for_content_type(request.content_type)
+            lines = request.stream or []
+
+        if file_format is None:
+            raise UnsupportedMediaType(request.content_type, detail="Send a .csv, .ndjson or .jsonl file.")
+
+        report = catalogue.import_products(catalogue.read_rows(lines, file_format))
+        return Response(report, status=status.HTTP_200_OK)
+
+
+class ProductExportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, file_format, *args, **kwargs):
+        if file_format not in streaming.CONTENT_TYPES:
+            return Response({"detail": "Export format must be csv or ndjson."}, status=status.HTTP_404_NOT_FOUND)
+
+        response = StreamingHttpResponse(catalogue.export_products(file_format),
+                                         content_type=streaming.CONTENT_TYPES[file_format])
+        response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+        return response
+
+
 class UpdateProduct(APIView):
     permission_classes = [IsAdminUser] 
 
     def patch(self, request, id, *args, **kwargs):
         try:
-            product = Product.objects.get(id=id)
+            product = Product.objects.with_stock().get(id=id)
         except Product.DoesNotExist:
             return Response({"detail": "Product not found."}, status=status.HTTP_404_NOT_FOUND)
 
@@ -67,18 +159,28 @@ class PromotionPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+class PromotionCursorPagination(CursorPagination):
+    page_size = 5 
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = 'id'
+
 class PromotionView(APIView):
     permission_classes = [IsAdminUser]
 
     def get(self, request, *args, **kwargs):
+        return cached_listing(request, PROMOTION, self.list_promotions)
+
+    def list_promotions(self, request):
         now = timezone.now()
-        print(now) 
-        promotions = Promotion.objects.filter(start_date__lte=now, end_date__gte=now)
+        promotions = Promotion.objects.filter(start_date__lte=now, end_date__gte=now).order_by('id').prefetch_related('applicable_products')
 
-        paginator = PromotionPagination()
+        paginator = get_paginator(request, PromotionPagination, PromotionCursorPagination)
         result_page = paginator.paginate_queryset(promotions, request)
         serializer = PromotionSerializer(result_page, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        with timer('serialization'):
+            data = serializer.data
+        return paginator.get_paginated_response(data)
 
     def post(self, request, *args, **kwargs):
         serializer = PromotionSerializer(data=request.data)
@@ -119,67 +221,377 @@ class OrderPagination(PageNumberPagination):
     max_page_size = 100
 
 
-class OrderView(APIView):
+class OrderCursorPagination(CursorPagination):
+    page_size = 5
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+
+class OrderPlacementMixin:
+    """Stock checks and pricing shared by the single and batch order endpoints."""
+
+    def cart_quantities(self, items):
+        quantities = {}
+        for item in items:
+            quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+        return quantities
+
+    def fetch_products(self, product_ids, lock):
+        products = Product.objects.filter(id__in=product_ids)
+        if not lock:
+            return {product.id: product for product in products}
+
+        # One locking SELECT for all products involved. Rows are always locked in
+        # id order so that two requests sharing products cannot deadlock each other.
+        with timer('lock_wait'):
+            return {product.id: product for product in products.select_for_update().order_by('id')}
+
+    def check_cart(self, products, quantities):
+        for product_id, quantity in quantities.items():
+            product = products.get(product_id)
+            if product is None:
+                raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [f"Product with ID {product_id} does not exist."]})
+            if product.stock < quantity:
+                raise self.out_of_stock(product)
+
+    def out_of_stock(self, product):
+        return ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [f"Not enough stock for product {product.name}"]})
+
+    def price_after_max_deduction(self, product, promotions):
+        # (best deduction, id of the promotion granting it or None)
+        product_price = product.price
+        best_deduction = 0 
+        best_promotion = None
+        for type, value, promotion_id in promotions:
+            if type == Promotion.FIXED:
+                deduction = value
+            elif type == Promotion.PERCENTAGE:
+                deduction = (product_price * value / 100)
+
+            if deduction > best_deduction:
+                best_deduction, best_promotion = deduction, promotion_id
+        return best_deduction, best_promotion
+
+    def unit_prices(self, products, promotions, product_ids):
+        # product_id -> (unit price, deduction per unit, promotion id), never going below zero
+        prices = {}
+        for product_id in product_ids:
+            product = products[product_id]
+            max_deduction, promotion_id = self.price_after_max_deduction(product, promotions.get(product_id, []))
+            prices[product_id] = (product.price, min(max_deduction, product.price), promotion_id)
+        return prices
+
+    def cart_price(self, prices, quantities):
+        total_price = 0
+        for product_id, quantity in quantities.items():
+            unit_price, discount, _ = prices[product_id]
+            total_price += (unit_price - discount) * quantity
+        return total_price
+
+    def build_order_items(self, order, items, prices):
+        return [
+            OrderItem(
+                order=order,
+                product_id=item['product_id'],
+                quantity=item['quantity'],
+                unit_price=prices[item['product_id']][0],
+                discount=prices[item['product_id']][1],
+                promotion_id=prices[item['product_id']][2],
+            )
+            for item in items
+        ]
+
+
+class OrderView(OrderPlacementMixin, APIView):
+    # Inventory modes, selected per deployment with settings.ORDER_INVENTORY_MODE
+    LOCKING = 'locking'
+    CONDITIONAL = 'conditional'
 
     def post(self, request, *args, **kwargs):
+        # raises Throttled (429) before any validation or query when over a limit
+        ticket = admission.admit(request.user.id, admission.cart_product_ids(request.data))
+        try:
+            return self.place_order(request)
+        finally:
+            ticket.release()
+
+    def place_order(self, request):
         serializer = OrderSerializer(data=request.data)
+        with timer('validation'):
+            is_valid = serializer.is_valid()
 
-        if serializer.is_valid():
+        if is_valid:
             try:
                 return self.create_order(request,serializer.validated_data)
             except ValidationError as e:
-                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    def price_after_max_deduction(self, product): 
-        now = timezone.now()
-        applicable_promotions = product.promotions.filter(
-            start_date__lte=now, 
-            end_date__gte=now,
-        )
-        product_price = product.price
-        best_deduction = 0 
-        for promo in applicable_promotions:
-            type = promo.discount_type 
-            value = promo.value
-
-            if type == 'fixed':
-                deduction = value
-            elif type == 'percentage':
-                deduction = (product_price * value / 100)
-
-            best_deduction = max(best_deduction, deduction) 
-        return best_deduction
+    def reserve_with_locks(self, quantities):
+        striped = stripe_index.stripe_counts(quantities)
+        unstriped = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in striped}
+
+        products = self.fetch_products(unstriped.keys(), lock=True)
+        self.check_cart(products, unstriped)
+        for product_id, quantity in unstriped.items():
+            products[product_id].stock -= quantity
+        Product.objects.bulk_update(products.values(), ['stock'])
+
+        if striped:
+            products.update(self.fetch_products(striped.keys(), lock=False))
+            self.take_from_stripes(products, quantities, striped)
+        return products
+
+    def reserve_conditionally(self, quantities):
+        # No row is read under lock: each UPDATE only succeeds while enough stock
+        # is left, so concurrent orders for a hot product never oversell it.
+        striped = stripe_index.stripe_counts(quantities)
+        unstriped = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in striped}
+
+        products = self.fetch_products(quantities.keys(), lock=False)
+        self.check_cart(products, unstriped)
+        for product_id in sorted(unstriped):
+            quantity = unstriped[product_id]
+            updated = Product.objects.filter(id=product_id, stock__gte=quantity).update(stock=F('stock') - quantity)
+            if not updated:
+                raise self.out_of_stock(products[product_id])
+
+        self.take_from_stripes(products, quantities, striped)
+        return products
+
+    def take_from_stripes(self, products, quantities, striped):
+        # Striped products are never locked as a row, whatever the inventory mode.
+        for product_id in sorted(striped):
+            if product_id not in products:
+                raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [f"Product with ID {product_id} does not exist."]})
+            if not stock_stripes.take(product_id, quantities[product_id], striped[product_id]):
+                raise self.out_of_stock(products[product_id])
 
     def create_order(self, request, validated_data):
         items = validated_data['items']
-        total_price = 0
+        quantities = self.cart_quantities(items)
 
         with transaction.atomic():
-            for item in items:
-                product = Product.objects.select_for_update().get(id=item['product_id'])
-                product.stock -= item['quantity']
-                product.save()
-                max_deduction = self.price_after_max_deduction(product)
-                total_price += min(product.price - max_deduction, 0) * item['quantity']
-            
+            if settings.ORDER_INVENTORY_MODE == self.CONDITIONAL:
+                products = self.reserve_conditionally(quantities)
+            else:
+                products = self.reserve_with_locks(quantities)
+
+            with timer('pricing'):
+                promotions = promotion_index.active_promotions(quantities.keys())
+                prices = self.unit_prices(products, promotions, quantities.keys())
+                total_price = self.cart_price(prices, quantities)
             order = Order.objects.create(
                 user_id=request.user,
                 items=items,
                 total_price=total_price,
             )
+            OrderItem.objects.bulk_create(self.build_order_items(order, items, prices))
+            outbox.publish(outbox.ORDER_CREATED, outbox.order_created_payload(order))
+            data_changed(PRODUCT)
         
+        with timer('serialization'):
+            data = OrderSerializer(order).data
         return Response({
             'message': 'Order placed successfully.',
-            'data': OrderSerializer(order).data
+            'data': data
         }, status=status.HTTP_201_CREATED)
 
     def get(self, request, *args, **kwargs): 
-        orders = Order.objects.filter(user_id=request.user)
+        # ?archived=true pages through the orders moved to the archive by archive_orders
+        if request.query_params.get('archived') == 'true':
+            return self.list_archived_orders(request)
+
+        # in order of placement; OrderCursorPagination pages go newest first
+        orders = rendering.order_rows(Order.objects.filter(user_id=request.user).order_by('id'))
         
-        paginator = OrderPagination()
+        paginator = get_paginator(request, OrderPagination, OrderCursorPagination)
         result_page = paginator.paginate_queryset(orders, request)
+        items = rendering.order_items([order['id'] for order in result_page])
         
-        serializer = OrderSerializer(result_page, many=True)
+        with timer('serialization'):
+            data = rendering.encode_orders(result_page, items)
         
-        return paginator.get_paginated_response(serializer.data)
\ No newline at end of file
+        return paginator.get_paginated_response(data)
+
+    def list_archived_orders(self, request):
+        paginator = get_paginator(request, OrderPagination, OrderCursorPagination)
+        result_page = paginator.paginate_queryset(archive.archived_orders(request.user), request)
+        with timer('serialization'):
+            data = archive.decode_orders(result_page)
+        return paginator.get_paginated_response(data)
+
+
+class BatchOrderView(OrderPlacementMixin, APIView):
+
+    def post(self, request, *args, **kwargs):
+        serializer = BatchOrderSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        orders = serializer.validated_data['orders']
+        results = [None] * len(orders)
+        carts = {}
+        with timer('validation'):
+            for index, data in enumerate(orders):
+                order_serializer = OrderSerializer(data=data)
+                if order_serializer.is_valid():
+                    items = order_serializer.validated_data['items']
+                    carts[index] = (items, self.cart_quantities(items))
+                else:
+                    results[index] = {'index': index, 'status': 'failed', 'errors': order_serializer.errors}
+
+        product_ids = set()
+        for items, quantities in carts.values():
+            product_ids.update(quantities)
+
+        created = []
+        with transaction.atomic():
+            # Batches always take row locks, once per product for the whole batch,
+            # whatever settings.ORDER_INVENTORY_MODE says for single orders.
+            products = self.fetch_products(product_ids, lock=True)
+            # striped products are checked against the sum of their stripes
+            stripes = stock_stripes.lock_stripes(stripe_index.stripe_counts(products.keys()))
+            for product_id, product_stripes in stripes.items():
+                products[product_id].stock = sum(stripe.stock for stripe in product_stripes)
+            with timer('pricing'):
+                promotions = promotion_index.active_promotions(product_ids)
+                prices = self.unit_prices(products, promotions, product_ids & products.keys())
+
+            for index, (items, quantities) in carts.items():
+                try:
+                    self.check_cart(products, quantities)
+                except ValidationError as e:
+                    results[index] = {'index': index, 'status': 'failed', 'errors': e.detail}
+                    continue
+
+                for product_id, quantity in quantities.items():
+                    products[product_id].stock -= quantity
+                created.append((index, Order(
+                    user_id=request.user,
+                    items=items,
+                    total_price=self.cart_price(prices, quantities),
+                )))
+
+            if created:
+                touched = {product_id for index, _ in created for product_id in carts[index][1]}
+                for product_id in sorted(touched & stripes.keys()):
+                    product_stripes = stripes[product_id]
+                    stock_stripes.deduct(product_stripes, sum(stripe.stock for stripe in product_stripes) - products[product_id].stock)
+                StockStripe.objects.bulk_update([stripe for product_id in sorted(touched & stripes.keys()) for stripe in stripes[product_id]], ['stock'])
+                Product.objects.bulk_update([products[product_id] for product_id in sorted(touched - stripes.keys())], ['stock'])
+                data_changed(PRODUCT)
+                Order.objects.bulk_create([order for _, order in created])
+                OrderItem.objects.bulk_create([
+                    order_item
+                    for index, order in created
+                    for order_item in self.build_order_items(order, carts[index][0], prices)
+                ])
+                outbox.publish_many(outbox.ORDER_CREATED, [outbox.order_created_payload(order) for _, order in created])
+
+        with timer('serialization'):
+            for index, order in created:
+                results[index] = {'index': index, 'status': 'created', 'id': order.id, 'data': OrderSerializer(order).data}
+
+        return Response({
+            'created': len(created),
+            'failed': len(orders) - len(created),
+            'results': results,
+        }, status=status.HTTP_200_OK)
+
+
+class OrderExportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, file_format, *args, **kwargs):
+        if file_format not in streaming.CONTENT_TYPES:
+            return Response({"detail": "Export format must be csv or ndjson."}, status=status.HTTP_404_NOT_FOUND)
+
+        serializer = OrderFilterSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(order_export.export_orders(file_format, serializer.validated_data),
+                                         content_type=streaming.CONTENT_TYPES[file_format])
+        response['Content-Disposition'] = f'attachment; filename="orders.{file_format}"'
+        return response
+
+
+class OrderStatusView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = OrderStatusUpdateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        limit = OrderStatusUpdateSerializer.MAX_ORDERS
+        with transaction.atomic():
+            if 'ids' in data:
+                order_ids = data['ids']
+            else:
+                order_ids = list(order_export.filtered_orders(**data['filter']).values_list('id', flat=True)[:limit + 1])
+                if len(order_ids) > limit:
+                    return Response({'filter': [f"Matches more than {limit} orders, narrow it down."]},
+                                    status=status.HTTP_400_BAD_REQUEST)
+            updated, skipped = order_status.change_status(order_ids, data['status'])
+
+        return Response({
+            'status': data['status'],
+            'updated': len(updated),
+            'skipped': skipped,
+        }, status=status.HTTP_200_OK)
+
+
+class SalesReportView(ABC, APIView):
+    """Base of the sales reports, answered from the rollups in orders/rollups.py."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        serializer = ReportRangeSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        params = serializer.validated_data
+        return Response({
+            'start': params['start'],
+            'end': params['end'],
+            **self.report(params),
+        }, status=status.HTTP_200_OK)
+
+    @abstractmethod
+    def report(self, params):
+        """The report's figures for the validated `params`, merged into the response."""
+
+
+def figure_sums():
+    return {figure: Sum(figure) for figure in ('orders', 'units', 'revenue', 'discount')}
+
+
+class DailySalesReportView(SalesReportView):
+
+    def report(self, params):
+        days = DailySales.objects.filter(day__range=(params['start'], params['end'])).order_by('day')
+        totals = days.aggregate(**figure_sums())
+        return {
+            'totals': SalesFiguresSerializer({figure: value or 0 for figure, value in totals.items()}).data,
+            'results': DailySalesReportSerializer(days, many=True).data,
+        }
+
+
+class ProductSalesReportView(SalesReportView):
+
+    def report(self, params):
+        rows = DailyProductSales.objects.filter(day__range=(params['start'], params['end']))
+        products = rows.values('product_id', 'product__name').annotate(**figure_sums()).order_by('-revenue', 'product_id')[:params['limit']]
+        return {'results': ProductSalesReportSerializer(products, many=True).data}
+
+
+class PromotionSalesReportView(SalesReportView):
+
+    def report(self, params):
+        rows = DailyPromotionSales.objects.filter(day__range=(params['start'], params['end']))
+        promotions = rows.values('promotion_id', 'promotion__name').annotate(**figure_sums()).order_by('-revenue', 'promotion_id')[:params['limit']]
+        return {'results': PromotionSalesReportSerializer(promotions, many=True).data}
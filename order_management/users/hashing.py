@@ -0,0 +1,125 @@
+"""
+Bounded password hashing.
+
+BoundedPBKDF2PasswordHasher only hashes (login, registration, password
+changes) while it holds one of settings.PASSWORD_HASHING_CONCURRENCY slots
+shared by all workers of the host, so that a burst of logins keeps at most that
+many workers and cores busy and leaves the others to order traffic. At most
+settings.PASSWORD_HASHING_QUEUE_SIZE more hashes wait for a slot; beyond that
+the request fails fast with 503 and Retry-After instead of tying up one more
+worker. The time spent waiting is recorded in the password_hashing_queue_seconds
+histogram.
+
+Slots, and places in the queue, are flocks of files in
+settings.PASSWORD_HASHING_LOCK_DIR, which the kernel releases if a worker dies
+holding them. Each acquisition opens the file anew, so threads of one worker
+exclude each other too.
+
+The hasher's iteration count is settings.PASSWORD_HASH_ITERATIONS, never below
+MIN_ITERATIONS. Django re-hashes a password on the next successful login when
+its iterations differ, so changing the setting moves existing users over.
+"""
+import fcntl
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from order_management.metrics import registry
+
+
+# OWASP's lower bound for PBKDF2-HMAC-SHA256 (2023)
+MIN_ITERATIONS = 600_000
+
+SLOT = 'slot'
+PLACE = 'place'
+
+
+class PasswordHashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins at once, try again shortly.'
+    default_code = 'password_hashing_busy'
+    # seconds, sent as Retry-After by DRF's exception handler
+    wait = 1
+
+
+def lock_path(kind, index):
+    return os.path.join(settings.PASSWORD_HASHING_LOCK_DIR, f'{kind}-{index}.lock')
+
+
+def lock(kind, index, blocking=False):
+    """A descriptor holding the flock of the `index`th `kind` file, or None if it is taken; close it to release."""
+    os.makedirs(settings.PASSWORD_HASHING_LOCK_DIR, exist_ok=True)
+    fd = os.open(lock_path(kind, index), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def lock_any(kind, count):
+    """(index, descriptor) of the first free one of `count` `kind` files, or None when all are taken."""
+    for index in range(count):
+        fd = lock(kind, index)
+        if fd is not None:
+            return index, fd
+    return None
+
+
+class HashingSlots:
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def run(self, operation, function, *args):
+        # verify() hashes with encode(), which then runs in the slot already taken
+        if getattr(self._local, 'inside', False):
+            return function(*args)
+
+        concurrency = settings.PASSWORD_HASHING_CONCURRENCY
+        submitted = time.perf_counter()
+        place = lock_any(PLACE, concurrency + settings.PASSWORD_HASHING_QUEUE_SIZE)
+        if place is None:
+            registry.increment('password_hashing_rejections', (('operation', operation),))
+            raise PasswordHashingBusy()
+
+        index, place_fd = place
+        try:
+            slot = lock_any(SLOT, concurrency)
+            # queued: wait for the slot of this place
+            slot_fd = slot[1] if slot else lock(SLOT, index % concurrency, blocking=True)
+            try:
+                registry.observe('password_hashing_queue_seconds', (('operation', operation),), time.perf_counter() - submitted)
+                self._local.inside = True
+                try:
+                    return function(*args)
+                finally:
+                    self._local.inside = False
+            finally:
+                os.close(slot_fd)
+        finally:
+            os.close(place_fd)
+
+
+hashing_slots = HashingSlots()
+
+
+class BoundedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    # same algorithm name, so existing pbkdf2_sha256 hashes verify as before
+    algorithm = 'pbkdf2_sha256'
+
+    @property
+    def iterations(self):
+        return max(settings.PASSWORD_HASH_ITERATIONS, MIN_ITERATIONS)
+
+    def encode(self, password, salt, iterations=None):
+        return hashing_slots.run('encode', super().encode, password, salt, iterations)
+
+    def verify(self, password, encoded):
+        return hashing_slots.run('verify', super().verify, password, encoded)
@@ -1,3 +1,104 @@
-from django.test import TestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+from rest_framework import status 
+from rest_framework_simplejwt.tokens import RefreshToken
+from unittest import mock
 
-# Create your tests here.
+import os
+import time
+import pytest 
+
+from order_management.testing import assert_query_budget
+
+from .hashing import MIN_ITERATIONS, PLACE, lock_any
+from .user_cache import user_cache
+
+
+def seed_users(size): 
+    start = User.objects.count()
+    User.objects.bulk_create([User(username=f"user_{start + i}") for i in range(size)])
+
+
+def endpoint_request(endpoint, client, user): 
+    username = f"new_{User.objects.count()}"
+    return {
+        "login": lambda: client.post("/login/", {"username": "customer", "password": "customer123"}, format="json"),
+        "token_refresh": lambda: client.post("/api/token/refresh/", {"refresh": str(RefreshToken.for_user(user))}, format="json"),
+        "register": lambda: client.post("/register/", {"username": username, "email": "new@example.com", "password": "new12345"}, format="json"),
+    }[endpoint]
+
+QUERY_BUDGETS = {
+    "login": 1,
+    "token_refresh": 1,
+    "register": 2,
+}
+
+@pytest.mark.django_db 
+@pytest.mark.parametrize("endpoint", sorted(QUERY_BUDGETS)) 
+def test_endpoint_query_budget(endpoint): 
+    user = User.objects.create_user(username="customer", password="customer123")
+    client = APIClient() 
+
+    def prepare(size):
+        seed_users(size)
+        return endpoint_request(endpoint, client, user)
+
+    assert_query_budget(QUERY_BUDGETS[endpoint], (1, 10, 100), prepare)
+
+@pytest.mark.django_db 
+def test_authentication_uses_user_cache(settings): 
+    user = User.objects.create_user(username="customer", password="customer123")
+    client = APIClient() 
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+
+    client.get("/orders/")
+    with CaptureQueriesContext(connection) as queries: 
+        assert client.get("/orders/").status_code == status.HTTP_200_OK
+    assert not any("auth_user" in query["sql"] for query in queries.captured_queries)
+
+    # deactivating through the ORM drops the cached user right away
+    user.is_active = False
+    user.save()
+    assert client.get("/orders/").status_code == status.HTTP_401_UNAUTHORIZED
+
+    # changes that bypass signals are picked up once the entry expires
+    User.objects.filter(id=user.id).update(is_active=True)
+    user_cache.put(user.id, User.objects.get(id=user.id))
+    User.objects.filter(id=user.id).update(is_active=False)
+    assert client.get("/orders/").status_code == status.HTTP_200_OK
+    with mock.patch("users.user_cache.time.monotonic", return_value=time.monotonic() + settings.USER_CACHE_TTL + 1): 
+        assert client.get("/orders/").status_code == status.HTTP_401_UNAUTHORIZED
+
+@pytest.mark.django_db 
+def test_login_rehashes_to_configured_iterations(settings): 
+    User.objects.create_user(username="customer", password="customer123")
+    client = APIClient() 
+
+    settings.PASSWORD_HASH_ITERATIONS = 600_000
+    assert client.post("/login/", {"username": "customer", "password": "customer123"}, format="json").status_code == status.HTTP_200_OK
+    assert User.objects.get(username="customer").password.startswith("pbkdf2_sha256$600000$")
+
+    # never below the policy minimum
+    settings.PASSWORD_HASH_ITERATIONS = 1000
+    assert client.post("/login/", {"username": "customer", "password": "customer123"}, format="json").status_code == status.HTTP_200_OK
+    assert User.objects.get(username="customer").password.startswith(f"pbkdf2_sha256${MIN_ITERATIONS}$")
+
+@pytest.mark.django_db 
+def test_login_fails_fast_when_hashing_is_busy(settings): 
+    User.objects.create_user(username="customer", password="customer123")
+    client = APIClient() 
+
+    # the places of other workers hashing or waiting, held as they would be from another process
+    places = settings.PASSWORD_HASHING_CONCURRENCY + settings.PASSWORD_HASHING_QUEUE_SIZE
+    held = [lock_any(PLACE, places) for _ in range(places)]
+    try:
+        response = client.post("/login/", {"username": "customer", "password": "customer123"}, format="json")
+    finally:
+        for index, fd in held:
+            os.close(fd)
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response["Retry-After"] == "1"
+
+    assert client.post("/login/", {"username": "customer", "password": "customer123"}, format="json").status_code == status.HTTP_200_OK
@@ -0,0 +1,57 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class UserCache:
+    """
+    Per-worker LRU cache of authenticated users, each kept for at most
+    settings.USER_CACHE_TTL seconds.
+
+    Saving or deleting a user drops it from the cache of the worker that made
+    the change; the others see the change once their entry expires, so a
+    deactivation takes effect everywhere within USER_CACHE_TTL seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # str(user id) -> (expires at, user), least recently used first
+        self._users = OrderedDict()
+
+    def get(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            entry = self._users.get(key)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at <= time.monotonic():
+                del self._users[key]
+                return None
+            self._users.move_to_end(key)
+        # each request gets its own instance, so nothing set on one leaks into another
+        return copy.copy(user)
+
+    def put(self, user_id, user):
+        if settings.USER_CACHE_TTL <= 0:
+            return
+        key = str(user_id)
+        with self._lock:
+            self._users[key] = (time.monotonic() + settings.USER_CACHE_TTL, copy.copy(user))
+            self._users.move_to_end(key)
+            while len(self._users) > settings.USER_CACHE_MAX_SIZE:
+                self._users.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+user_cache = UserCache()